@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+
+import StringIO
+import hashlib
+import threading
+
+from PIL import Image
+from PIL import ImageCms
+
+
+# "print-rendering-intent" keywords, as in the PWG RenderingIntent field, to
+# ImageCms (intent, flags).
+INTENTS = {
+  'perceptual': (ImageCms.INTENT_PERCEPTUAL, 0),
+  'relative': (ImageCms.INTENT_RELATIVE_COLORIMETRIC, 0),
+  'relative-bpc': (
+    ImageCms.INTENT_RELATIVE_COLORIMETRIC,
+    ImageCms.FLAGS['BLACKPOINTCOMPENSATION']),
+  'saturation': (ImageCms.INTENT_SATURATION, 0),
+  'absolute': (ImageCms.INTENT_ABSOLUTE_COLORIMETRIC, 0),
+}
+
+DEFAULT_INTENT = 'perceptual'
+
+# Profile of images that don't embed one, and of printers not given one.
+SRGB = 'sRGB'
+
+# Rows converted at a time.
+BAND_ROWS = 256
+
+# PIL mode of the pixels of an ICC profile color space.
+PROFILE_MODES = {'RGB': 'RGB', 'CMYK': 'CMYK', 'GRAY': 'L'}
+
+
+def profile_key(profile):
+  """Cache key of a profile: SRGB, a file path, or embedded ICC bytes."""
+  if profile is None or profile == SRGB:
+    return SRGB
+  if '\0' in profile:
+    return hashlib.sha1(profile).hexdigest()
+  return profile
+
+
+def open_profile(profile):
+  if profile is None or profile == SRGB:
+    return ImageCms.ImageCmsProfile(ImageCms.createProfile('sRGB'))
+  if '\0' in profile:
+    return ImageCms.ImageCmsProfile(StringIO.StringIO(profile))
+  return ImageCms.ImageCmsProfile(profile)
+
+
+def profile_mode(profile):
+  return PROFILE_MODES.get(profile.profile.xcolor_space.strip(), 'RGB')
+
+
+class TransformCache:
+  """ImageCms transforms by (source, target, intent), built once.
+
+  Each transform takes and makes pixels in the PIL modes of its profiles,
+  kept with it as (transform, in_mode, out_mode).
+  """
+
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.transforms = {}
+    self.hits = 0
+    self.misses = 0
+
+  def get(self, source, target, intent):
+    if intent not in INTENTS:
+      raise ValueError('Unknown rendering intent: {}'.format(intent))
+    key = (profile_key(source), profile_key(target), intent)
+    with self.lock:
+      entry = self.transforms.get(key)
+      if entry is not None:
+        self.hits += 1
+        return entry
+
+    rendering_intent, flags = INTENTS[intent]
+    try:
+      input_profile = open_profile(source)
+      output_profile = open_profile(target)
+      in_mode = profile_mode(input_profile)
+      out_mode = profile_mode(output_profile)
+      entry = (
+          ImageCms.buildTransform(
+              input_profile,
+              output_profile,
+              in_mode,
+              out_mode,
+              rendering_intent,
+              flags),
+          in_mode,
+          out_mode)
+    except (IOError, ImageCms.PyCMSError) as error:
+      raise ValueError('Color transform failed: {}'.format(error))
+    with self.lock:
+      self.misses += 1
+      self.transforms[key] = entry
+    return entry
+
+
+TRANSFORMS = TransformCache()
+
+
+def source_profile(img):
+  """The ICC profile embedded in an image, or SRGB."""
+  return img.info.get('icc_profile') or SRGB
+
+
+def convert(img, mode, target=SRGB, intent=DEFAULT_INTENT, source=None):
+  """Convert a PIL image to mode in the target color space.
+
+  Images without an embedded profile are taken to be sRGB, so converting
+  them to sRGB is a plain Image.convert. Otherwise the cached transform is
+  applied a band of rows at a time. A target of None means device color,
+  with no color management at all.
+  """
+  if source is None:
+    source = source_profile(img)
+  if target is None or profile_key(source) == profile_key(target):
+    return img if img.mode == mode else img.convert(mode)
+
+  transform, in_mode, out_mode = TRANSFORMS.get(source, target, intent)
+  if img.mode != in_mode:
+    img = img.convert(in_mode)
+  if img.height <= BAND_ROWS:
+    output = ImageCms.applyTransform(img, transform)
+  else:
+    output = Image.new(out_mode, img.size)
+    for y in xrange(0, img.height, BAND_ROWS):
+      box = (0, y, img.width, min(y + BAND_ROWS, img.height))
+      output.paste(ImageCms.applyTransform(img.crop(box), transform), box[:2])
+  return output if output.mode == mode else output.convert(mode)
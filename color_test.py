@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+
+import unittest
+
+from PIL import Image
+from PIL import ImageChops
+from PIL import ImageCms
+
+import color
+
+
+def srgb_icc():
+  return ImageCms.ImageCmsProfile(ImageCms.createProfile('sRGB')).tobytes()
+
+
+class TestColor(unittest.TestCase):
+
+  def test_convert_without_profile(self):
+    img = Image.new('L', (8, 8), 128)
+    self.assertEqual(
+        color.convert(img, 'RGB').tobytes(), img.convert('RGB').tobytes())
+    rgb = img.convert('RGB')
+    self.assertIs(color.convert(rgb, 'RGB', 'sRGB', 'saturation'), rgb)
+    self.assertIs(color.convert(rgb, 'RGB', None), rgb)
+
+  def test_convert_embedded_profile(self):
+    cache = color.TRANSFORMS = color.TransformCache()
+    img = Image.new('RGB', (20, 600), (200, 40, 90))
+    img.info['icc_profile'] = srgb_icc()
+
+    for intent in ('perceptual', 'perceptual', 'relative-bpc'):
+      converted = color.convert(img, 'RGB', intent=intent)
+      self.assertEqual(converted.size, img.size)
+      # sRGB to sRGB, within rounding.
+      self.assertLessEqual(
+          max(ImageChops.difference(converted, img).getextrema())[1], 2)
+    self.assertEqual((cache.hits, cache.misses), (1, 2))
+
+    self.assertEqual(color.convert(img, 'L', intent='perceptual').mode, 'L')
+    self.assertEqual(cache.hits, 2)
+
+  def test_unknown_intent(self):
+    img = Image.new('RGB', (1, 1))
+    img.info['icc_profile'] = srgb_icc()
+    with self.assertRaises(ValueError):
+      color.convert(img, 'RGB', intent='vivid')
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+
+import os
+
+import raster
+from print import DEFAULT_DOCUMENT_FORMAT
+from print import PRINT_QUALITY_DRAFT
+from print import PRINT_QUALITY_NORMAL
+
+
+# Document formats whose pages can be reduced, see raster.reduce_file.
+REDUCIBLE_FORMATS = ('image/pwg-raster', 'image/urf')
+
+
+class DegradePolicy:
+  """When a printer's backlog is too long, and what jobs give up to drain it.
+
+  The backlog is the number of jobs spooled for the printer, and the
+  seconds their documents take to upload at the observed throughput. Past
+  either threshold, jobs go as draft, and raster documents are resampled
+  down to resolution and made gray, as configured.
+  """
+
+  def __init__(
+      self,
+      max_queued_jobs=None,
+      max_drain_seconds=None,
+      draft=True,
+      resolution=None,
+      grayscale=False,
+      ):
+    self.max_queued_jobs = max_queued_jobs
+    self.max_drain_seconds = max_drain_seconds
+    self.draft = draft
+    self.resolution = resolution
+    self.grayscale = grayscale
+
+  def backed_up(self, queued_jobs, drain_seconds):
+    return (
+        (self.max_queued_jobs is not None
+         and queued_jobs > self.max_queued_jobs)
+        or (self.max_drain_seconds is not None
+            and drain_seconds > self.max_drain_seconds))
+
+  def degrade(self, document_path, options):
+    """Degrade a spooled document in place, and the send_job options for it.
+
+    Returns the changes made, like ['draft', '300dpi', 'grayscale'].
+    Documents that can't be reduced are left as they are.
+    """
+    changes = []
+    quality = options.get('print_quality', PRINT_QUALITY_NORMAL)
+    if self.draft and quality > PRINT_QUALITY_DRAFT:
+      options['print_quality'] = PRINT_QUALITY_DRAFT
+      changes.append('draft')
+
+    document_format = options.get('document_format', DEFAULT_DOCUMENT_FORMAT)
+    if document_format not in REDUCIBLE_FORMATS or not (
+        changes or self.resolution or self.grayscale):
+      return changes
+
+    # Page headers carry the print quality too.
+    tmp_path = document_path + '.tmp'
+    try:
+      reduced = raster.reduce_file(
+          document_path,
+          tmp_path,
+          resolution=self.resolution,
+          grayscale=self.grayscale,
+          quality=PRINT_QUALITY_DRAFT if self.draft else None)
+    except ValueError:
+      if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+      return changes
+    os.rename(tmp_path, document_path)
+    return changes + [
+        change for change in reduced if not change.startswith('quality')]
@@ -0,0 +1,284 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+from __future__ import print_function
+
+import argparse
+import os
+import threading
+import time
+
+from pkipplib import pkipplib
+
+from print import get_attributes
+from print import get_printer_attribute
+from print import get_status
+from print import get_status_code
+from print import guess_document_format
+from print import send_job
+
+
+# server-error-service-unavailable, server-error-not-accepting-jobs and
+# server-error-busy [RFC2911] 13.1.5: the printer may take the job later,
+# or another printer of the pool may take it now.
+RETRYABLE_STATUS_CODES = (0x0502, 0x0506, 0x0507)
+
+class PrinterStatus:
+  """What the dispatcher knows about one printer of the pool."""
+
+  # Weight of the latest observation in the moving averages.
+  SMOOTHING = 0.3
+
+  def __init__(self, url, throughput=1024 * 1024, job_seconds=10.0):
+    self.url = url
+    self.state = pkipplib.IPP_PRINTER_IDLE
+    self.queued_job_count = 0
+    # Time of the last successful Get-Printer-Attributes, 0 if never.
+    self.refreshed = 0
+    # Observed upload throughput, bytes/second.
+    self.throughput = throughput
+    # Observed seconds the printer takes per queued job.
+    self.job_seconds = job_seconds
+    # Jobs routed to the printer and not yet sent.
+    self.queue = []
+    # Jobs being sent to the printer.
+    self.in_flight = 0
+    self.jobs_sent = 0
+    self.bytes_sent = 0
+
+  @property
+  def stopped(self):
+    return self.state == pkipplib.IPP_PRINTER_STOPPED
+
+  def backlog(self):
+    """Jobs ahead of a newly routed job."""
+    return max(self.queued_job_count, self.in_flight) + len(self.queue)
+
+  def expected_completion_time(self, job_bytes):
+    """Seconds until a job of the given size would be done printing."""
+    return (
+        self.backlog() * self.job_seconds
+        + job_bytes / float(self.throughput))
+
+  def observe(self, job_bytes, seconds):
+    """Fold a completed send into the throughput estimates."""
+    seconds = max(seconds, 1e-3)
+    self.throughput += self.SMOOTHING * (job_bytes / seconds - self.throughput)
+    self.job_seconds += self.SMOOTHING * (seconds - self.job_seconds)
+    self.jobs_sent += 1
+    self.bytes_sent += job_bytes
+
+
+class DispatchJob:
+
+  def __init__(self, path, options):
+    self.path = path
+    self.size = os.path.getsize(path)
+    # Keyword arguments to send_job.
+    self.options = options
+    self.url = None
+    self.response = None
+    # Why the job failed, None while it hasn't.
+    self.error = None
+    self.attempts = 0
+    self.done = threading.Event()
+
+
+class Dispatcher:
+  """Routes jobs across a pool of equivalent printers.
+
+  Each job goes to the printer expected to finish it first, given its cached
+  "printer-state" and "queued-job-count" and the throughput observed while
+  sending to it. No printer is given more than `max_queue_depth` jobs ahead
+  of time, and jobs waiting for a printer that stops are routed elsewhere.
+  Jobs the printer can't take now are retried, up to `max_attempts` sends;
+  jobs it refuses fail.
+  """
+
+  def __init__(
+      self,
+      urls,
+      max_queue_depth=2,
+      refresh_interval=5.0,
+      max_attempts=5,
+      sender=send_job,
+      fetcher=get_attributes,
+      ):
+    self.printers = [PrinterStatus(url) for url in urls]
+    self.max_queue_depth = max_queue_depth
+    self.refresh_interval = refresh_interval
+    self.max_attempts = max_attempts
+    self.sender = sender
+    self.fetcher = fetcher
+
+    self.condition = threading.Condition()
+    # Jobs not yet routed to a printer.
+    self.pending = []
+    self.stopping = False
+    self.threads = []
+
+  def refresh(self, printer):
+    """Update the cached state of a printer."""
+    response = self.fetcher(printer.url, ['printer-state', 'queued-job-count'])
+    state = get_printer_attribute(response, 'printer-state')
+    queued_job_count = get_printer_attribute(response, 'queued-job-count')
+    with self.condition:
+      if not state:
+        # Unreachable, as good as stopped.
+        printer.state = pkipplib.IPP_PRINTER_STOPPED
+      else:
+        printer.state = state[0]
+        printer.refreshed = time.time()
+      if queued_job_count:
+        printer.queued_job_count = queued_job_count[0]
+      if printer.stopped:
+        self.reroute(printer)
+      self.condition.notify_all()
+
+  def reroute(self, printer):
+    """Hand back the jobs waiting for a printer to be routed again."""
+    self.pending[:0] = printer.queue
+    printer.queue = []
+
+  def choose(self, job):
+    """The printer a job should go to now, or None to keep it waiting."""
+    candidates = [
+        printer for printer in self.printers
+        if not printer.stopped and len(printer.queue) < self.max_queue_depth
+        ]
+    if not candidates:
+      return None
+    return min(
+        candidates,
+        key=lambda printer: printer.expected_completion_time(job.size))
+
+  def submit(self, path, **options):
+    job = DispatchJob(path, options)
+    with self.condition:
+      self.pending.append(job)
+      self.condition.notify_all()
+    return job
+
+  def route(self):
+    while True:
+      with self.condition:
+        while not self.stopping:
+          printer = self.pending and self.choose(self.pending[0])
+          if printer:
+            break
+          self.condition.wait(self.refresh_interval)
+        if self.stopping:
+          return
+        job = self.pending.pop(0)
+        job.url = printer.url
+        printer.queue.append(job)
+        self.condition.notify_all()
+
+  def send(self, printer):
+    while True:
+      with self.condition:
+        while not self.stopping and (printer.stopped or not printer.queue):
+          self.condition.wait(self.refresh_interval)
+        if self.stopping:
+          return
+        job = printer.queue.pop(0)
+        job.attempts += 1
+        printer.in_flight += 1
+
+      start = time.time()
+      try:
+        with open(job.path, 'rb') as data_file:
+          response = self.sender(printer.url, data_file, **job.options)
+      except (IOError, ValueError) as error:
+        # Unreadable document, or options that don't fit it.
+        response, status, error_message = None, None, str(error)
+        retryable = False
+      else:
+        status = get_status_code(response)
+        if status is None:
+          error_message = 'transport error'
+        else:
+          error_message = (
+              get_status(response) or 'status 0x{:04x}'.format(status))
+        retryable = status is None or status in RETRYABLE_STATUS_CODES
+      elapsed = time.time() - start
+
+      with self.condition:
+        printer.in_flight -= 1
+        if status is not None and status < 0x0100:
+          printer.observe(job.size, elapsed)
+          printer.queued_job_count += 1
+          job.response = response
+          job.done.set()
+        elif retryable and job.attempts < self.max_attempts:
+          # Retry elsewhere, and find out what's up with this printer.
+          self.pending.insert(0, job)
+          printer.state = pkipplib.IPP_PRINTER_STOPPED
+          self.reroute(printer)
+        else:
+          job.response = response
+          job.error = error_message
+          job.done.set()
+        self.condition.notify_all()
+
+  def monitor(self, printer):
+    while True:
+      self.refresh(printer)
+      with self.condition:
+        if not self.stopping:
+          self.condition.wait(self.refresh_interval)
+        if self.stopping:
+          return
+
+  def start(self):
+    targets = [(self.route, ())]
+    for printer in self.printers:
+      targets.append((self.monitor, (printer,)))
+      targets.append((self.send, (printer,)))
+    for target, args in targets:
+      thread = threading.Thread(target=target, args=args)
+      thread.daemon = True
+      thread.start()
+      self.threads.append(thread)
+
+  def stop(self):
+    with self.condition:
+      self.stopping = True
+      self.condition.notify_all()
+    for thread in self.threads:
+      thread.join()
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(
+      description='Send documents across a pool of equivalent printers.')
+
+  parser.add_argument('inputs', nargs='+', help='Encoded documents')
+  parser.add_argument(
+      '--url', action='append', required=True, dest='urls',
+      help='Printer URL, repeated for each printer of the pool')
+  parser.add_argument(
+      '--max-queue-depth', type=int, default=2,
+      help='Jobs routed ahead of time to any one printer')
+
+  args = parser.parse_args()
+
+  dispatcher = Dispatcher(args.urls, max_queue_depth=args.max_queue_depth)
+  dispatcher.start()
+  start = time.time()
+  jobs = [
+      dispatcher.submit(
+          path, document_format=guess_document_format(path))
+      for path in args.inputs]
+  for job in jobs:
+    while not job.done.wait(1):
+      pass
+    print(job.path, job.url, job.error or '')
+  dispatcher.stop()
+
+  elapsed = time.time() - start
+  for printer in dispatcher.printers:
+    print('{}: {} jobs, {} bytes, {:.0f} B/s'.format(
+        printer.url, printer.jobs_sent, printer.bytes_sent,
+        printer.throughput))
+  print('{} jobs in {:.1f}s'.format(len(jobs), elapsed))
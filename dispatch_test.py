@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+
+import os
+import tempfile
+import unittest
+
+from pkipplib import pkipplib
+
+from dispatch import DispatchJob
+from dispatch import Dispatcher
+from fake_printer import FakePrinter
+
+
+def ipp_response(status):
+  return pkipplib.IPPRequest(operation_id=status, request_id=1)
+
+
+def idle_printer():
+  response = ipp_response(0)
+  response.printer['printer-state'] = ('enum', pkipplib.IPP_PRINTER_IDLE)
+  return response
+
+
+class TestDispatcher(unittest.TestCase):
+
+  def setUp(self):
+    handle, self.document = tempfile.mkstemp()
+    os.write(handle, 'RaS2' + '\0' * 1796)
+    os.close(handle)
+
+  def tearDown(self):
+    os.remove(self.document)
+
+  def test_choose(self):
+    dispatcher = Dispatcher(['a', 'b', 'c'], max_queue_depth=1)
+    a, b, c = dispatcher.printers
+    job = DispatchJob(self.document, {})
+
+    a.queued_job_count = 3
+    b.queued_job_count = 1
+    c.queued_job_count = 2
+    self.assertIs(dispatcher.choose(job), b)
+
+    b.state = pkipplib.IPP_PRINTER_STOPPED
+    self.assertIs(dispatcher.choose(job), c)
+
+    c.queue.append(job)
+    self.assertIs(dispatcher.choose(job), a)
+
+    # Much faster printers win despite a longer queue.
+    c.queue = []
+    a.job_seconds = 1.0
+    self.assertIs(dispatcher.choose(job), a)
+
+  def test_reroute_stopped(self):
+    dispatcher = Dispatcher(['a', 'b'])
+    a, b = dispatcher.printers
+    job = dispatcher.submit(self.document)
+    dispatcher.pending.remove(job)
+    a.queue.append(job)
+
+    a.state = pkipplib.IPP_PRINTER_STOPPED
+    dispatcher.reroute(a)
+    self.assertEqual(dispatcher.pending, [job])
+    self.assertIs(dispatcher.choose(job), b)
+
+  def run_jobs(self, sender, jobs=2):
+    """Dispatch jobs through sender, against printers that never stop."""
+    dispatcher = Dispatcher(
+        ['a', 'b'], refresh_interval=0.05, max_attempts=3, sender=sender,
+        fetcher=lambda url, names: idle_printer())
+    dispatcher.start()
+    submitted = [dispatcher.submit(self.document) for _ in range(jobs)]
+    for job in submitted:
+      self.assertTrue(job.done.wait(5))
+    dispatcher.stop()
+    for printer in dispatcher.printers:
+      self.assertEqual(printer.in_flight, 0)
+    return submitted
+
+  def test_refused(self):
+    calls = []
+    def sender(url, data_file, **options):
+      calls.append(url)
+      return ipp_response(0x040A)
+    for job in self.run_jobs(sender):
+      self.assertEqual(job.error, 'status 0x040a')
+      self.assertEqual(job.attempts, 1)
+    self.assertEqual(len(calls), 2)
+
+  def test_busy(self):
+    calls = []
+    def sender(url, data_file, **options):
+      calls.append(url)
+      return ipp_response(0x0507)
+    job, = self.run_jobs(sender, jobs=1)
+    self.assertEqual(job.error, 'status 0x0507')
+    self.assertEqual(len(calls), 3)
+
+  def test_sender_error(self):
+    def sender(url, data_file, **options):
+      raise ValueError('No pages in 5- of 1')
+    for job in self.run_jobs(sender):
+      self.assertEqual(job.error, 'No pages in 5- of 1')
+      self.assertIsNone(job.response)
+
+  def test_dispatch(self):
+    printers = [FakePrinter(pages_per_minute=6000) for _ in range(3)]
+    printers[0].stopped = True
+    for printer in printers:
+      printer.start()
+
+    dispatcher = Dispatcher(
+        [printer.url for printer in printers], refresh_interval=0.05)
+    dispatcher.start()
+    jobs = [dispatcher.submit(self.document) for _ in range(6)]
+    for job in jobs:
+      self.assertTrue(job.done.wait(5))
+    dispatcher.stop()
+
+    self.assertEqual(len(printers[0].jobs), 0)
+    self.assertEqual(len(printers[1].jobs) + len(printers[2].jobs), 6)
+    self.assertTrue(printers[1].jobs and printers[2].jobs)
+    for printer in printers:
+      printer.shutdown()
+      printer.server_close()
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,574 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+from __future__ import print_function
+
+import BaseHTTPServer
+import SocketServer
+import argparse
+import json
+import re
+import struct
+import tempfile
+import threading
+import time
+import zlib
+
+from pkipplib import pkipplib
+
+from print import COMPRESSION_WBITS
+from print import get_status_code
+from print import send_job
+
+
+# Status codes [RFC2911] 13.1
+IPP_OK = 0x0000
+IPP_BAD_REQUEST = 0x0400
+IPP_NOT_FOUND = 0x0406
+IPP_OPERATION_NOT_SUPPORTED = 0x0501
+IPP_SERVICE_UNAVAILABLE = 0x0502
+IPP_SERVER_BUSY = 0x0507
+
+OPERATION_NAMES = {
+  pkipplib.IPP_PRINT_JOB: 'Print-Job',
+  pkipplib.IPP_VALIDATE_JOB: 'Validate-Job',
+  pkipplib.IPP_CREATE_JOB: 'Create-Job',
+  pkipplib.IPP_SEND_DOCUMENT: 'Send-Document',
+  pkipplib.IPP_GET_JOB_ATTRIBUTES: 'Get-Job-Attributes',
+  pkipplib.IPP_GET_JOBS: 'Get-Jobs',
+  pkipplib.IPP_GET_PRINTER_ATTRIBUTES: 'Get-Printer-Attributes',
+}
+
+
+def pack_resolution(cross_feed, feed, units=pkipplib.IPP_RES_PER_INCH):
+  """Encode an IPP resolution value [RFC2910] 3.9."""
+  return struct.pack('>iib', cross_feed, feed, units)
+
+
+def parse_resolution(value):
+  """Parse '600dpi' or '600x300dpi' into an IPP resolution value."""
+  match = re.match(r'^(\d+)(?:x(\d+))?dpi$', value)
+  if not match:
+    raise ValueError('Not a resolution: {}'.format(value))
+  cross_feed = int(match.group(1))
+  feed = int(match.group(2) or cross_feed)
+  return pack_resolution(cross_feed, feed)
+
+
+DEFAULT_ATTRIBUTES = {
+  'printer-make-and-model': [('textWithoutLanguage', 'Open Print Stack Fake')],
+  'printer-is-accepting-jobs': [('boolean', 1)],
+  'ipp-versions-supported': [('keyword', '1.1'), ('keyword', '2.0')],
+  'operations-supported': [
+    ('enum', operation_id) for operation_id in sorted(OPERATION_NAMES)],
+  'compression-supported': [
+    ('keyword', 'none'), ('keyword', 'deflate'), ('keyword', 'gzip')],
+  'document-format-supported': [
+    ('mimeMediaType', 'application/octet-stream'),
+    ('mimeMediaType', 'image/jpeg'),
+    ('mimeMediaType', 'image/pwg-raster'),
+    ('mimeMediaType', 'image/urf'),
+  ],
+  'pwg-raster-document-resolution-supported': [
+    ('resolution', pack_resolution(300, 300)),
+    ('resolution', pack_resolution(600, 600)),
+  ],
+  'pwg-raster-document-type-supported': [
+    ('keyword', 'black_1'), ('keyword', 'sgray_8'), ('keyword', 'srgb_8')],
+  'urf-supported': [
+    ('keyword', 'V1.4'), ('keyword', 'CP1'), ('keyword', 'PQ3-4-5'),
+    ('keyword', 'RS300-600'), ('keyword', 'SRGB24'), ('keyword', 'W8'),
+    ('keyword', 'DM1')],
+  'print-quality-supported': [('enum', 3), ('enum', 4), ('enum', 5)],
+  'print-scaling-supported': [
+    ('keyword', 'auto'), ('keyword', 'auto-fit'), ('keyword', 'fill'),
+    ('keyword', 'fit'), ('keyword', 'none')],
+  'media-supported': [
+    ('keyword', 'iso_a4_210x297mm'), ('keyword', 'na_letter_8.5x11in')],
+  'sides-supported': [
+    ('keyword', 'one-sided'),
+    ('keyword', 'two-sided-long-edge'),
+    ('keyword', 'two-sided-short-edge'),
+  ],
+}
+
+
+def load_attributes(attributes_file):
+  """Load printer attributes from JSON, as {name: [[type, value], ..]}.
+
+  Resolution values are given as '600dpi' or '600x300dpi' strings.
+  """
+  attributes = {}
+  for name, values in json.load(open(attributes_file)).items():
+    attributes[str(name)] = [
+        (str(value_type),
+         parse_resolution(value) if value_type == 'resolution'
+         else value if isinstance(value, (bool, int))
+         else str(value))
+        for value_type, value in values
+        ]
+  return attributes
+
+
+def count_pages(data):
+  """Page count as announced by the first header of a PWG or URF document."""
+  if data[:4] == 'RaS2' and len(data) >= 4 + 456:
+    # TotalPageCount of the first page header.
+    return struct.unpack('>I', data[4+452:4+456])[0] or 1
+  elif data[:8] == 'UNIRAST\0' and len(data) >= 12:
+    return struct.unpack('>I', data[8:12])[0]
+  return 1
+
+
+def percentile(values, fraction):
+  """Nearest-rank percentile of a list of values."""
+  if not values:
+    return None
+  ordered = sorted(values)
+  return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class FakeJob:
+
+  def __init__(self, job_id, name, user):
+    self.job_id = job_id
+    self.name = name
+    self.user = user
+    self.created = time.time()
+    self.document_format = None
+    self.compression = None
+    self.bytes = 0
+    self.pages = 0
+    # Set when the document has been received.
+    self.start_time = None
+    self.end_time = None
+
+
+class FakePrinter(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+  """IPP server standing in for a printer.
+
+  Accepts documents at `ingest_rate` bytes/second (unlimited when None),
+  either decoding them with the raster decoders or discarding them, and
+  "prints" them one at a time at `pages_per_minute`.
+  """
+
+  daemon_threads = True
+  allow_reuse_address = True
+
+  def __init__(
+      self,
+      address=('127.0.0.1', 0),
+      attributes=None,
+      ingest_rate=None,
+      pages_per_minute=None,
+      decode=False,
+      max_queued_jobs=None,
+      ):
+    BaseHTTPServer.HTTPServer.__init__(self, address, FakePrinterHandler)
+    self.attributes = dict(DEFAULT_ATTRIBUTES)
+    self.attributes.update(attributes or {})
+    self.ingest_rate = ingest_rate
+    self.pages_per_minute = pages_per_minute
+    self.decode = decode
+    self.max_queued_jobs = max_queued_jobs
+    # When True the printer reports "stopped" and refuses jobs.
+    self.stopped = False
+
+    self.lock = threading.Lock()
+    self.jobs = {}
+    self.next_job_id = 1
+    # Print engine is busy until this time.
+    self.engine_free_time = 0
+    # (operation name, status code, latency seconds, bytes in, bytes out)
+    self.requests = []
+
+  @property
+  def url(self):
+    return 'http://{}:{}'.format(*self.server_address[:2])
+
+  def start(self):
+    """Serve from a background thread."""
+    thread = threading.Thread(target=self.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return thread
+
+  def job_state(self, job, now=None):
+    """Simulated "job-state" enum of a job."""
+    now = now or time.time()
+    if job.end_time is None or now < job.start_time:
+      return pkipplib.IPP_JOB_PENDING
+    elif now < job.end_time:
+      return pkipplib.IPP_JOB_PROCESSING
+    return pkipplib.IPP_JOB_COMPLETE
+
+  def queued_job_count(self, now=None):
+    now = now or time.time()
+    return len([
+        job for job in self.jobs.values()
+        if self.job_state(job, now) != pkipplib.IPP_JOB_COMPLETE
+        ])
+
+  def printer_state(self, now=None):
+    if self.stopped:
+      return pkipplib.IPP_PRINTER_STOPPED
+    elif self.queued_job_count(now):
+      return pkipplib.IPP_PRINTER_PROCESSING
+    return pkipplib.IPP_PRINTER_IDLE
+
+  def record(self, operation, status, latency, bytes_in, bytes_out):
+    with self.lock:
+      self.requests.append((operation, status, latency, bytes_in, bytes_out))
+
+  def stats(self):
+    """Per-operation request count, latency percentiles and byte totals."""
+    with self.lock:
+      requests = list(self.requests)
+    stats = {}
+    for operation in sorted(set(request[0] for request in requests)):
+      latencies = [r[2] for r in requests if r[0] == operation]
+      stats[operation] = {
+        'count': len(latencies),
+        'p50': percentile(latencies, 0.50),
+        'p99': percentile(latencies, 0.99),
+        'bytes_in': sum(r[3] for r in requests if r[0] == operation),
+        'bytes_out': sum(r[4] for r in requests if r[0] == operation),
+      }
+    return stats
+
+  def create_job(self, request):
+    name = (
+        get_job_value(request, 'job-name')
+        or get_operation_value(request, 'job-name', 'job'))
+    with self.lock:
+      job = FakeJob(
+          self.next_job_id,
+          name,
+          get_operation_value(request, 'requesting-user-name', ''))
+      self.next_job_id += 1
+      self.jobs[job.job_id] = job
+    return job
+
+  def receive_document(self, job, request):
+    """Ingest, and optionally decode, the document data of a request."""
+    job.document_format = get_operation_value(
+        request, 'document-format', 'application/octet-stream')
+    job.compression = get_operation_value(request, 'compression', 'none')
+
+    data = request.data
+    if job.compression in COMPRESSION_WBITS:
+      data = zlib.decompress(data, COMPRESSION_WBITS[job.compression])
+
+    if self.ingest_rate:
+      time.sleep(len(data) / float(self.ingest_rate))
+
+    job.bytes += len(data)
+    job.pages += count_pages(data)
+    if self.decode:
+      decode_document(data)
+
+    with self.lock:
+      now = time.time()
+      job.start_time = max(now, self.engine_free_time)
+      print_time = 0
+      if self.pages_per_minute:
+        print_time = job.pages * 60.0 / self.pages_per_minute
+      job.end_time = self.engine_free_time = job.start_time + print_time
+
+
+def decode_document(data):
+  """Decode a raster document, as a printer's RIP would."""
+  # Only pulled in when decoding, so PIL isn't needed otherwise.
+  from raster import Raster
+
+  with tempfile.NamedTemporaryFile() as raster_file:
+    raster_file.write(data)
+    raster_file.flush()
+    raster_obj = Raster.create_best_raster(raster_file.name)
+    if raster_obj is not None:
+      raster_obj.load(raster_file.name)
+
+
+def get_operation_value(request, name, default=None):
+  try:
+    return request.operation[name][0][1]
+  except KeyError:
+    return default
+
+
+def get_job_value(request, name, default=None):
+  try:
+    return request.job[name][0][1]
+  except KeyError:
+    return default
+
+
+class FakePrinterHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+  protocol_version = 'HTTP/1.1'
+
+  def log_message(self, format, *args):
+    pass
+
+  def do_POST(self):
+    start = time.time()
+    if self.headers.get('Expect', '').lower() == '100-continue':
+      error = self.check_accepting(None)
+      if error:
+        # Refused before the client sends the body, which is never read.
+        self.close_connection = 1
+        self.send_ipp(error, start, '')
+        return
+      self.wfile.write('HTTP/1.1 100 Continue\r\n\r\n')
+    body = self.read_body()
+
+    request = pkipplib.IPPRequest(body)
+    try:
+      request.parse()
+    except pkipplib.IPPError:
+      self.send_ipp(self.new_response(None, IPP_BAD_REQUEST), start, body)
+      return
+
+    handler = getattr(
+        self,
+        'ipp_' + OPERATION_NAMES.get(
+            request.operation_id, '').lower().replace('-', '_'),
+        None)
+    if handler is None:
+      response = self.new_response(request, IPP_OPERATION_NOT_SUPPORTED)
+    else:
+      response = handler(request)
+    self.send_ipp(response, start, body, request)
+
+  def read_body(self):
+    """The request body, of a Content-Length or chunked."""
+    if self.headers.get('Transfer-Encoding', '').lower() != 'chunked':
+      return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+    chunks = []
+    while True:
+      size = int(self.rfile.readline().split(';')[0], 16)
+      if not size:
+        break
+      chunks.append(self.rfile.read(size))
+      self.rfile.readline()
+    # Trailer fields, up to the empty line.
+    while self.rfile.readline() not in ('\r\n', '\n', ''):
+      pass
+    return ''.join(chunks)
+
+  def send_ipp(self, response, start, body, request=None):
+    data = response.dump()
+    self.server.record(
+        OPERATION_NAMES.get(request and request.operation_id, 'Unknown'),
+        response.operation_id,
+        time.time() - start,
+        len(body),
+        len(data))
+    self.send_response(200)
+    self.send_header('Content-Type', 'application/ipp')
+    self.send_header('Content-Length', str(len(data)))
+    self.end_headers()
+    self.wfile.write(data)
+
+  def new_response(self, request, status):
+    response = pkipplib.IPPRequest(
+        version=(2, 0),
+        operation_id=status,
+        request_id=request.request_id if request else 0)
+    response.operation['attributes-charset'] = ('charset', 'utf-8')
+    response.operation['attributes-natural-language'] = (
+        'naturalLanguage', 'en-us')
+    return response
+
+  def find_job(self, request):
+    job_id = get_operation_value(request, 'job-id')
+    if job_id is None:
+      match = re.search(
+          r'(\d+)$', get_operation_value(request, 'job-uri', ''))
+      job_id = match and int(match.group(1))
+    return self.server.jobs.get(job_id)
+
+  def job_group(self, job):
+    server = self.server
+    return [
+      ('job-id', [('integer', job.job_id)]),
+      ('job-uri', [('uri', '{}/jobs/{}'.format(
+          server.url.replace('http://', 'ipp://'), job.job_id))]),
+      ('job-name', [('nameWithoutLanguage', job.name)]),
+      ('job-state', [('enum', server.job_state(job))]),
+      ('job-state-reasons', [('keyword', 'none')]),
+      ('job-impressions-completed', [('integer', (
+          job.pages
+          if server.job_state(job) == pkipplib.IPP_JOB_COMPLETE
+          else 0))]),
+      ('job-k-octets', [('integer', (job.bytes + 1023) // 1024)]),
+    ]
+
+  def job_response(self, request, job):
+    response = self.new_response(request, IPP_OK)
+    response._job_attributes = [self.job_group(job)]
+    return response
+
+  def check_accepting(self, request):
+    """Error response when the printer can't take a job now, else None."""
+    server = self.server
+    if server.stopped:
+      return self.new_response(request, IPP_SERVICE_UNAVAILABLE)
+    if (server.max_queued_jobs is not None
+        and server.queued_job_count() >= server.max_queued_jobs):
+      return self.new_response(request, IPP_SERVER_BUSY)
+    return None
+
+  def ipp_print_job(self, request):
+    error = self.check_accepting(request)
+    if error:
+      return error
+    job = self.server.create_job(request)
+    self.server.receive_document(job, request)
+    return self.job_response(request, job)
+
+  def ipp_validate_job(self, request):
+    return self.check_accepting(request) or self.new_response(request, IPP_OK)
+
+  def ipp_create_job(self, request):
+    error = self.check_accepting(request)
+    if error:
+      return error
+    return self.job_response(request, self.server.create_job(request))
+
+  def ipp_send_document(self, request):
+    job = self.find_job(request)
+    if job is None:
+      return self.new_response(request, IPP_NOT_FOUND)
+    self.server.receive_document(job, request)
+    return self.job_response(request, job)
+
+  def ipp_get_job_attributes(self, request):
+    job = self.find_job(request)
+    if job is None:
+      return self.new_response(request, IPP_NOT_FOUND)
+    return self.job_response(request, job)
+
+  def ipp_get_jobs(self, request):
+    response = self.new_response(request, IPP_OK)
+    jobs = sorted(self.server.jobs.values(), key=lambda job: job.job_id)
+    if get_operation_value(request, 'which-jobs') != 'completed':
+      jobs = [
+          job for job in jobs
+          if self.server.job_state(job) != pkipplib.IPP_JOB_COMPLETE
+          ]
+    response._job_attributes = [self.job_group(job) for job in jobs] or [[]]
+    return response
+
+  def ipp_get_printer_attributes(self, request):
+    server = self.server
+    attributes = dict(server.attributes)
+    attributes['printer-state'] = [('enum', server.printer_state())]
+    attributes['queued-job-count'] = [
+        ('integer', server.queued_job_count())]
+    attributes['printer-uri-supported'] = [
+        ('uri', server.url.replace('http://', 'ipp://') + '/ipp/print')]
+
+    try:
+      requested = set(
+          value for (_, value) in request.operation['requested-attributes'])
+    except KeyError:
+      requested = set(['all'])
+
+    response = self.new_response(request, IPP_OK)
+    response._printer_attributes = [[
+        (name, values)
+        for name, values in sorted(attributes.items())
+        if 'all' in requested or name in requested
+        ]]
+    return response
+
+
+def run_load(url, data, clients=4, jobs=100, **send_kwargs):
+  """Send `jobs` copies of data over `clients` concurrent connections."""
+  lock = threading.Lock()
+  remaining = [jobs]
+  latencies = []
+  errors = [0]
+
+  def client():
+    while True:
+      with lock:
+        if remaining[0] <= 0:
+          return
+        remaining[0] -= 1
+      start = time.time()
+      response = send_job(url, data, **send_kwargs)
+      latency = time.time() - start
+      with lock:
+        if get_status_code(response) == IPP_OK:
+          latencies.append(latency)
+        else:
+          errors[0] += 1
+
+  start = time.time()
+  threads = [threading.Thread(target=client) for _ in range(clients)]
+  for thread in threads:
+    thread.start()
+  for thread in threads:
+    thread.join()
+  elapsed = time.time() - start
+
+  return {
+    'jobs': len(latencies),
+    'errors': errors[0],
+    'seconds': elapsed,
+    'jobs_per_second': len(latencies) / elapsed if elapsed else None,
+    'p50': percentile(latencies, 0.50),
+    'p99': percentile(latencies, 0.99),
+  }
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(
+      description='Stand-in IPP printer and load generator.')
+  subparsers = parser.add_subparsers(dest='action')
+
+  serve_parser = subparsers.add_parser('serve', help='Run a fake printer')
+  serve_parser.add_argument('--host', default='127.0.0.1')
+  serve_parser.add_argument('--port', type=int, default=8631)
+  serve_parser.add_argument(
+      '--attributes', help='JSON file of printer attributes')
+  serve_parser.add_argument(
+      '--ingest-rate', type=float, help='Document ingest rate, bytes/second')
+  serve_parser.add_argument(
+      '--pages-per-minute', type=float, help='Simulated print speed')
+  serve_parser.add_argument(
+      '--decode', action='store_true', help='Decode documents, not discard')
+  serve_parser.add_argument(
+      '--max-queued-jobs', type=int,
+      help='Answer server-error-busy beyond this many queued jobs')
+
+  load_parser = subparsers.add_parser('load', help='Generate load')
+  load_parser.add_argument('url', help='Printer URL')
+  load_parser.add_argument('input', help='Document to send')
+  load_parser.add_argument('-c', '--clients', type=int, default=4)
+  load_parser.add_argument('-n', '--jobs', type=int, default=100)
+
+  args = parser.parse_args()
+
+  if args.action == 'serve':
+    server = FakePrinter(
+        (args.host, args.port),
+        attributes=args.attributes and load_attributes(args.attributes),
+        ingest_rate=args.ingest_rate,
+        pages_per_minute=args.pages_per_minute,
+        decode=args.decode,
+        max_queued_jobs=args.max_queued_jobs,
+        )
+    print('Serving on {}'.format(server.url))
+    try:
+      server.serve_forever()
+    except KeyboardInterrupt:
+      pass
+    for operation, stats in sorted(server.stats().items()):
+      print('{}: {}'.format(operation, stats))
+
+  elif args.action == 'load':
+    data = open(args.input, 'rb').read()
+    print(run_load(args.url, data, args.clients, args.jobs))
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+
+import unittest
+
+from pkipplib import pkipplib
+
+from fake_printer import FakePrinter
+from fake_printer import IPP_OK
+from fake_printer import IPP_SERVER_BUSY
+from fake_printer import run_load
+from print import get_attributes
+from print import get_printer_attribute
+from print import get_status_code
+from print import send_job
+
+
+PWG_DATA = 'RaS2' + '\0' * 1796 + '\x00\x00\xff\xff\xff'
+
+
+class TestFakePrinter(unittest.TestCase):
+
+  def setUp(self):
+    self.printer = FakePrinter()
+    self.printer.start()
+
+  def tearDown(self):
+    self.printer.shutdown()
+    self.printer.server_close()
+
+  def test_print_job(self):
+    response = send_job(self.printer.url, PWG_DATA, compression='gzip')
+    self.assertEqual(get_status_code(response), IPP_OK)
+    self.assertEqual(response.job['job-id'][0][1], 1)
+
+    job = self.printer.jobs[1]
+    self.assertEqual(job.bytes, len(PWG_DATA))
+    self.assertEqual(job.compression, 'gzip')
+    self.assertEqual(job.document_format, 'image/pwg-raster')
+    self.assertEqual(
+        self.printer.job_state(job), pkipplib.IPP_JOB_COMPLETE)
+    self.assertEqual(self.printer.stats()['Print-Job']['count'], 1)
+
+  def test_create_job_and_send_document(self):
+    printer = pkipplib.CUPS(url=self.printer.url)
+    request = printer.newRequest(pkipplib.IPP_CREATE_JOB)
+    response = printer.doRequest(request)
+    job_id = response.job['job-id'][0][1]
+    self.assertEqual(
+        response.job['job-state'][0][1], pkipplib.IPP_JOB_PENDING)
+
+    request = printer.newRequest(pkipplib.IPP_SEND_DOCUMENT)
+    request.operation['job-id'] = ('integer', job_id)
+    request.data = PWG_DATA
+    response = printer.doRequest(request)
+    self.assertEqual(get_status_code(response), IPP_OK)
+    self.assertEqual(self.printer.jobs[job_id].bytes, len(PWG_DATA))
+
+  def test_get_printer_attributes(self):
+    self.printer.pages_per_minute = 1
+    send_job(self.printer.url, PWG_DATA)
+    response = get_attributes(
+        self.printer.url, ['printer-state', 'queued-job-count'])
+    self.assertEqual(
+        get_printer_attribute(response, 'printer-state'),
+        [pkipplib.IPP_PRINTER_PROCESSING])
+    self.assertEqual(
+        get_printer_attribute(response, 'queued-job-count'), [1])
+    self.assertEqual(
+        get_printer_attribute(response, 'compression-supported'), [])
+
+  def test_busy(self):
+    self.printer.pages_per_minute = 1
+    self.printer.max_queued_jobs = 1
+    send_job(self.printer.url, PWG_DATA)
+    self.assertEqual(
+        get_status_code(send_job(self.printer.url, PWG_DATA)),
+        IPP_SERVER_BUSY)
+
+  def test_run_load(self):
+    report = run_load(self.printer.url, PWG_DATA, clients=3, jobs=9)
+    self.assertEqual(report['jobs'], 9)
+    self.assertEqual(report['errors'], 0)
+    self.assertLessEqual(report['p50'], report['p99'])
+
+
+if __name__ == '__main__':
+  unittest.main()
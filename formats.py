@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+
+import StringIO
+import argparse
+import time
+
+from PIL import Image
+
+from print import get_attributes
+from print import get_printer_attribute
+from print import measure_link_speed
+from raster import BAND_ROWS
+from raster import Raster
+
+
+JPEG = 'image/jpeg'
+
+# Raster formats by "document-format", as the file extension that picks
+# their encoder, see Raster.create_best_raster.
+RASTER_EXTENSIONS = {
+  'image/pwg-raster': '.pwg',
+  'image/urf': '.urf',
+}
+
+# Bands of BAND_ROWS rows encoded, spread over the page, to estimate the
+# size and encode time of the whole page.
+SAMPLE_BANDS = 4
+
+# Bytes/second assumed when the link speed isn't known, about 100 Mbit/s.
+DEFAULT_LINK_SPEED = 10 * 1024 * 1024
+
+
+class Estimate:
+  """Expected size and CPU time of a document in one format."""
+
+  def __init__(self, document_format, size, seconds, raster_obj=None):
+    self.document_format = document_format
+    self.size = size
+    self.seconds = seconds
+    # Raster loaded with the page, None for documents sent as they are.
+    self.raster = raster_obj
+
+  def cost(self, link_speed):
+    """Seconds to encode and upload."""
+    return self.seconds + self.size / float(link_speed)
+
+  def __str__(self):
+    return '{} {:.2f} MB in {:.2f}s'.format(
+        self.document_format, self.size / 1e6, self.seconds)
+
+
+def sample_boxes(size, sample_bands=SAMPLE_BANDS):
+  """Boxes of up to sample_bands bands of BAND_ROWS rows, spread evenly."""
+  width, height = size
+  bands = (height + BAND_ROWS - 1) // BAND_ROWS
+  indexes = sorted(set(i * bands // sample_bands for i in range(sample_bands)))
+  return [
+      (0, i * BAND_ROWS, width, min((i + 1) * BAND_ROWS, height))
+      for i in indexes]
+
+
+def estimate_raster(input_file, document_format, sample_bands=SAMPLE_BANDS):
+  """Load the page and encode a sample of its bands, to estimate the whole."""
+  raster_obj = Raster.create_best_raster(
+      'page' + RASTER_EXTENSIONS[document_format])
+  start = time.time()
+  raster_obj.load_img(input_file)
+  load_seconds = time.time() - start
+
+  img = raster_obj.img
+  boxes = sample_boxes(img.size, sample_bands)
+  output = StringIO.StringIO()
+  start = time.time()
+  raster_obj.encode_bands_(
+      output, [img.crop(box) for box in boxes], raster_obj.colorspace_str)
+  encode_seconds = time.time() - start
+
+  scale = img.height / float(sum(box[3] - box[1] for box in boxes))
+  size = (
+      raster_obj.file_header_size
+      + raster_obj.page_header_size
+      + int(output.tell() * scale))
+  return Estimate(
+      document_format, size, load_seconds + encode_seconds * scale, raster_obj)
+
+
+def choose_format(input_file, formats_supported, link_speed=None):
+  """Estimate each format the printer supports, and pick the cheapest.
+
+  JPEG sources can go as they are to printers that take JPEG, at no CPU
+  cost. Other sources aren't re-encoded to JPEG, which would blur text and
+  line art. Every raster format the printer takes is estimated from a
+  sample of the page. Returns the estimates, the cheapest first.
+  """
+  link_speed = link_speed or DEFAULT_LINK_SPEED
+  estimates = []
+  if JPEG in formats_supported and Image.open(input_file).format == 'JPEG':
+    with open(input_file, 'rb') as jpeg_file:
+      jpeg_file.seek(0, 2)
+      estimates.append(Estimate(JPEG, jpeg_file.tell(), 0.0))
+  for document_format in sorted(RASTER_EXTENSIONS):
+    if document_format in formats_supported:
+      estimates.append(estimate_raster(input_file, document_format))
+  if not estimates:
+    raise ValueError('No supported document format: {}'.format(
+        ', '.join(formats_supported)))
+
+  estimates.sort(key=lambda estimate: estimate.cost(link_speed))
+  print('Document format: {} ({} B/s link; {})'.format(
+      estimates[0].document_format,
+      int(link_speed),
+      '; '.join(str(estimate) for estimate in estimates)))
+  return estimates
+
+
+def encode_for_printer(
+    input_file,
+    output_prefix,
+    formats_supported,
+    link_speed=None,
+    ):
+  """Encode a page in the cheapest format for the printer and the link.
+
+  Returns (path of the document, its "document-format"). JPEG documents
+  are the input file itself.
+  """
+  best = choose_format(input_file, formats_supported, link_speed)[0]
+  if best.raster is None:
+    return input_file, best.document_format
+  output_file = output_prefix + RASTER_EXTENSIONS[best.document_format]
+  best.raster.save(output_file)
+  return output_file, best.document_format
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(
+      description='Encode a page in the format cheapest to print it with.')
+
+  parser.add_argument('input', help='Input image')
+  parser.add_argument(
+      'output_prefix', help='Output file, without the extension of its format')
+  parser.add_argument(
+      '--url', help='Printer URL, to ask for document-format-supported')
+  parser.add_argument(
+      '--formats', default=','.join([JPEG] + sorted(RASTER_EXTENSIONS)),
+      help='Comma separated formats the printer supports, without --url')
+  parser.add_argument(
+      '--link-speed', type=float,
+      help='Link speed in bytes/second, measured when not given with --url')
+
+  args = parser.parse_args()
+
+  formats_supported = args.formats.split(',')
+  link_speed = args.link_speed
+  if args.url:
+    formats_supported = get_printer_attribute(
+        get_attributes(args.url, ['document-format-supported']),
+        'document-format-supported')
+    if link_speed is None:
+      link_speed = measure_link_speed(args.url)
+
+  try:
+    output_file, document_format = encode_for_printer(
+        args.input, args.output_prefix, formats_supported, link_speed)
+  except ValueError as error:
+    exit(str(error))
+  print(output_file)
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+from PIL import Image
+from PIL import ImageDraw
+
+import formats
+
+
+def photo(path):
+  """A noisy JPEG, small as JPEG and large as runs."""
+  rng = random.Random(1)
+  img = Image.frombytes(
+      'RGB', (600, 400), ''.join(chr(rng.randint(0, 255)) for _ in xrange(
+          600 * 400 * 3)))
+  img.save(path, quality=50, dpi=(300, 300))
+
+
+def text_page(path):
+  img = Image.new('RGB', (1240, 1754), 'white')
+  draw = ImageDraw.Draw(img)
+  for y in range(100, 1600, 40):
+    draw.text((100, y), 'Lorem ipsum dolor sit amet', fill='black')
+  img.save(path, quality=90, dpi=(150, 150))
+
+
+class TestFormats(unittest.TestCase):
+
+  def setUp(self):
+    self.tmp_dir = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.tmp_dir)
+
+  def test_sample_boxes(self):
+    self.assertEqual(formats.sample_boxes((10, 100)), [(0, 0, 10, 100)])
+    boxes = formats.sample_boxes((10, 3508))
+    self.assertEqual(len(boxes), formats.SAMPLE_BANDS)
+    self.assertEqual(boxes[0], (0, 0, 10, 256))
+    self.assertEqual(boxes[-1], (0, 2560, 10, 2816))
+
+  def test_choose_format(self):
+    photo_path = os.path.join(self.tmp_dir, 'photo.jpg')
+    photo(photo_path)
+    supported = ['image/jpeg', 'image/urf', 'image/pwg-raster']
+
+    estimates = formats.choose_format(photo_path, supported, 1e6)
+    self.assertEqual(
+        [e.document_format for e in estimates][0], 'image/jpeg')
+    self.assertEqual(len(estimates), 3)
+    self.assertEqual(estimates[0].size, os.path.getsize(photo_path))
+
+    costs = [estimate.cost(1e6) for estimate in estimates]
+    self.assertEqual(costs, sorted(costs))
+
+    # Only JPEG sources go as JPEG.
+    text_path = os.path.join(self.tmp_dir, 'text.png')
+    text_page(text_path)
+    estimates = formats.choose_format(text_path, supported)
+    self.assertEqual(
+        sorted(e.document_format for e in estimates),
+        ['image/pwg-raster', 'image/urf'])
+
+    estimates = formats.choose_format(photo_path, ['image/urf'])
+    self.assertEqual([e.document_format for e in estimates], ['image/urf'])
+
+    with self.assertRaises(ValueError):
+      formats.choose_format(photo_path, ['application/pdf'])
+
+  def test_estimate_raster(self):
+    text_path = os.path.join(self.tmp_dir, 'text.png')
+    text_page(text_path)
+    estimate = formats.estimate_raster(text_path, 'image/urf')
+    output_path = os.path.join(self.tmp_dir, 'text.urf')
+    estimate.raster.save(output_path)
+    self.assertAlmostEqual(
+        estimate.size, os.path.getsize(output_path),
+        delta=os.path.getsize(output_path) * 0.25)
+
+  def test_encode_for_printer(self):
+    photo_path = os.path.join(self.tmp_dir, 'photo.jpg')
+    photo(photo_path)
+    prefix = os.path.join(self.tmp_dir, 'out')
+    self.assertEqual(
+        formats.encode_for_printer(photo_path, prefix, ['image/jpeg']),
+        (photo_path, 'image/jpeg'))
+    path, document_format = formats.encode_for_printer(
+        photo_path, prefix, ['image/urf'])
+    self.assertEqual((path, document_format), (prefix + '.urf', 'image/urf'))
+    self.assertEqual(open(path, 'rb').read(8), 'UNIRAST\0')
+
+
+if __name__ == '__main__':
+  unittest.main()
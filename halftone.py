@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+
+import collections
+import threading
+
+from PIL import Image
+from PIL import ImageChops
+
+
+METHODS = ('ordered', 'diffusion')
+
+# Side of the Bayer matrix used for ordered dithering.
+BAYER_SIZE = 8
+
+# Rows of the previous band error diffusion runs over again, so that the
+# error carried into a band is close to what a whole page pass would carry.
+DIFFUSION_OVERLAP = 16
+
+# Gray values above their threshold are white.
+THRESHOLD_TABLE = [0] + [255] * 255
+
+
+def bayer_matrix(size):
+  """Bayer index matrix of a power of 2 side, as a list of rows."""
+  matrix = [[0]]
+  while len(matrix) < size:
+    matrix = (
+        [[4 * v for v in row] + [4 * v + 2 for v in row] for row in matrix]
+        + [[4 * v + 3 for v in row] + [4 * v + 1 for v in row]
+           for row in matrix])
+  return matrix
+
+
+# Rows of the threshold bands cached, a multiple of BAYER_SIZE. Shorter
+# bands are cropped from them, taller ones built each time.
+THRESHOLD_ROWS = 256
+
+# Page widths threshold bands are cached for, least recently used dropped.
+THRESHOLD_WIDTHS = 8
+
+_THRESHOLDS = collections.OrderedDict()
+_THRESHOLDS_LOCK = threading.Lock()
+
+def tile_thresholds(size, bayer_size):
+  """Gray image of Bayer thresholds tiled over size."""
+  width, height = size
+  levels = bayer_size * bayer_size
+  repeats = width // bayer_size + 1
+  tile_rows = [
+      (''.join(chr(int((v + 0.5) * 256 / levels)) for v in row)
+       * repeats)[:width]
+      for row in bayer_matrix(bayer_size)
+      ]
+  return Image.frombytes('L', size, ''.join(
+      tile_rows[y % bayer_size] for y in xrange(height)))
+
+
+def threshold_image(size, bayer_size=BAYER_SIZE):
+  """Gray image of Bayer thresholds tiled over size, cached by width."""
+  width, height = size
+  if height > THRESHOLD_ROWS:
+    return tile_thresholds(size, bayer_size)
+  key = (width, bayer_size)
+  with _THRESHOLDS_LOCK:
+    thresholds = _THRESHOLDS.pop(key, None)
+    if thresholds is None:
+      thresholds = tile_thresholds((width, THRESHOLD_ROWS), bayer_size)
+    # Back at the most recently used end.
+    _THRESHOLDS[key] = thresholds
+    while len(_THRESHOLDS) > THRESHOLD_WIDTHS:
+      _THRESHOLDS.popitem(last=False)
+  if height == THRESHOLD_ROWS:
+    return thresholds
+  return thresholds.crop((0, 0, width, height))
+
+
+def ordered(band):
+  """Dither a gray band to 1-bit against the tiled Bayer matrix.
+
+  Bands must start on a row that is a multiple of BAYER_SIZE.
+  """
+  thresholds = threshold_image(band.size)
+  return ImageChops.subtract(band, thresholds).point(THRESHOLD_TABLE, '1')
+
+
+def dither(img, box, method='ordered'):
+  """Dither the box of a gray page to a 1-bit band.
+
+  Only the rows of the box, and for error diffusion DIFFUSION_OVERLAP rows
+  above it, are read, so pages are halftoned a band at a time.
+  """
+  left, top, right, bottom = box
+  if method == 'ordered':
+    return ordered(img.crop(box))
+  if method == 'diffusion':
+    overlap = min(top, DIFFUSION_OVERLAP)
+    # Floyd-Steinberg, by PIL.
+    band = img.crop((left, top - overlap, right, bottom)).convert('1')
+    if not overlap:
+      return band
+    return band.crop((0, overlap, right - left, bottom - top + overlap))
+  raise ValueError('Unknown halftone method: {}'.format(method))
+
+
+def dither_bands(bands, method='ordered'):
+  """Dither a page given as gray bands, top to bottom, to 1-bit bands.
+
+  All bands but the last must have a multiple of BAYER_SIZE rows.
+  """
+  tail = None
+  for band in bands:
+    if tail is None:
+      yield dither(band, (0, 0) + band.size, method)
+    else:
+      window = Image.new('L', (band.width, tail.height + band.height))
+      window.paste(tail, (0, 0))
+      window.paste(band, (0, tail.height))
+      yield dither(window, (0, tail.height) + window.size, method)
+    if method == 'diffusion':
+      tail = band.crop((
+          0, max(0, band.height - DIFFUSION_OVERLAP), band.width, band.height))
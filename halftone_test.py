@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from PIL import Image
+
+import halftone
+from raster import PWG
+from raster import URF
+from raster import encode_file
+
+
+def white_fraction(img):
+  return img.convert('L').histogram()[255] / float(img.width * img.height)
+
+
+def dither_page(img, method, band_rows=64):
+  page = Image.new('1', img.size)
+  for y in range(0, img.height, band_rows):
+    box = (0, y, img.width, min(y + band_rows, img.height))
+    page.paste(halftone.dither(img, box, method), box[:2])
+  return page
+
+
+class TestHalftone(unittest.TestCase):
+
+  def test_bayer_matrix(self):
+    self.assertEqual(halftone.bayer_matrix(2), [[0, 2], [3, 1]])
+    matrix = halftone.bayer_matrix(8)
+    self.assertEqual(
+        sorted(v for row in matrix for v in row), range(64))
+
+  def test_dither_levels(self):
+    for method in halftone.METHODS:
+      for level in (0, 64, 128, 192, 255):
+        page = dither_page(Image.new('L', (100, 200), level), method)
+        self.assertEqual(page.mode, '1')
+        self.assertAlmostEqual(
+            white_fraction(page), level / 255.0, delta=0.03)
+
+  def test_diffusion_bands(self):
+    img = Image.linear_gradient('L').resize((120, 300))
+    whole = img.convert('1')
+    banded = dither_page(img, 'diffusion')
+    self.assertAlmostEqual(
+        white_fraction(banded), white_fraction(whole), delta=0.01)
+
+  def test_threshold_cache(self):
+    halftone._THRESHOLDS.clear()
+    band = halftone.threshold_image((40, 64))
+    self.assertEqual(band.size, (40, 64))
+    self.assertEqual(
+        band.tobytes(),
+        halftone.tile_thresholds((40, 64), halftone.BAYER_SIZE).tobytes())
+    # Every band height of a width is cut from the one cached band.
+    halftone.threshold_image((40, 3))
+    self.assertEqual(halftone._THRESHOLDS.keys(), [(40, halftone.BAYER_SIZE)])
+    tall = halftone.threshold_image((40, halftone.THRESHOLD_ROWS + 8))
+    self.assertEqual(tall.size, (40, halftone.THRESHOLD_ROWS + 8))
+    self.assertEqual(len(halftone._THRESHOLDS), 1)
+
+    for width in range(1, 2 * halftone.THRESHOLD_WIDTHS):
+      halftone.threshold_image((width, 8))
+    self.assertEqual(len(halftone._THRESHOLDS), halftone.THRESHOLD_WIDTHS)
+    self.assertNotIn((40, halftone.BAYER_SIZE), halftone._THRESHOLDS)
+
+  def test_unknown_method(self):
+    with self.assertRaises(ValueError):
+      halftone.dither(Image.new('L', (8, 8)), (0, 0, 8, 8), 'stochastic')
+
+  def test_encode(self):
+    tmp_dir = tempfile.mkdtemp()
+    try:
+      image_path = os.path.join(tmp_dir, 'gray.png')
+      Image.new('RGB', (64, 40), (128, 128, 128)).save(
+          image_path, dpi=(300, 300))
+
+      pwg_path = os.path.join(tmp_dir, 'gray.pwg')
+      encode_file(image_path, pwg_path, halftone_method='ordered')
+      pwg = PWG()
+      data = open(pwg_path).read()
+      (start, end), = pwg.read_pages_(data)
+      info = pwg.page_info_()
+      self.assertEqual(
+          (info['color_kind'], info['bits_per_pixel']), ('BLACK', 1))
+      self.assertEqual(pwg.bytes_per_line, (info['width'] + 7) // 8)
+      rows = ''.join(pwg.decode_rows_(
+          data, start, pwg.bytes_per_line, info['height'], 1, '\x00'))
+      # Half the bits of the image are ink.
+      ink = sum(
+          bin(ord(c)).count('1')
+          for y in range(40)
+          for c in rows[y * pwg.bytes_per_line:y * pwg.bytes_per_line + 8])
+      self.assertAlmostEqual(ink / (64 * 40.0), 0.5, delta=0.05)
+
+      urf_path = os.path.join(tmp_dir, 'gray.urf')
+      encode_file(image_path, urf_path, halftone_method='diffusion')
+      urf = URF()
+      data = open(urf_path).read()
+      (start, end), = urf.read_pages_(data)
+      self.assertEqual((urf.bpp, urf.colorspace), (8, 0))
+      rows = ''.join(urf.decode_rows_(data, start, 64, 40, 1))
+      self.assertEqual(set(rows), set(['\x00', '\xff']))
+    finally:
+      shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+  unittest.main()
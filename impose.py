@@ -0,0 +1,430 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+
+import argparse
+import time
+
+from PIL import Image
+
+from raster import ImageBox
+from raster import MEDIA_SIZES
+from raster import Raster
+from raster import line_units
+from raster import map_file
+from raster import pil_mode
+from raster import scale_bands
+from raster import white_pixel
+
+
+# Pages per sheet: (columns, rows) on a landscape sheet, the other way round
+# on a portrait one.
+GRIDS = {
+  2: (2, 1),
+  4: (2, 2),
+  6: (3, 2),
+  8: (4, 2),
+  9: (3, 3),
+  16: (4, 4),
+}
+
+LAYOUTS = ['{}up'.format(pages) for pages in sorted(GRIDS)] + ['booklet']
+
+ORIENTATIONS = ('auto', 'portrait', 'landscape')
+
+# Rows a line record can repeat its line for.
+MAX_LINE_REPEAT = 256
+
+
+class EncodedPage:
+  """A page placed at its own size, its encoded lines copied as they are."""
+
+  def __init__(self, raster_obj, data, start, info):
+    self.raster = raster_obj
+    self.data = data
+    self.start = start
+    self.unit, self.units = line_units(info['bits_per_pixel'], info['width'])
+    self.height = info['height']
+    mode = pil_mode(info['color_kind'], info['bits_per_pixel'])
+    self.fill = white_pixel(mode, info['color_kind'] == 'BLACK') * self.unit
+
+  def records(self):
+    """Yield the (encoded line, rows) of the page."""
+    y = 0
+    i = self.start
+    try:
+      while y < self.height:
+        rows = min(ord(self.data[i]) + 1, self.height - y)
+        line, i = self.line_(i + 1)
+        yield line, rows
+        y += rows
+    except IndexError:
+      raise ValueError('Truncated input')
+
+  def line_(self, i):
+    """The encoded line starting at i, and its end.
+
+    A fill code (0x80) would fill the rest of the sheet line, so it becomes
+    white runs to the edge of the page.
+    """
+    data = self.data
+    start = i
+    x = 0
+    while x < self.units:
+      code = ord(data[i])
+      if code == 0x80:
+        white = self.raster.encode_runs_(
+            [(self.fill, self.units - x, True)], self.unit)
+        return data[start:i] + white, i + 1
+      elif code < 0x80:
+        x += code + 1
+        i += 1 + self.unit
+      else:
+        x += 257 - code
+        i += 1 + (257 - code) * self.unit
+    if i > len(data):
+      raise IndexError(i)
+    return data[start:i], i
+
+
+class ScaledPage:
+  """A page placed at another size, decoded, scaled and encoded in bands.
+
+  Bilevel pages are scaled in gray and thresholded back, and padded with
+  white to whole bytes, so they sit on byte boundaries of the sheet.
+  """
+
+  def __init__(self, raster_obj, data, start, info, size):
+    self.raster = raster_obj
+    self.data = data
+    self.start = start
+    self.info = info
+    self.size = size
+    self.mode = pil_mode(info['color_kind'], info['bits_per_pixel'])
+    self.unit, self.units = line_units(info['bits_per_pixel'], size[0])
+    self.height = size[1]
+
+  def bands(self):
+    """Yield the page at its placed size, in bands of up to BAND_ROWS rows."""
+    return scale_bands(
+        self.raster.decode_bands_(self.data, self.start, self.info),
+        self.mode,
+        (self.info['width'], self.info['height']),
+        self.size)
+
+  def records(self):
+    """Yield the (encoded line, rows) of the page."""
+    inverted = self.info['color_kind'] == 'BLACK'
+    padded_width = self.units * 8 if self.mode == '1' else self.size[0]
+    for band in self.bands():
+      if band.width != padded_width:
+        padded = Image.new(self.mode, (padded_width, band.height), 'white')
+        padded.paste(band, (0, 0))
+        band = padded
+      for line in self.raster.encode_band_lines_(band, inverted):
+        yield line, 1
+
+
+def merge_records(records):
+  """Join consecutive records of the same line."""
+  last, rows = None, 0
+  for line, count in records:
+    if line == last:
+      rows += count
+      continue
+    if last is not None:
+      yield last, rows
+    last, rows = line, count
+  if last is not None:
+    yield last, rows
+
+
+class Placement:
+  """A page at (left, top) of a sheet, left in compression units."""
+
+  def __init__(self, page, left, top):
+    self.left = left
+    self.top = top
+    self.width = page.units
+    self.height = page.height
+    self.records = merge_records(page.records())
+    self.line, self.remaining = None, 0
+
+  @property
+  def bottom(self):
+    return self.top + self.height
+
+  def advance(self, rows):
+    """Move down rows, which are never more than the line has left."""
+    self.remaining -= rows
+    if self.remaining <= 0:
+      self.line, self.remaining = next(self.records, (None, 0))
+
+
+def sheet_layout(page_size, layout, orientation='auto', sheet_size=None):
+  """Size of the sheet for pages of page_size, and its (columns, rows).
+
+  The sheet is sheet_size, by default the size of a page, turned whichever
+  way fits the pages largest, or the way orientation says.
+  """
+  columns, rows = GRIDS[2] if layout == 'booklet' else GRIDS[
+      int(layout[:-2])]
+  short, long_side = sorted(sheet_size or page_size)
+  candidates = {
+    'portrait': ((short, long_side), (rows, columns)),
+    'landscape': ((long_side, short), (columns, rows)),
+  }
+
+  def fit(candidate):
+    (sheet_width, sheet_height), (grid_columns, grid_rows) = candidate
+    return min(
+        sheet_width // grid_columns / float(page_size[0]),
+        sheet_height // grid_rows / float(page_size[1]))
+
+  if orientation == 'auto':
+    # Ties go to the orientation of the pages.
+    source = 'portrait' if page_size[0] <= page_size[1] else 'landscape'
+    orientation = max(
+        [source] + [name for name in sorted(candidates) if name != source],
+        key=lambda name: fit(candidates[name]))
+  return candidates[orientation]
+
+
+def sheet_sides(page_count, layout):
+  """Page indexes on each side of each sheet, in grid order, None for blanks.
+
+  Booklets are padded to a multiple of 4 pages, and their sheets folded in
+  the middle and stacked read in order.
+  """
+  if layout != 'booklet':
+    per_side = int(layout[:-2])
+    return [
+        range(first, min(first + per_side, page_count))
+        for first in xrange(0, page_count, per_side)]
+
+  padded = -(-page_count // 4) * 4
+
+  def page(number):
+    return number - 1 if number <= page_count else None
+
+  sides = []
+  for sheet in xrange(padded // 4):
+    sides.append([page(padded - 2 * sheet), page(2 * sheet + 1)])
+    sides.append([page(2 * sheet + 2), page(padded - 2 * sheet - 1)])
+  return sides
+
+
+def place_page(raster_obj, data, start, info, cell):
+  """Placement of a page centered in a cell (left, top, width, height).
+
+  Pages that fit are copied in the encoded domain, larger ones scaled to
+  fit. Bilevel pages go on whole bytes, so they are scaled as well when
+  their lines end in padding bits.
+  """
+  cell_left, cell_top, cell_width, cell_height = cell
+  width, height = info['width'], info['height']
+  bilevel = info['bits_per_pixel'] < 8
+  if bilevel:
+    # The whole bytes inside the cell.
+    cell_right = (cell_left + cell_width) // 8 * 8
+    cell_left = -(-cell_left // 8) * 8
+    cell_width = cell_right - cell_left
+  scale = min(cell_width / float(width), cell_height / float(height))
+
+  if scale >= 1 and not (bilevel and width % 8):
+    page = EncodedPage(raster_obj, data, start, info)
+    size = (width, height)
+  else:
+    scale = min(scale, 1)
+    size = (
+        max(1, min(cell_width, int(width * scale))),
+        max(1, min(cell_height, int(height * scale))))
+    page = ScaledPage(raster_obj, data, start, info, size)
+
+  left = cell_left + (cell_width - size[0]) // 2
+  top = cell_top + (cell_height - size[1]) // 2
+  if bilevel:
+    left //= 8
+  return Placement(page, left, top)
+
+
+def write_sheet_body(output_file, raster_obj, placements, info):
+  """Write the body of a sheet of placed pages.
+
+  Each line record joins the current lines of the pages across the sheet,
+  with white runs between them, for as many rows as none of them changes.
+  Returns the ImageBox of the sheet, that of the placed pages.
+  """
+  width, height = info['width'], info['height']
+  unit, units = line_units(info['bits_per_pixel'], width)
+  pixels_per_unit = 8 if info['bits_per_pixel'] < 8 else 1
+  mode = pil_mode(info['color_kind'], info['bits_per_pixel'])
+  fill = white_pixel(mode, info['color_kind'] == 'BLACK') * unit
+  placements = sorted(placements, key=lambda placement: placement.left)
+
+  white_lines = {}
+  def white(count):
+    if count not in white_lines:
+      white_lines[count] = raster_obj.encode_runs_(
+          [(fill, count, True)], unit)
+    return white_lines[count]
+
+  image_box = ImageBox()
+  y = 0
+  while y < height:
+    active = [
+        placement for placement in placements
+        if placement.top <= y < placement.bottom]
+    for placement in active:
+      if placement.remaining <= 0:
+        placement.advance(0)
+    rows = min(
+        [height - y, MAX_LINE_REPEAT]
+        + [placement.top - y for placement in placements if placement.top > y]
+        + [placement.bottom - y for placement in active]
+        + [placement.remaining for placement in active])
+
+    parts = [chr(rows - 1)]
+    x = 0
+    for placement in active:
+      if placement.left > x:
+        parts.append(white(placement.left - x))
+      parts.append(placement.line)
+      x = placement.left + placement.width
+    if x < units:
+      parts.append(white(units - x))
+    output_file.write(''.join(parts))
+
+    for _ in xrange(rows):
+      if active:
+        image_box.add_row(
+            active[0].left * pixels_per_unit, min(width, x * pixels_per_unit))
+      else:
+        image_box.add_row()
+    for placement in active:
+      placement.advance(rows)
+    y += rows
+  return image_box
+
+
+def impose_file(
+    input_file, output_file, layout='2up', orientation='auto', media=None):
+  """Put several pages of a raster file on each side of a sheet.
+
+  N-up layouts fill a grid of pages left to right, top to bottom. Booklets
+  are 2-up sheets, printed two-sided short edge, to be folded and stapled
+  in the middle. Sheets are of media, see MEDIA_SIZES, at the resolution
+  of the first page, by default the size of the first page. Pages that fit
+  their cell, as A4 pages 2-up on A3, are copied without decoding them,
+  the others are decoded, scaled and encoded a band at a time. Returns the
+  number of sheet sides.
+  """
+  if layout not in LAYOUTS:
+    raise ValueError('Unknown layout {}'.format(layout))
+  if media is not None and media not in MEDIA_SIZES:
+    raise ValueError('Unknown media {}'.format(media))
+  raster_obj = Raster.create_best_raster(input_file)
+  if raster_obj is None:
+    raise ValueError('Unrecognised input format')
+  target = Raster.create_best_raster(output_file)
+  if target is None or target.__class__ != raster_obj.__class__:
+    raise ValueError('Output must be in the format of the input')
+
+  data = map_file(input_file)
+  try:
+    pages = [
+        (raster_obj.page_info_(), start)
+        for start, end in raster_obj.read_pages_(data)
+        ]
+  except IndexError:
+    raise ValueError('Truncated input')
+  if not pages:
+    raise ValueError('No pages')
+  first, first_start = pages[0]
+  for info, _ in pages:
+    if (info['color_kind'], info['bits_per_pixel']) != (
+        first['color_kind'], first['bits_per_pixel']):
+      raise ValueError('Pages of different pixel formats')
+
+  sheet_size = None
+  if media is not None:
+    sheet_size = [
+        mm / 25.4 * resolution
+        for mm, resolution in zip(MEDIA_SIZES[media], first['resolution'])]
+  (sheet_width, sheet_height), (columns, rows) = sheet_layout(
+      (first['width'], first['height']), layout, orientation, sheet_size)
+  if media is None:
+    cell_width, cell_height = sheet_width // columns, sheet_height // rows
+  else:
+    # Cells rounded to pixels as pages of their size are, see page_geometry,
+    # so those pages fit them whole.
+    cell_width = int(round(sheet_width / columns))
+    cell_height = int(round(sheet_height / rows))
+    sheet_width, sheet_height = cell_width * columns, cell_height * rows
+  sides = sheet_sides(len(pages), layout)
+  sheet_info = dict(
+      first,
+      width=sheet_width,
+      height=sheet_height,
+      total_page_count=len(sides))
+  if layout == 'booklet':
+    sheet_info.update(duplex=True, tumble=True)
+
+  header_size = raster_obj.page_header_size
+  with open(output_file, 'wb') as output:
+    raster_obj.write_file_header_(output, len(sides))
+    for side in sides:
+      placements = []
+      for cell, index in enumerate(side):
+        if index is None:
+          continue
+        info, start = pages[index]
+        placements.append(place_page(
+            raster_obj, data, start, info, (
+                cell % columns * cell_width,
+                cell // columns * cell_height,
+                cell_width,
+                cell_height)))
+
+      # Headers of the first page, laid out as the sheet.
+      raster_obj.decode_page_header_(
+          data[first_start - header_size:first_start])
+      raster_obj.set_page_info_(sheet_info)
+      if media is not None:
+        raster_obj.page_size_name = media
+      header_start = output.tell()
+      raster_obj.encode_page_header_(output)
+      image_box = write_sheet_body(output, raster_obj, placements, sheet_info)
+
+      # As in Raster.encode_page_bands_, the header goes again with the box.
+      body_end = output.tell()
+      raster_obj.set_image_box_(image_box)
+      output.seek(header_start)
+      raster_obj.encode_page_header_(output)
+      output.seek(body_end)
+  return len(sides)
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(
+      description='Put several pages of a PWG or URF file on each sheet.')
+
+  parser.add_argument('input', help='Input raster file')
+  parser.add_argument('output', help='Output raster file, of the same format')
+  parser.add_argument('--layout', choices=LAYOUTS, default='2up')
+  parser.add_argument(
+      '--sheet', choices=ORIENTATIONS, default='auto',
+      help='Sheet orientation, by default whichever fits the pages largest')
+  parser.add_argument(
+      '--media', choices=sorted(MEDIA_SIZES),
+      help='Sheet media, by default the size of the first page')
+
+  args = parser.parse_args()
+
+  start = time.time()
+  try:
+    sides = impose_file(
+        args.input, args.output, args.layout, args.sheet, args.media)
+  except ValueError as error:
+    exit(str(error))
+  print('{} sheet sides in {:.2f}s'.format(sides, time.time() - start))
@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from PIL import Image
+from PIL import ImageChops
+from PIL import ImageDraw
+from PIL import ImageStat
+
+import impose
+from raster import PWG
+from raster import URF
+from raster import decode_file
+from raster import validate_file
+from raster_test import test_image
+from raster_test import write_pages
+
+
+def decode_pages(path, tmp_dir):
+  output_path = os.path.join(tmp_dir, 'side-%d.png')
+  pages = decode_file(path, output_path)
+  return [
+      Image.open(output_path % page_number)
+      for page_number in range(1, pages + 1)]
+
+
+class TestImpose(unittest.TestCase):
+
+  def setUp(self):
+    self.tmp_dir = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.tmp_dir)
+
+  def test_sheet_sides(self):
+    self.assertEqual(
+        impose.sheet_sides(5, '4up'), [[0, 1, 2, 3], [4]])
+    self.assertEqual(
+        impose.sheet_sides(6, 'booklet'),
+        [[None, 0], [1, None], [5, 2], [3, 4]])
+
+  def test_sheet_layout(self):
+    # Portrait pages go 2-up on a landscape sheet, 4-up on a portrait one.
+    self.assertEqual(
+        impose.sheet_layout((210, 297), '2up'), ((297, 210), (2, 1)))
+    self.assertEqual(
+        impose.sheet_layout((210, 297), '4up'), ((210, 297), (2, 2)))
+    self.assertEqual(
+        impose.sheet_layout((210, 297), '2up', 'portrait'),
+        ((210, 297), (1, 2)))
+    self.assertEqual(
+        impose.sheet_layout((210, 297), '2up', sheet_size=(297, 420)),
+        ((420, 297), (2, 1)))
+
+  def test_nup(self):
+    pwg_path = os.path.join(self.tmp_dir, 'in.pwg')
+    first = test_image((400, 300)).resize((400, 300))
+    ImageDraw.Draw(first).ellipse((50, 50, 350, 250), fill='blue')
+    small = [test_image((150, 40 + 20 * n)) for n in range(4)]
+    write_pages(PWG(), pwg_path, [first] + small)
+
+    output_path = os.path.join(self.tmp_dir, 'out.pwg')
+    self.assertEqual(impose.impose_file(pwg_path, output_path, '4up'), 2)
+    self.assertEqual(validate_file(output_path), [])
+    sides = decode_pages(output_path, self.tmp_dir)
+    self.assertEqual([side.size for side in sides], [(400, 300)] * 2)
+
+    # Small pages copied as they are, centered in their cells.
+    for index, img in enumerate(small, 1):
+      side = sides[index // 4]
+      cell = index % 4
+      left = cell % 2 * 200 + (200 - img.width) // 2
+      top = cell // 2 * 150 + (150 - img.height) // 2
+      placed = side.crop((left, top, left + img.width, top + img.height))
+      self.assertEqual(placed.tobytes(), img.tobytes())
+    self.assertEqual(
+        sides[1].crop((200, 0, 400, 300)).getextrema(), ((255, 255),) * 3)
+
+    # The first page scaled down to its cell.
+    scaled = first.resize((200, 150), Image.LANCZOS)
+    difference = ImageChops.difference(
+        sides[0].crop((0, 0, 200, 150)), scaled)
+    self.assertLess(max(ImageStat.Stat(difference).mean), 2)
+
+  def test_media(self):
+    """A4 pages 2-up on A3 are copied as they are, never scaled."""
+    pwg_path = os.path.join(self.tmp_dir, 'in.pwg')
+    # A4 at 20 DPI.
+    levels = [30, 90, 150]
+    write_pages(
+        PWG(), pwg_path,
+        [Image.new('L', (165, 234), level) for level in levels],
+        'GRAY', 8, resolution=(20, 20))
+
+    output_path = os.path.join(self.tmp_dir, 'out.pwg')
+    scaled_page = impose.ScaledPage
+    def refuse(*args):
+      raise AssertionError('Page scaled')
+    impose.ScaledPage = refuse
+    try:
+      self.assertEqual(
+          impose.impose_file(
+              pwg_path, output_path, '2up', media='iso_a3_297x420mm'),
+          2)
+    finally:
+      impose.ScaledPage = scaled_page
+    self.assertEqual(validate_file(output_path), [])
+    sides = decode_pages(output_path, self.tmp_dir)
+    self.assertEqual([side.size for side in sides], [(330, 234)] * 2)
+    self.assertEqual(sides[0].crop((0, 0, 165, 234)).getextrema(), (30, 30))
+    self.assertEqual(sides[0].crop((165, 0, 330, 234)).getextrema(), (90, 90))
+    self.assertEqual(sides[1].getpixel((80, 100)), 150)
+
+    with self.assertRaises(ValueError):
+      impose.impose_file(pwg_path, output_path, media='iso_a0_841x1189mm')
+
+  def test_fill_codes(self):
+    """Lines ending in the fill code are copied up to the page edge."""
+    pwg = PWG()
+    pwg_path = os.path.join(self.tmp_dir, 'in.pwg')
+    write_pages(pwg, pwg_path, [Image.new('L', (40, 30), 255)], 'GRAY', 8)
+    with open(pwg_path, 'ab') as pwg_file:
+      pwg.set_page_info_(dict(pwg.page_info_(), width=10, height=4))
+      pwg.encode_page_header_(pwg_file)
+      # 4 rows of 3 black pixels, then white.
+      pwg_file.write('\x03\x02\x00\x80')
+
+    output_path = os.path.join(self.tmp_dir, 'out.pwg')
+    impose.impose_file(pwg_path, output_path, '2up', 'landscape')
+    self.assertEqual(validate_file(output_path), [])
+    side, = decode_pages(output_path, self.tmp_dir)
+    self.assertEqual(side.size, (40, 30))
+    expected = Image.new('L', (40, 30), 255)
+    expected.paste(0, (25, 13, 28, 17))
+    # The blank first page scaled to its cell stays blank.
+    self.assertEqual(side.tobytes(), expected.tobytes())
+
+  def test_booklet(self):
+    urf_path = os.path.join(self.tmp_dir, 'in.urf')
+    levels = [10, 50, 90, 130, 170]
+    write_pages(
+        URF(), urf_path,
+        [Image.new('L', (80, 100), level) for level in levels],
+        'GRAY', 8)
+
+    output_path = os.path.join(self.tmp_dir, 'out.urf')
+    self.assertEqual(impose.impose_file(urf_path, output_path, 'booklet'), 4)
+    self.assertEqual(validate_file(output_path), [])
+    urf = URF()
+    data = open(output_path).read()
+    list(urf.read_pages_(data))
+    info = urf.page_info_()
+    self.assertTrue(info['duplex'])
+    self.assertTrue(info['tumble'])
+    self.assertEqual(info['total_page_count'], 4)
+
+    sides = decode_pages(output_path, self.tmp_dir)
+    self.assertEqual([side.size for side in sides], [(100, 80)] * 4)
+    order = [[8, 1], [2, 7], [6, 3], [4, 5]]
+    for side, pages in zip(sides, order):
+      for cell, page in enumerate(pages):
+        level = levels[page - 1] if page <= len(levels) else 255
+        self.assertEqual(side.getpixel((cell * 50 + 25, 40)), level)
+
+  def test_bilevel(self):
+    pwg_path = os.path.join(self.tmp_dir, 'in.pwg')
+    img = Image.new('1', (101, 60), 1)
+    ImageDraw.Draw(img).rectangle((20, 10, 80, 50), fill=0)
+    write_pages(PWG(), pwg_path, [img] * 2, 'BLACK', 1)
+
+    output_path = os.path.join(self.tmp_dir, 'out.pwg')
+    impose.impose_file(pwg_path, output_path, '2up', 'landscape')
+    self.assertEqual(validate_file(output_path), [])
+    side, = decode_pages(output_path, self.tmp_dir)
+    self.assertEqual(side.size, (101, 60))
+    # Cells of whole bytes, 48 pixels wide from 0 and 56.
+    self.assertEqual(side.getpixel((24, 30)), 0)
+    self.assertEqual(side.getpixel((80, 30)), 0)
+    self.assertEqual(side.getpixel((52, 30)), 255)
+    self.assertEqual(side.getpixel((25, 5)), 255)
+
+  def test_errors(self):
+    pwg_path = os.path.join(self.tmp_dir, 'in.pwg')
+    write_pages(PWG(), pwg_path, [test_image()])
+    with self.assertRaises(ValueError):
+      impose.impose_file(pwg_path, os.path.join(self.tmp_dir, 'out.urf'))
+    with self.assertRaises(ValueError):
+      impose.impose_file(pwg_path, pwg_path + '.pwg', '3up')
+
+    data = open(pwg_path).read()
+    with open(pwg_path, 'wb') as pwg_file:
+      pwg_file.write(data[:-20])
+    with self.assertRaises(ValueError):
+      impose.impose_file(pwg_path, os.path.join(self.tmp_dir, 'out.pwg'))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+
+import re
+import struct
+
+
+# Job request attributes checked against printer capabilities:
+# (attribute group, attribute, "-supported" printer attribute).
+JOB_ATTRIBUTES = [
+  ('operation', 'document-format', 'document-format-supported'),
+  ('operation', 'compression', 'compression-supported'),
+  ('job', 'sides', 'sides-supported'),
+  ('job', 'print-quality', 'print-quality-supported'),
+  ('job', 'print-scaling', 'print-scaling-supported'),
+]
+
+# PWG page header fields, from the start of the file [PWG5102.4].
+PWG_HEADER_SIZE = 4 + 1796
+PWG_PAGE_SIZE = 4 + 352 # PageSize, in points
+PWG_RESOLUTION = 4 + 276 # HWResolution
+PWG_BITS_PER_COLOR = 4 + 384
+PWG_COLOR_SPACE = 4 + 400
+
+# "pwg-raster-document-type-supported" color spaces, by cupsColorSpace.
+PWG_TYPES = {
+  1: 'rgb',
+  3: 'black',
+  6: 'cmyk',
+  18: 'sgray',
+  19: 'srgb',
+  20: 'adobe-rgb',
+}
+
+# URF page header fields, from the start of the file.
+URF_HEADER_SIZE = 12 + 32
+URF_BITS_PER_PIXEL = 12
+URF_COLOR_SPACE = 13
+URF_RESOLUTION = 12 + 20
+
+# "urf-supported" keywords, by (color space, bits per pixel).
+URF_TYPES = {
+  (0, 8): 'W8',
+  (1, 24): 'SRGB24',
+  (3, 24): 'ADOBERGB24',
+}
+
+RESOLUTION_PER_CM = 4
+# Fraction a resolution may be off one the printer supports.
+RESOLUTION_TOLERANCE = 0.01
+
+# Media size names end in their dimensions [PWG5101.1].
+MEDIA_SIZE = re.compile(r'_([\d.]+)x([\d.]+)(mm|in)$')
+# Millimeters a page may be off the media size.
+MEDIA_TOLERANCE = 1.0
+
+
+class Preflight:
+  """Outcome of checking a job against the capabilities of a printer.
+
+  Problems are what the printer doesn't support. Unknown are the printer
+  attributes it doesn't report, leaving the check inconclusive.
+  """
+
+  def __init__(self):
+    self.problems = []
+    self.unknown = []
+
+  @property
+  def conclusive(self):
+    return not self.unknown
+
+  def check(self, name, value, supported):
+    if supported is None:
+      self.unknown.append(name)
+    elif value not in supported:
+      self.problems.append('{} {!r} not supported'.format(name, value))
+
+
+def supported_values(capabilities, name):
+  """Values of a printer attribute, None if the printer doesn't report it."""
+  try:
+    return [value for (_, value) in capabilities.printer[name]]
+  except (AttributeError, KeyError):
+    return None
+
+
+def unpack_resolution(value):
+  """(cross feed, feed) DPI of an IPP resolution value [RFC2910] 3.9."""
+  cross_feed, feed, units = struct.unpack('>iib', value)
+  if units == RESOLUTION_PER_CM:
+    return cross_feed * 2.54, feed * 2.54
+  return cross_feed, feed
+
+
+def resolution_supported(resolution, resolutions):
+  # 600 DPI is reported as 236 dots/cm, that is 599.44 DPI.
+  return any(
+      all(abs(a - b) <= b * RESOLUTION_TOLERANCE
+          for a, b in zip(resolution, supported))
+      for supported in resolutions)
+
+
+def media_mm(name):
+  """(width, height) in millimeters of a media size name, None if not sized."""
+  match = MEDIA_SIZE.search(name)
+  if not match:
+    return None
+  scale = 25.4 if match.group(3) == 'in' else 1.0
+  return (
+      round(float(match.group(1)) * scale, 1),
+      round(float(match.group(2)) * scale, 1))
+
+
+def check_media(result, page_mm, media_supported):
+  if media_supported is None:
+    result.unknown.append('media-supported')
+    return
+  # In either orientation.
+  page_mm = sorted(page_mm)
+  for name in media_supported:
+    size = media_mm(name)
+    if size and all(
+        abs(a - b) <= MEDIA_TOLERANCE for a, b in zip(sorted(size), page_mm)):
+      return
+  result.problems.append(
+      'media of {:.0f}x{:.0f}mm not supported'.format(*page_mm))
+
+
+def check_pwg(result, capabilities, head):
+  resolution = struct.unpack(
+      '>II', head[PWG_RESOLUTION:PWG_RESOLUTION + 8])
+  resolutions = supported_values(
+      capabilities, 'pwg-raster-document-resolution-supported')
+  if resolutions is None:
+    result.unknown.append('pwg-raster-document-resolution')
+  elif not resolution_supported(
+      resolution, [unpack_resolution(value) for value in resolutions]):
+    result.problems.append(
+        'pwg-raster-document-resolution {}x{}dpi not supported'.format(
+            *resolution))
+
+  color_space, = struct.unpack(
+      '>I', head[PWG_COLOR_SPACE:PWG_COLOR_SPACE + 4])
+  bits_per_color, = struct.unpack(
+      '>I', head[PWG_BITS_PER_COLOR:PWG_BITS_PER_COLOR + 4])
+  result.check(
+      'pwg-raster-document-type',
+      '{}_{}'.format(
+          PWG_TYPES.get(color_space, color_space), bits_per_color),
+      supported_values(capabilities, 'pwg-raster-document-type-supported'))
+
+  page_size = struct.unpack('>II', head[PWG_PAGE_SIZE:PWG_PAGE_SIZE + 8])
+  check_media(
+      result,
+      [points * 25.4 / 72 for points in page_size],
+      supported_values(capabilities, 'media-supported'))
+
+
+def check_urf(result, capabilities, head):
+  urf_supported = supported_values(capabilities, 'urf-supported')
+  if urf_supported is None:
+    result.unknown.append('urf-supported')
+    return
+
+  resolutions = []
+  for keyword in urf_supported:
+    if keyword.startswith('RS'):
+      resolutions.extend(int(dpi) for dpi in keyword[2:].split('-'))
+  dpi, = struct.unpack('>I', head[URF_RESOLUTION:URF_RESOLUTION + 4])
+  result.check('urf resolution', dpi, resolutions)
+
+  urf_type = URF_TYPES.get(
+      (ord(head[URF_COLOR_SPACE]), ord(head[URF_BITS_PER_PIXEL])))
+  if urf_type is None:
+    result.unknown.append('urf type')
+  else:
+    result.check('urf type', urf_type, urf_supported)
+
+
+def check(capabilities, request, head=None):
+  """Check a job request, and the head of its raster document if given.
+
+  Capabilities are the Get-Printer-Attributes response of the printer.
+  Raster documents are checked by the header of their first page.
+  """
+  result = Preflight()
+  for group, name, supported in JOB_ATTRIBUTES:
+    try:
+      value = getattr(request, group)[name][0][1]
+    except KeyError:
+      continue
+    result.check(name, value, supported_values(capabilities, supported))
+
+  if head is None:
+    return result
+  if head[:4] == 'RaS2' and len(head) >= PWG_HEADER_SIZE:
+    check_pwg(result, capabilities, head)
+  elif head[:8] == 'UNIRAST\0' and len(head) >= URF_HEADER_SIZE:
+    check_urf(result, capabilities, head)
+  return result
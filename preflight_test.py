@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+
+import struct
+import unittest
+
+from pkipplib import pkipplib
+
+import preflight
+import transports
+from fake_printer import FakePrinter
+from fake_printer import IPP_SERVICE_UNAVAILABLE
+from fake_printer import pack_resolution
+from print import get_attributes
+from print import get_status_code
+from print import job_request
+from print import send_job
+
+
+class Capabilities:
+
+  def __init__(self, **attributes):
+    self.printer = dict(
+        (name.replace('_', '-'), values)
+        for name, values in attributes.items())
+
+
+def pwg_head(dpi=300, color_space=18, bits_per_color=8, page_size=(595, 842)):
+  header = bytearray(1796)
+  header[276:284] = struct.pack('>II', dpi, dpi)
+  header[352:360] = struct.pack('>II', *page_size)
+  header[384:388] = struct.pack('>I', bits_per_color)
+  header[400:404] = struct.pack('>I', color_space)
+  return 'RaS2' + str(header)
+
+
+def urf_head(dpi=300, color_space=1, bits_per_pixel=24):
+  header = bytearray(32)
+  header[0] = bits_per_pixel
+  header[1] = color_space
+  header[20:24] = struct.pack('>I', dpi)
+  return 'UNIRAST\0' + struct.pack('>I', 1) + str(header)
+
+
+def request(document_format='image/pwg-raster', compression='none'):
+  return job_request(
+      pkipplib.CUPS(url='http://127.0.0.1:631'), pkipplib.IPP_PRINT_JOB,
+      'job', 'user', compression, document_format)
+
+
+PWG_CAPABILITIES = Capabilities(
+    document_format_supported=[('mimeMediaType', 'image/pwg-raster')],
+    sides_supported=[
+      ('keyword', 'one-sided'), ('keyword', 'two-sided-short-edge')],
+    print_quality_supported=[('enum', 4), ('enum', 5)],
+    print_scaling_supported=[('keyword', 'none')],
+    pwg_raster_document_resolution_supported=[
+      ('resolution', pack_resolution(300, 300)),
+      # 600 DPI, per centimeter.
+      ('resolution', pack_resolution(236, 236, 4)),
+    ],
+    pwg_raster_document_type_supported=[('keyword', 'sgray_8')],
+    media_supported=[
+      ('keyword', 'iso_a4_210x297mm'), ('keyword', 'na_letter_8.5x11in')],
+    )
+
+
+class TestPreflight(unittest.TestCase):
+
+  def test_pwg(self):
+    result = preflight.check(PWG_CAPABILITIES, request(), pwg_head())
+    self.assertEqual((result.problems, result.unknown), ([], []))
+    self.assertTrue(result.conclusive)
+
+    # Letter, landscape.
+    result = preflight.check(
+        PWG_CAPABILITIES, request(), pwg_head(600, page_size=(792, 612)))
+    self.assertEqual(result.problems, [])
+
+    result = preflight.check(
+        PWG_CAPABILITIES, request(compression='gzip'),
+        pwg_head(1200, 19, 8, (288, 432)))
+    self.assertEqual(len(result.problems), 3)
+    self.assertIn("pwg-raster-document-type 'srgb_8' not supported",
+                  result.problems)
+    self.assertIn('media of 102x152mm not supported', result.problems)
+    # Not reported by the printer, left to Validate-Job.
+    self.assertEqual(result.unknown, ['compression'])
+
+  def test_job_attributes(self):
+    result = preflight.check(
+        PWG_CAPABILITIES, request(document_format='image/urf'))
+    self.assertEqual(
+        result.problems, ["document-format 'image/urf' not supported"])
+
+  def test_urf(self):
+    capabilities = Capabilities(
+        urf_supported=[('keyword', 'RS300-600'), ('keyword', 'W8')])
+    result = preflight.check(capabilities, request(), urf_head(300, 0, 8))
+    self.assertEqual(result.problems, [])
+
+    result = preflight.check(capabilities, request(), urf_head(150))
+    self.assertEqual(result.problems, [
+        'urf resolution 150 not supported',
+        "urf type 'SRGB24' not supported",
+    ])
+
+  def test_media_mm(self):
+    self.assertEqual(preflight.media_mm('iso_a4_210x297mm'), (210.0, 297.0))
+    self.assertEqual(preflight.media_mm('na_letter_8.5x11in'), (215.9, 279.4))
+    self.assertIsNone(preflight.media_mm('roll_max'))
+
+  def test_send_job(self):
+    printer = FakePrinter()
+    # Leaves the check inconclusive.
+    del printer.attributes['print-scaling-supported']
+    printer.start()
+    try:
+      capabilities = get_attributes(printer.url, ['all'])
+      response = send_job(
+          printer.url, urf_head(150) + '\xff' * 100000,
+          document_format='image/urf', capabilities=capabilities)
+      self.assertEqual(
+          get_status_code(response), transports.IPP_ATTRIBUTES_NOT_SUPPORTED)
+      self.assertEqual(printer.jobs, {})
+
+      # Inconclusive, and the printer refuses jobs in Validate-Job.
+      printer.stopped = True
+      response = send_job(
+          printer.url, urf_head(300) + '\xff' * 100000,
+          document_format='image/urf', capabilities=capabilities)
+      self.assertEqual(get_status_code(response), IPP_SERVICE_UNAVAILABLE)
+      self.assertEqual(
+          [operation for operation, _, _, _, _ in printer.requests],
+          ['Get-Printer-Attributes', 'Validate-Job'])
+
+      printer.stopped = False
+      response = send_job(
+          printer.url, urf_head(300) + '\xff' * 100000,
+          document_format='image/urf', capabilities=capabilities)
+      self.assertEqual(get_status_code(response), transports.IPP_OK)
+      self.assertEqual(len(printer.jobs), 1)
+    finally:
+      printer.shutdown()
+      printer.server_close()
+
+
+if __name__ == '__main__':
+  unittest.main()
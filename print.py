@@ -1,11 +1,19 @@
 #!/usr/bin/env python
 # -*- encoding: utf-8 -*-
 
+from __future__ import print_function
 
+import argparse
+import os.path
 import struct
+import time
+import zlib
 
 from pkipplib import pkipplib
 
+import preflight
+import transports
+
 # print-rendering-intent
 # print-content-optimize
 
@@ -318,30 +326,152 @@ def get_job(url, job_id):
   return printer.doRequest(request)
 
 
-def get_attributes(url):
+def get_attributes(
+    url,
+    requested_attributes=(
+        'printer-uri-supported',
+        'printer-type',
+        'member-uris',
+        ),
+    ):
   printer = pkipplib.CUPS(url=url)
+  return printer.doRequest(attributes_request(printer, requested_attributes))
+
 
+def attributes_request(printer, requested_attributes):
   request = printer.newRequest(pkipplib.IPP_GET_PRINTER_ATTRIBUTES)
   request.setVersion('2.0')
 
   request.operation['printer-uri'] = (
       'uri', printer.identifierToURI('ipp', 'print'))
 
-  request.operation['requested-attributes'] = (
-      'nameWithoutLanguage', 'printer-uri-supported')
-  request.operation['requested-attributes'] = (
-      'nameWithoutLanguage', 'printer-type')
-  request.operation['requested-attributes'] = (
-      'nameWithoutLanguage', 'member-uris')
+  for attribute in requested_attributes:
+    request.operation['requested-attributes'] = (
+        'nameWithoutLanguage', attribute)
 
-  return printer.doRequest(request)
+  return request
 
 
-def send_job(url, data, job_name='MyJobName', user_name='MyName'):
-  printer = pkipplib.CUPS(url=url)
+# "compression" (type3 keyword) values [RFC2911] and the zlib window bits
+# that produce their framing.
+COMPRESSION_WBITS = {
+  'gzip': 16 + zlib.MAX_WBITS, # [RFC1952]
+  'deflate': -zlib.MAX_WBITS, # [RFC1951]
+}
+
+# Preferred first; gzip carries a CRC32 of the document.
+COMPRESSION_PREFERENCE = ['gzip', 'deflate']
+
+# Link speeds, in bytes/second.
+# Above FAST_LINK_SPEED deflate costs more CPU time than it saves on the wire.
+# Below SLOW_LINK_SPEED upload time dominates and the extra CPU time of a
+# higher compression level pays for itself.
+FAST_LINK_SPEED = 40 * 1024 * 1024
+SLOW_LINK_SPEED = 2 * 1024 * 1024
+
+# Bytes uploaded to measure the link speed, enough for the upload time to
+# stand out from the round trip latency of a WAN link.
+LINK_SAMPLE_SIZE = 256 * 1024
+
+CHUNK_SIZE = 64 * 1024
+
+# "print-quality" (type2 enum) values [RFC2911] 4.2.13.
+PRINT_QUALITY_DRAFT = 3
+PRINT_QUALITY_NORMAL = 4
+
+# Status codes from here up are errors, client then server [RFC2911] 13.1.
+IPP_CLIENT_ERROR = 0x0400
 
-  request = printer.newRequest(pkipplib.IPP_PRINT_JOB)
-  #request = printer.newRequest(pkipplib.IPP_VALIDATE_JOB)
+# "document-format" (mimeMediaType) values by file extension.
+DOCUMENT_FORMATS = {
+  '.jpeg': 'image/jpeg',
+  '.jpg': 'image/jpeg',
+  '.pwg': 'image/pwg-raster',
+  '.urf': 'image/urf',
+}
+DEFAULT_DOCUMENT_FORMAT = 'image/pwg-raster'
+
+
+def guess_document_format(path):
+  """The "document-format" of a file, from its extension."""
+  extension = os.path.splitext(path)[1].lower()
+  return DOCUMENT_FORMATS.get(extension, DEFAULT_DOCUMENT_FORMAT)
+
+
+def measure_link_speed(url, sample_size=LINK_SAMPLE_SIZE):
+  """Estimate the upload speed to the printer in bytes/second.
+
+  Get-Printer-Attributes is timed bare, then followed by sample_size bytes
+  of random data, which the printer reads and ignores as the operation
+  takes no document. The difference is the time the sample took to upload,
+  without the round trip latency. None when the printer can't be reached.
+  """
+  printer = pkipplib.CUPS(url=url)
+  preamble = attributes_request(printer, ['printer-state']).dump()
+  # Random, so that nothing on the way can compress it.
+  sample = os.urandom(sample_size)
+  seconds = []
+  for chunks in ([], [sample]):
+    start = time.time()
+    if transports.post_ipp(printer.url, preamble, chunks=chunks) is None:
+      return None
+    seconds.append(time.time() - start)
+  return sample_size / max(seconds[1] - seconds[0], 1e-6)
+
+
+def choose_compression(compression_supported, link_speed=None):
+  """Choose a (compression, level) pair for the given printer and link."""
+  for compression in COMPRESSION_PREFERENCE:
+    if compression in compression_supported:
+      break
+  else:
+    return ('none', 0)
+
+  if link_speed is None:
+    return (compression, 6)
+  elif link_speed >= FAST_LINK_SPEED:
+    return ('none', 0)
+  elif link_speed >= SLOW_LINK_SPEED:
+    return (compression, 1)
+  return (compression, 6)
+
+
+def read_chunks(input_file, chunk_size=CHUNK_SIZE):
+  """Yield the contents of a file in chunks."""
+  while True:
+    chunk = input_file.read(chunk_size)
+    if not chunk:
+      return
+    yield chunk
+
+
+def compress_chunks(chunks, compression='none', level=6):
+  """Compress an iterable of data chunks incrementally."""
+  if compression in (None, 'none'):
+    for chunk in chunks:
+      yield chunk
+    return
+
+  compressor = zlib.compressobj(
+      level, zlib.DEFLATED, COMPRESSION_WBITS[compression])
+  for chunk in chunks:
+    compressed = compressor.compress(chunk)
+    if compressed:
+      yield compressed
+  yield compressor.flush()
+
+
+def job_request(
+    printer,
+    operation,
+    job_name,
+    user_name,
+    compression,
+    document_format,
+    print_quality=PRINT_QUALITY_NORMAL,
+    ):
+  """Request of a job operation, Print-Job or Validate-Job, without data."""
+  request = printer.newRequest(operation)
   request.setVersion('2.0')
 
   # -*- Operation attributes -*-
@@ -373,14 +503,15 @@ def send_job(url, data, job_name='MyJobName', user_name='MyName'):
   
   # "compression" (type3 keyword):
   # The client OPTIONALLY supplies this attribute.
-  
+  if compression not in (None, 'none'):
+    request.operation['compression'] = (
+        'keyword', compression)
+
   # "document-format" (mimeMediaType):
   # The client OPTIONALLY supplies this attribute.
-  request.operation['document-format'] = [
-    ('mimeMediaType', 'image/jpeg'), # 0
-    ('mimeMediaType', 'image/urf'), # 1
-    ('mimeMediaType', 'image/pwg-raster'), # 2
-  ][2]
+  # image/jpeg, image/urf or image/pwg-raster, see DOCUMENT_FORMATS.
+  request.operation['document-format'] = (
+      'mimeMediaType', document_format)
 
   # "document-natural-language" (naturalLanguage)
   # The client OPTIONALLY supplies this attribute.
@@ -397,13 +528,8 @@ def send_job(url, data, job_name='MyJobName', user_name='MyName'):
 
   # -*- Job attributes -*-
 
-  '' ''
-  request.job['print-quality'] = [ #
-    #('enum', 3), # "Draft"
-    ('enum', 4), # "Standard"
-    ('enum', 5), # "High"
-  ][1]
-  '' ''
+  # 3: "draft", 4: "normal", 5: "high"
+  request.job['print-quality'] = ('enum', print_quality)
 
   request.job['sides'] = [ #
     ('keyword', 'one-sided'),
@@ -590,40 +716,190 @@ def send_job(url, data, job_name='MyJobName', user_name='MyName'):
   exit(0)
   ' '''
 
-  request.data = data
+  return request
 
-  return printer.doRequest(request)
+
+def validate_job(
+    url,
+    job_name='MyJobName',
+    user_name='MyName',
+    compression='none',
+    document_format=DEFAULT_DOCUMENT_FORMAT,
+    print_quality=PRINT_QUALITY_NORMAL,
+    ):
+  """Validate-Job, the attributes of a Print-Job without its document."""
+  printer = pkipplib.CUPS(url=url)
+  return printer.doRequest(job_request(
+      printer, pkipplib.IPP_VALIDATE_JOB, job_name, user_name, compression,
+      document_format, print_quality))
+
+
+def document_head(data):
+  """Start of the document data, enough for its first page header.
+
+  None for iterables of chunks, which can't be read twice.
+  """
+  if hasattr(data, 'fileno'):
+    data.seek(0)
+    head = data.read(preflight.PWG_HEADER_SIZE)
+    data.seek(0)
+    return head
+  if isinstance(data, str):
+    return data[:preflight.PWG_HEADER_SIZE]
+  return None
+
+
+def send_job(
+    url,
+    data,
+    job_name='MyJobName',
+    user_name='MyName',
+    compression='none',
+    compression_level=6,
+    document_format=DEFAULT_DOCUMENT_FORMAT,
+    copies=1,
+    capabilities=None,
+    print_quality=PRINT_QUALITY_NORMAL,
+    pages=None,
+    reverse=False,
+    ):
+  """Print-Job the document data, a string, an iterable of chunks or a file.
+
+  Files are sent straight from the file to the socket when uncompressed.
+  Other data, and compressed files, are streamed as they are compressed,
+  see transports.post_ipp. Files can be sent as collated copies, or only some of their pages, in
+  reverse order even, see transports.document_parts. Pages are ranges of
+  page numbers, see transports.parse_page_ranges.
+  socket:// and lpd:// URLs skip IPP, streaming the data as it is, see
+  transports.send.
+
+  Given the printer capabilities, a Get-Printer-Attributes response, the
+  job is checked before any of the document is sent, see preflight.check,
+  and with Validate-Job when the capabilities fall short. Rejected jobs
+  return the response rejecting them.
+  """
+  if transports.is_raw_url(url):
+    return transports.send(
+        url, data, job_name, user_name, document_format, copies, pages,
+        reverse)
+
+  printer = pkipplib.CUPS(url=url)
+
+  request = job_request(
+      printer, pkipplib.IPP_PRINT_JOB, job_name, user_name, compression,
+      document_format, print_quality)
+
+  if capabilities is not None:
+    result = preflight.check(capabilities, request, document_head(data))
+    if result.problems:
+      return transports.Response(
+          transports.IPP_ATTRIBUTES_NOT_SUPPORTED, '; '.join(result.problems))
+    if not result.conclusive:
+      response = validate_job(
+          url, job_name, user_name, compression, document_format,
+          print_quality)
+      status_code = get_status_code(response)
+      if status_code is None or status_code >= IPP_CLIENT_ERROR:
+        return response
+
+  if hasattr(data, 'fileno'):
+    parts = transports.document_parts(
+        data, document_format, copies, pages, reverse)
+    if compression in (None, 'none'):
+      return parse_response(
+          transports.post_ipp(printer.url, request.dump(), data, parts))
+    data = transports.document_chunks(data, parts)
+  elif copies != 1 or pages or reverse:
+    raise ValueError('Copies and pages need a document file')
+  elif isinstance(data, str):
+    data = [data]
+  # Compressed on the way out, a chunk at a time.
+  return parse_response(transports.post_ipp(
+      printer.url, request.dump(),
+      chunks=compress_chunks(data, compression, compression_level)))
+
+
+def parse_response(body):
+  """IPP response of a body from transports.post_ipp, None without one."""
+  if body is None:
+    return None
+  response = pkipplib.IPPRequest(body)
+  response.parse()
+  return response
+
+
+def get_status_code(response):
+  """Status code of a response, None when the request never got through."""
+  if response is None:
+    return None
+  return response.operation_id
+
+
+# The attribute getters below look values up and catch the failure, as
+# pkipplib attribute groups raise KeyError rather than support `in`. A None
+# response raises AttributeError.
 
 
 def get_status(response):
   try:
-    if 'status-message' in response.operation:
-      return response.operation['status-message'][0][1]
-  except:
+    return response.operation['status-message'][0][1]
+  except (AttributeError, KeyError, IndexError):
     return None
 
 
 def get_job_state_reason(response):
   try:
-    if 'job-state-reasons' in response.job:
-      return response.job['job-state-reasons'][0][1]
-  except:
+    return response.job['job-state-reasons'][0][1]
+  except (AttributeError, KeyError, IndexError):
     return None
 
 
 def get_job_id(response):
   try:
-    if 'job-id' in response.job:
-      return response.job['job-id'][0][1]
-  except:
+    return response.job['job-id'][0][1]
+  except (AttributeError, KeyError, IndexError):
     return None
 
 
-if __name__ == '__main__':
-  import sys
-  data = open(sys.argv[1], 'rb').read()
+def get_printer_attribute(response, name):
+  """Return the list of values of a printer attribute in a response."""
+  try:
+    return [value for (_, value) in response.printer[name]]
+  except (AttributeError, KeyError):
+    return []
 
-  URL = 'http://192.168.2.165:631'
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(
+      description='Send raster files to an IPP printer.')
+
+  parser.add_argument('input', help='Input file')
+  parser.add_argument(
+      '--url', default='http://192.168.2.165:631', help='Printer URL')
+  parser.add_argument(
+      '--compression',
+      choices=['none', 'auto'] + sorted(COMPRESSION_WBITS),
+      default='none',
+      help='Document compression, "auto" to negotiate with the printer')
+  parser.add_argument(
+      '--link-speed', type=float,
+      help='Link speed in bytes/second, measured when not given')
+  parser.add_argument(
+      '--copies', type=int, default=1,
+      help='Collated copies, the pages of the document sent again')
+  parser.add_argument(
+      '--pages', type=transports.parse_page_ranges,
+      help='Pages to send, like 40-45,50, out of a PWG or URF document')
+  parser.add_argument(
+      '--reverse', action='store_true',
+      help='Send the pages last first, for face-up output bins')
+  parser.add_argument(
+      '--preflight', action='store_true',
+      help='Check the job against the printer capabilities before sending it')
+
+  args = parser.parse_args()
+
+  URL = args.url
   # printer-uri-supported : [('uri', 'ipp://192.168.2.165/ipp/print')]
 
   #Job attributes :
@@ -635,7 +911,32 @@ if __name__ == '__main__':
   #print(get_attributes(URL))
   #exit(0)
 
-  response = send_job(URL, data)
+  compression, compression_level = args.compression, 6
+  if compression == 'auto':
+    link_speed = args.link_speed
+    if link_speed is None:
+      link_speed = measure_link_speed(URL)
+    compression, compression_level = choose_compression(
+        get_printer_attribute(
+            get_attributes(URL, ['compression-supported']),
+            'compression-supported'),
+        link_speed)
+    print('Compression: {} level {} (link speed {} B/s)'.format(
+        compression, compression_level, link_speed))
+
+  with open(args.input, 'rb') as input_file:
+    response = send_job(
+        URL,
+        input_file,
+        compression=compression,
+        compression_level=compression_level,
+        document_format=guess_document_format(args.input),
+        copies=args.copies,
+        pages=args.pages,
+        reverse=args.reverse,
+        capabilities=(
+            get_attributes(URL, ['all']) if args.preflight else None),
+        )
   print(response)
 
   print(get_status(response))
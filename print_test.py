@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+
+import gzip
+import unittest
+import zlib
+import StringIO
+
+from fake_printer import FakePrinter
+from print import choose_compression
+from print import compress_chunks
+from print import guess_document_format
+from print import measure_link_speed
+from print import FAST_LINK_SPEED
+from print import SLOW_LINK_SPEED
+
+
+class TestPrint(unittest.TestCase):
+
+  def test_choose_compression(self):
+    self.assertEqual(choose_compression([]), ('none', 0))
+    self.assertEqual(choose_compression(['none', 'compress']), ('none', 0))
+    self.assertEqual(
+        choose_compression(['none', 'deflate']), ('deflate', 6))
+    self.assertEqual(
+        choose_compression(['deflate', 'gzip'], FAST_LINK_SPEED), ('none', 0))
+    self.assertEqual(
+        choose_compression(['deflate', 'gzip'], SLOW_LINK_SPEED), ('gzip', 1))
+    self.assertEqual(
+        choose_compression(['deflate', 'gzip'], SLOW_LINK_SPEED - 1),
+        ('gzip', 6))
+
+  def test_measure_link_speed(self):
+    printer = FakePrinter()
+    printer.start()
+    try:
+      self.assertGreater(measure_link_speed(printer.url, 64 * 1024), 0)
+      bare, sampled = [request[3] for request in printer.requests]
+      self.assertEqual(sampled - bare, 64 * 1024)
+    finally:
+      printer.shutdown()
+      printer.server_close()
+    self.assertIsNone(measure_link_speed(printer.url))
+
+  def test_guess_document_format(self):
+    self.assertEqual(guess_document_format('a/photo.JPG'), 'image/jpeg')
+    self.assertEqual(guess_document_format('page.urf'), 'image/urf')
+    self.assertEqual(guess_document_format('page.pwg'), 'image/pwg-raster')
+    self.assertEqual(guess_document_format('page'), 'image/pwg-raster')
+
+  def test_compress_chunks(self):
+    chunks = ['\x00\xff\xff\xff' * 1000, 'abc', '\x7f\x00\x00\x00' * 1000]
+    data = ''.join(chunks)
+
+    self.assertEqual(''.join(compress_chunks(chunks, 'none')), data)
+
+    deflated = ''.join(compress_chunks(chunks, 'deflate'))
+    self.assertEqual(zlib.decompress(deflated, -zlib.MAX_WBITS), data)
+
+    gzipped = ''.join(compress_chunks(chunks, 'gzip', 1))
+    self.assertLess(len(gzipped), len(data))
+    self.assertEqual(
+        gzip.GzipFile(fileobj=StringIO.StringIO(gzipped)).read(), data)
+
+
+if __name__ == '__main__':
+  unittest.main()
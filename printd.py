@@ -0,0 +1,245 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+from __future__ import print_function
+
+import SocketServer
+import argparse
+import json
+import multiprocessing
+import os
+import socket
+import threading
+import time
+
+# Imported once, here, so that neither requests nor the encoder workers forked
+# from this process pay for importing PIL and pkipplib.
+import raster
+
+from print import choose_compression
+from print import get_attributes
+from print import get_job
+from print import get_job_id
+from print import get_job_state_reason
+from print import get_printer_attribute
+from print import get_status
+from print import get_status_code
+from print import guess_document_format
+from print import send_job
+from transports import is_raw_url
+
+
+DEFAULT_SOCKET = os.environ.get(
+    'PRINTD_SOCKET', '/tmp/open-print-stack.sock')
+
+
+def encode_job(input_file, output_file, blank_pages=None):
+  """Encode in an encoder process, with the row cache counters of the process.
+
+  Each encoder keeps its own raster.ROW_CACHE, warm over the jobs it takes.
+  """
+  suppressed = raster.encode_file(input_file, output_file, blank_pages)
+  return suppressed, raster.ROW_CACHE.stats()
+
+
+class CapabilityCache:
+  """Printer attributes by printer URL, refetched after `ttl` seconds."""
+
+  def __init__(self, ttl=300.0):
+    self.ttl = ttl
+    self.lock = threading.Lock()
+    self.entries = {}
+
+  def get(self, url):
+    with self.lock:
+      entry = self.entries.get(url)
+    if entry and time.time() - entry[0] < self.ttl:
+      return entry[1]
+
+    response = get_attributes(url, ['all'])
+    if response is None:
+      return None
+    with self.lock:
+      self.entries[url] = (time.time(), response)
+    return response
+
+
+class PrintDaemon(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+  """Long-running encoder and sender, serving JSON requests on a socket.
+
+  Each request is one line of JSON with an "action" of "encode", "send" or
+  "status", answered by one line of JSON.
+  """
+
+  daemon_threads = True
+
+  def __init__(self, socket_path=DEFAULT_SOCKET, encoders=None):
+    if os.path.exists(socket_path):
+      os.remove(socket_path)
+    SocketServer.UnixStreamServer.__init__(
+        self, socket_path, PrintDaemonHandler)
+    self.socket_path = socket_path
+    self.started = time.time()
+    self.capabilities = CapabilityCache()
+    self.encoders = multiprocessing.Pool(encoders)
+
+    self.lock = threading.Lock()
+    self.counts = {}
+
+  def count(self, action):
+    with self.lock:
+      self.counts[action] = self.counts.get(action, 0) + 1
+
+  def server_close(self):
+    SocketServer.UnixStreamServer.server_close(self)
+    self.encoders.terminate()
+    if os.path.exists(self.socket_path):
+      os.remove(self.socket_path)
+
+  def encode(self, message):
+    suppressed, row_cache = self.encoders.apply(
+        encode_job,
+        (message['input'], message['output'], message.get('blank_pages')))
+    return {'blank_pages_suppressed': suppressed, 'row_cache': row_cache}
+
+  def send(self, message):
+    url = message['url']
+    compression = message.get('compression', 'none')
+    compression_level = 6
+    if compression == 'auto':
+      compression, compression_level = choose_compression(
+          get_printer_attribute(
+              self.capabilities.get(url), 'compression-supported'),
+          message.get('link_speed'))
+
+    # Jobs the printer can't take are refused before the upload.
+    capabilities = None
+    if message.get('preflight', True) and not is_raw_url(url):
+      capabilities = self.capabilities.get(url)
+
+    with open(message['input'], 'rb') as input_file:
+      response = send_job(
+          url,
+          input_file,
+          job_name=message.get('job_name', 'MyJobName'),
+          user_name=message.get('user_name', 'MyName'),
+          compression=compression,
+          compression_level=compression_level,
+          document_format=guess_document_format(message['input']),
+          copies=message.get('copies', 1),
+          capabilities=capabilities,
+          )
+    return {
+      'status_code': get_status_code(response),
+      'status': get_status(response),
+      'job_id': get_job_id(response),
+    }
+
+  def status(self, message):
+    if 'url' in message and 'job_id' in message:
+      response = get_job(message['url'], message['job_id'])
+      return {
+        'status_code': get_status_code(response),
+        'job_state_reason': get_job_state_reason(response),
+      }
+    with self.lock:
+      counts = dict(self.counts)
+    return {
+      'uptime': time.time() - self.started,
+      'requests': counts,
+      'cached_printers': sorted(self.capabilities.entries),
+    }
+
+
+class PrintDaemonHandler(SocketServer.StreamRequestHandler):
+
+  def handle(self):
+    for line in iter(self.rfile.readline, ''):
+      try:
+        # pkipplib builds requests from byte strings, not unicode.
+        message = dict(
+            (str(key), str(value) if isinstance(value, unicode) else value)
+            for key, value in json.loads(line).items())
+        action = message.get('action')
+        if action not in ('encode', 'send', 'status'):
+          raise ValueError('Unknown action: {}'.format(action))
+        self.server.count(action)
+        reply = getattr(self.server, action)(message)
+        reply['ok'] = True
+      except Exception as error:
+        reply = {'ok': False, 'error': str(error)}
+      self.wfile.write(json.dumps(reply) + '\n')
+      self.wfile.flush()
+
+
+def request(message, socket_path=DEFAULT_SOCKET):
+  """Send one request to the daemon and return its reply."""
+  client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+  client.connect(socket_path)
+  try:
+    client.sendall(json.dumps(message) + '\n')
+    return json.loads(client.makefile().readline())
+  finally:
+    client.close()
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(
+      description='Raster and print daemon, and its client.')
+  parser.add_argument(
+      '--socket', default=DEFAULT_SOCKET, help='Daemon Unix socket path')
+  subparsers = parser.add_subparsers(dest='action')
+
+  serve_parser = subparsers.add_parser('serve', help='Run the daemon')
+  serve_parser.add_argument(
+      '--encoders', type=int, help='Encoder processes, default one per CPU')
+
+  encode_parser = subparsers.add_parser('encode', help='Encode an image')
+  encode_parser.add_argument('input', help='Input file')
+  encode_parser.add_argument('output', help='Output file')
+  encode_parser.add_argument(
+      '--blank-pages', choices=['minimal'],
+      help='Encode blank pages minimally')
+
+  send_parser = subparsers.add_parser('send', help='Send a raster file')
+  send_parser.add_argument('url', help='Printer URL')
+  send_parser.add_argument('input', help='Input file')
+  send_parser.add_argument('--job-name', default='MyJobName')
+  send_parser.add_argument('--user-name', default='MyName')
+  send_parser.add_argument('--copies', type=int, default=1)
+  send_parser.add_argument(
+      '--no-preflight', dest='preflight', action='store_false',
+      help="Don't check the job against the printer capabilities first")
+  send_parser.add_argument(
+      '--compression', choices=['none', 'auto', 'deflate', 'gzip'],
+      default='none')
+
+  status_parser = subparsers.add_parser(
+      'status', help='Daemon status, or job status given a printer and job')
+  status_parser.add_argument('url', nargs='?', help='Printer URL')
+  status_parser.add_argument('job_id', nargs='?', type=int, help='Job id')
+
+  args = parser.parse_args()
+
+  if args.action == 'serve':
+    daemon = PrintDaemon(args.socket, args.encoders)
+    print('Listening on {}'.format(args.socket))
+    try:
+      daemon.serve_forever()
+    except KeyboardInterrupt:
+      pass
+    finally:
+      daemon.server_close()
+    exit(0)
+
+  message = dict(
+      (key, value) for key, value in vars(args).items()
+      if value is not None and key != 'socket')
+  for key in ('input', 'output'):
+    if key in message:
+      message[key] = os.path.abspath(message[key])
+
+  reply = request(message, args.socket)
+  print(json.dumps(reply, indent=2, sort_keys=True))
+  if not reply['ok']:
+    exit(1)
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from PIL import Image
+
+from fake_printer import FakePrinter
+from printd import PrintDaemon
+from printd import request
+
+
+class TestPrintDaemon(unittest.TestCase):
+
+  def setUp(self):
+    self.tmp_dir = tempfile.mkdtemp()
+    self.socket_path = os.path.join(self.tmp_dir, 'printd.sock')
+    self.daemon = PrintDaemon(self.socket_path, encoders=1)
+    thread = threading.Thread(target=self.daemon.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+  def tearDown(self):
+    self.daemon.shutdown()
+    self.daemon.server_close()
+    shutil.rmtree(self.tmp_dir)
+
+  def test_encode_send_status(self):
+    image_path = os.path.join(self.tmp_dir, 'image.png')
+    raster_path = os.path.join(self.tmp_dir, 'image.urf')
+    Image.new('RGB', (16, 8), (255, 0, 0)).save(image_path, dpi=(300, 300))
+
+    reply = request(
+        {'action': 'encode', 'input': image_path, 'output': raster_path},
+        self.socket_path)
+    self.assertTrue(reply['ok'])
+    self.assertEqual(open(raster_path).read(8), 'UNIRAST\0')
+    # All 8 rows are the same.
+    self.assertGreaterEqual(reply['row_cache']['hits'], 7)
+
+    printer = FakePrinter()
+    printer.start()
+    reply = request(
+        {'action': 'send', 'url': printer.url, 'input': raster_path,
+         'compression': 'auto'},
+        self.socket_path)
+    printer.shutdown()
+    printer.server_close()
+    self.assertTrue(reply['ok'])
+    self.assertEqual(reply['status_code'], 0)
+    self.assertEqual(reply['job_id'], 1)
+    self.assertEqual(printer.jobs[1].compression, 'gzip')
+
+    reply = request({'action': 'status'}, self.socket_path)
+    self.assertEqual(reply['requests'], {'encode': 1, 'send': 1, 'status': 1})
+    self.assertEqual(reply['cached_printers'], [printer.url])
+
+  def test_error(self):
+    reply = request({'action': 'encode', 'input': 'a.png', 'output': 'a.txt'},
+                    self.socket_path)
+    self.assertEqual(
+        reply, {'ok': False, 'error': 'Unrecognised output format'})
+
+
+if __name__ == '__main__':
+  unittest.main()
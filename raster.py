@@ -4,12 +4,24 @@ from __future__ import print_function
 
 import StringIO
 import argparse
+import collections
+import math
+import mmap
+import re
+import shutil
 import struct
+import threading
 import os.path
 
 from PIL import Image
 from PIL import ImageDraw
 
+import color
+import halftone
+import strips
+import tolerance
+import writers
+
 
 COLOR_SPACE_ENUM = {
   1: 'Rgb', # Device RGB (red green blue)
@@ -42,6 +54,84 @@ PRINT_QUALITY_ENUM = {
   5: 'High',
 }
 
+PWG_PAGE_HEADER_SIZE = 1796
+URF_PAGE_HEADER_SIZE = 32
+
+# Kind of pixel for each color space, so PWG and URF pages can be compared.
+PWG_COLOR_KINDS = {
+  1: 'RGB',
+  3: 'BLACK',
+  6: 'CMYK',
+  18: 'GRAY',
+  19: 'RGB',
+  20: 'RGB',
+}
+PWG_COLOR_SPACES = {'RGB': 19, 'BLACK': 3, 'CMYK': 6, 'GRAY': 18}
+
+URF_COLOR_KINDS = {
+  0: 'GRAY', # sGray
+  1: 'RGB', # sRGB
+  3: 'RGB', # AdobeRGB
+  4: 'GRAY', # Device gray
+  5: 'RGB', # Device RGB
+  6: 'CMYK', # Device CMYK
+}
+URF_COLOR_SPACES = {'GRAY': 0, 'RGB': 1, 'CMYK': 6}
+
+# PIL modes holding each kind of pixel.
+# Black is stored inverted, as PIL's 0 is black and the printer's is no ink.
+PIL_MODES = {'RGB': 'RGB', 'GRAY': 'L', 'BLACK': 'L', 'CMYK': 'CMYK'}
+INVERT_TABLE = ''.join(chr(255 - i) for i in range(256))
+
+# Rows decoded or encoded at a time, bounding memory use per page.
+BAND_ROWS = 256
+
+COPY_CHUNK_SIZE = 1024 * 1024
+
+# Media sizes by PWG self-describing name, in millimeters.
+MEDIA_SIZES = {
+  'iso_a3_297x420mm': (297, 420),
+  'iso_a4_210x297mm': (210, 297),
+  'iso_a5_148x210mm': (148, 210),
+  'na_letter_8.5x11in': (215.9, 279.4),
+  'na_legal_8.5x14in': (215.9, 355.6),
+}
+DEFAULT_MEDIA = 'iso_a4_210x297mm'
+
+# HWResolution values to choose from, as in the printer attribute
+# "pwg-raster-document-resolution-supported".
+DEFAULT_RESOLUTIONS = (300, 600)
+
+# How far above a resolution a source may be and still be printed at it.
+RESOLUTION_TOLERANCE = 0.05
+
+# CutMedia "AfterPage".
+CUT_MEDIA_AFTER_PAGE = 4
+
+# Bytes of raw and encoded rows kept by the row cache.
+ROW_CACHE_BYTES = 32 * 1024 * 1024
+
+# Mirrors the bits of an octet, for flipping bilevel lines.
+BIT_REVERSE_TABLE = ''.join(
+    chr(int('{:08b}'.format(i)[::-1], 2)) for i in range(256))
+
+# CrossFeedTransform and FeedTransform values.
+TRANSFORM_NORMAL = 1
+TRANSFORM_REVERSED = 0xFFFFFFFF # -1
+
+# Transforms of the back side of a duplex sheet, by "pwg-raster-document-
+# sheet-back" value and Tumble, as (horizontal flip, vertical flip).
+SHEET_BACK_TRANSFORMS = {
+  ('normal', False): (False, False),
+  ('normal', True): (False, False),
+  ('flipped', False): (False, True),
+  ('flipped', True): (True, False),
+  ('rotated', False): (True, True),
+  ('rotated', True): (False, False),
+  ('manual-tumble', False): (False, False),
+  ('manual-tumble', True): (True, True),
+}
+
 
 def to_b(byte_str):
   """Convert byte str to signed char."""
@@ -52,8 +142,289 @@ def to_B(byte_str):
   return struct.unpack('B', byte_str)[0]
 
 
+def map_file(file_path):
+  """Read-only view of a file's contents, without reading it all in."""
+  with open(file_path, 'rb') as input_file:
+    return map_file_object(input_file)
+
+
+def map_file_object(input_file):
+  """map_file, for a file already open."""
+  if os.fstat(input_file.fileno()).st_size == 0:
+    return ''
+  return mmap.mmap(input_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def line_units(bits_per_pixel, width):
+  """Bytes per compression unit, and units per line.
+
+  Below 8 bits per pixel the unit of compression is the octet.
+  """
+  if bits_per_pixel < 8:
+    return 1, (bits_per_pixel * width + 7) // 8
+  return bits_per_pixel // 8, width
+
+
+def pil_mode(kind, bits_per_pixel):
+  """PIL mode for a kind of pixel."""
+  if bits_per_pixel == 1:
+    return '1'
+  return PIL_MODES[kind]
+
+
+def image_dpi(img, default=72):
+  """Horizontal resolution of an image, from its metadata."""
+  dpi = img.info.get('dpi')
+  if not dpi or not dpi[0]:
+    return default
+  return int(round(dpi[0]))
+
+
+def page_geometry(source_size, source_dpi, media_mm, resolutions):
+  """Lay out a source image on media, at the lowest resolution that keeps
+  its detail.
+
+  The source is placed at its physical size, shrunk to fit the media if it
+  is larger. Returns (resolution, media size, placed size), sizes in pixels
+  at that resolution.
+  """
+  media_inches = [mm / 25.4 for mm in media_mm]
+  source_inches = [pixels / float(source_dpi) for pixels in source_size]
+  scale = min(1.0, *[m / s for m, s in zip(media_inches, source_inches)])
+  placed_inches = [inches * scale for inches in source_inches]
+
+  # Source pixels per inch of paper.
+  effective_dpi = source_size[0] / placed_inches[0]
+  resolutions = sorted(resolutions)
+  resolution = next(
+      (r for r in resolutions
+       if effective_dpi <= r * (1 + RESOLUTION_TOLERANCE)),
+      resolutions[-1])
+
+  media_size = tuple(int(round(i * resolution)) for i in media_inches)
+  placed_size = tuple(
+      max(1, min(int(round(i * resolution)), m))
+      for i, m in zip(placed_inches, media_size))
+  if resolution == source_dpi and all(
+      abs(p - s) <= 1 for p, s in zip(placed_size, source_size)):
+    # Off by rounding only, the source is clipped rather than resampled.
+    placed_size = tuple(source_size)
+  return resolution, media_size, placed_size
+
+
+def reduce_on_load(img, size):
+  """Have an opened image decode at the smallest resolution of at least size.
+
+  JPEGs are scaled down by the DCT while decoding, with draft(). Other
+  formats are decoded whole, then reduced by a whole factor when this PIL
+  has Image.reduce.
+  """
+  if img.format == 'JPEG':
+    img.draft(img.mode, size)
+  elif hasattr(img, 'reduce'):
+    factor = min(s // t for s, t in zip(img.size, size))
+    if factor >= 2:
+      img = img.reduce(factor)
+  return img
+
+
+def image_bands(img, rows=BAND_ROWS):
+  """Yield an image as crops of `rows` rows, top to bottom."""
+  for y in xrange(0, img.height, rows):
+    yield img.crop((0, y, img.width, min(y + rows, img.height)))
+
+
+def scale_bands(bands, mode, source_size, size, rows=BAND_ROWS):
+  """Yield an image given as bands resampled to size, in bands of `rows`.
+
+  Each band is resampled from the source rows under it and enough rows
+  around them for the filter, so bands join without seams. Bilevel images
+  are resampled in gray and thresholded back. Missing source rows are
+  white.
+  """
+  width, height = source_size
+  scaled_width, scaled_height = size
+  work_mode = 'L' if mode == '1' else mode
+  scale = height / float(scaled_height)
+  margin = int(math.ceil(3 * max(scale, 1))) + 1
+
+  bands = iter(bands)
+  buffered = Image.new(work_mode, (width, 0))
+  buffered_top = 0
+  for top in xrange(0, scaled_height, rows):
+    bottom = min(top + rows, scaled_height)
+    need_top = max(0, int(top * scale) - margin)
+    need_bottom = min(height, int(math.ceil(bottom * scale)) + margin)
+
+    kept = buffered.crop((
+        0, min(need_top - buffered_top, buffered.height),
+        width, buffered.height))
+    parts = [kept]
+    buffered_rows = kept.height
+    while need_top + buffered_rows < need_bottom:
+      band = next(bands, None)
+      if band is None:
+        band = Image.new(
+            work_mode, (width, need_bottom - need_top - buffered_rows),
+            'white')
+      parts.append(band.convert(work_mode))
+      buffered_rows += band.height
+    buffered = Image.new(work_mode, (width, buffered_rows))
+    y = 0
+    for part in parts:
+      buffered.paste(part, (0, y))
+      y += part.height
+    buffered_top = need_top
+
+    band = buffered.resize(
+        (scaled_width, bottom - top),
+        Image.LANCZOS,
+        box=(0, top * scale - need_top, width, bottom * scale - need_top))
+    if mode == '1':
+      band = band.point(lambda value: 255 if value >= 128 else 0, '1')
+    yield band
+
+
+def white_pixel(mode, inverted=False):
+  """The raw byte of a white pixel of a PIL mode, once encoded."""
+  return '\x00' if inverted or mode == 'CMYK' else '\xff'
+
+
+class ImageBox:
+  """Bounding box of the non-white pixels of a page, found while encoding.
+
+  Edges are in pixels, right and bottom exclusive, as in the PWG ImageBox
+  fields. An empty box means a blank page.
+  """
+
+  def __init__(self):
+    self.rows = 0
+    self.left = None
+    self.top = None
+    self.right = None
+    self.bottom = None
+
+  @property
+  def empty(self):
+    return self.top is None
+
+  def add_row(self, left=None, right=None):
+    """Account for the next row, with its non-white extent if not blank."""
+    if left is not None:
+      if self.top is None:
+        self.top = self.rows
+        self.left, self.right = left, right
+      else:
+        self.left = min(self.left, left)
+        self.right = max(self.right, right)
+      self.bottom = self.rows + 1
+    self.rows += 1
+
+  def edges(self):
+    """(left, top, right, bottom), all 0 for a blank page."""
+    if self.empty:
+      return 0, 0, 0, 0
+    return self.left, self.top, self.right, self.bottom
+
+
+_RUN_PATTERNS = {}
+
+def run_pattern(bytes_per_pixel):
+  """Regex matching a run of identical pixels."""
+  if bytes_per_pixel not in _RUN_PATTERNS:
+    _RUN_PATTERNS[bytes_per_pixel] = re.compile(
+        '(.{{{}}})\\1*'.format(bytes_per_pixel), re.DOTALL)
+  return _RUN_PATTERNS[bytes_per_pixel]
+
+
+_RUN_TABLES = {}
+
+def run_tables(bytes_per_pixel):
+  """Pixels covered and bytes taken by a run, by its code.
+
+  0x80 fills the rest of the line, and takes no pixels here.
+  """
+  if bytes_per_pixel not in _RUN_TABLES:
+    pixels = [code + 1 for code in range(0x80)] + [0] + [
+        257 - code for code in range(0x81, 0x100)]
+    advance = [1 + bytes_per_pixel] * 0x80 + [1] + [
+        1 + (257 - code) * bytes_per_pixel for code in range(0x81, 0x100)]
+    _RUN_TABLES[bytes_per_pixel] = pixels, advance
+  return _RUN_TABLES[bytes_per_pixel]
+
+
+class RowCache:
+  """Encoded rows by raw row and pixel size, least recently used dropped.
+
+  Letterheads, rules, footers and blank lines repeat over pages and jobs,
+  and are only encoded once. Rows are their own keys, so that a hash
+  collision can't give the wrong row back.
+  """
+
+  def __init__(self, max_bytes=ROW_CACHE_BYTES):
+    self.max_bytes = max_bytes
+    self.lock = threading.Lock()
+    self.size = 0
+    self.rows = collections.OrderedDict()
+    self.hits = 0
+    self.misses = 0
+
+  def get(self, row, bytes_per_pixel):
+    key = (row, bytes_per_pixel)
+    with self.lock:
+      encoded = self.rows.pop(key, None)
+      if encoded is None:
+        self.misses += 1
+        return None
+      self.hits += 1
+      # Back at the most recently used end.
+      self.rows[key] = encoded
+    return encoded
+
+  def put(self, row, bytes_per_pixel, encoded):
+    cost = len(row) + len(encoded)
+    if cost > self.max_bytes:
+      return
+    with self.lock:
+      key = (row, bytes_per_pixel)
+      if key in self.rows:
+        return
+      self.rows[key] = encoded
+      self.size += cost
+      while self.size > self.max_bytes:
+        (old_row, _), old_encoded = self.rows.popitem(last=False)
+        self.size -= len(old_row) + len(old_encoded)
+
+  def stats(self):
+    return {'hits': self.hits, 'misses': self.misses, 'bytes': self.size}
+
+
+# Shared by all the pages and jobs of a process.
+ROW_CACHE = RowCache()
+
+
 class Raster:
 
+  # ICC profile pages are converted to, color.SRGB or a file path. None for
+  # device color, converted without color management.
+  target_profile = color.SRGB
+
+  rendering_intent = color.DEFAULT_INTENT
+
+  # Method pages are halftoned to 1-bit black with, see halftone.METHODS.
+  # None for continuous tone.
+  halftone = None
+
+  # Resolutions the printer supports, encode picks from them.
+  resolutions = DEFAULT_RESOLUTIONS
+
+  # tolerance.Tolerance snapping near-equal pixels before encoding, None
+  # for lossless pages.
+  tolerance = None
+
+  # Cache of encoded rows, None to encode every row.
+  row_cache = ROW_CACHE
+
   @staticmethod
   def guess_format(file_path):
     """Guess the format from the file path and potentially contents."""
@@ -103,101 +474,548 @@ class Raster:
     if height is None:
       height = img.height
 
-    x, y = 0, 0
-    i = 0
+    y = 0
+    rows = []
+    for row in self.decode_rows_(data, 0, width, height, bytes_per_pixel):
+      rows.append(row)
+      if len(rows) == BAND_ROWS:
+        img.paste(Image.frombytes(img.mode, (width, len(rows)), ''.join(rows)),
+                  (0, y))
+        y += len(rows)
+        rows = []
+    if rows:
+      img.paste(Image.frombytes(img.mode, (width, len(rows)), ''.join(rows)),
+                (0, y))
 
-    line_repeat = to_B(data[i])
-    i += 1
-    j = i
+    return img
 
-    while i < len(data) and y < height:
-      code = data[i]
-      code_int = to_b(data[i])
 
-      if code == '\x80':
-        #'FillRestOfLineWithFillByte'
+  def convert_img_(self, img, mode):
+    """Convert an image for encoding, honoring the rendering intent."""
+    return color.convert(
+        img,
+        mode,
+        self.target_profile,
+        self.rendering_intent or color.DEFAULT_INTENT,
+        )
+
 
-        pixels_left_in_line = width - x
+  def encode_packbits_like_(
+      self,
+      output_file,
+      img,
+      colorspace_str,
+      image_box=None,
+      ):
+    self.encode_bands_(
+        output_file, image_bands(img), colorspace_str, image_box)
+
+
+  def encode_bands_(self, output_file, bands, colorspace_str, image_box=None):
+    """Encode a page body from its bands of rows, top to bottom."""
+    # 1-bit pages are black, 1 for ink.
+    inverted = colorspace_str == '1'
+    for band in self.prepare_bands_(bands, colorspace_str):
+      self.encode_band_(
+          output_file, band, inverted=inverted, image_box=image_box)
+
+
+  def prepare_bands_(self, bands, colorspace_str):
+    """Halftone, convert and snap bands of rows to the pixels of the page."""
+    if self.halftone:
+      # Halftoned from gray, a band at a time.
+      bands = halftone.dither_bands(
+          (band if band.mode == 'L' else band.convert('L') for band in bands),
+          self.halftone)
+    for band in bands:
+      if band.mode != colorspace_str:
+        band = band.convert(colorspace_str)
+      if self.tolerance:
+        band = self.tolerance.apply(band)
+      yield band
+
+
+  def encode_band_(self, output_file, band_img, inverted=False, image_box=None):
+    """Encode the rows of a PIL image, one line each.
+
+    The non-white extent of each row is added to image_box, if given.
+    """
+    for line in self.encode_band_lines_(band_img, inverted, image_box):
+      output_file.write('\x00')
+      output_file.write(line)
+
+
+  def encode_band_lines_(self, band_img, inverted=False, image_box=None):
+    """Yield the encoded rows of a PIL image, without line repeat bytes."""
+    raw = band_img.tobytes()
+    if inverted:
+      raw = raw.translate(INVERT_TABLE)
+    row_bytes = len(raw) // band_img.height
+    unit = 1 if band_img.mode == '1' else row_bytes // band_img.width
+    # Bilevel rows are measured in whole bytes of 8 pixels.
+    pixels_per_byte = 8 if band_img.mode == '1' else 1
+    white = white_pixel(band_img.mode, inverted)
+    # Padding bits of bilevel rows don't count as content.
+    padding_bits = -band_img.width % 8 if band_img.mode == '1' else 0
+    padding_mask = (1 << padding_bits) - 1
+    for row_start in xrange(0, len(raw), row_bytes):
+      row = raw[row_start:row_start + row_bytes]
+      yield self.encode_line_(row, unit)
+      if image_box is None:
+        continue
+      if padding_bits:
+        last = ord(row[-1])
+        last = last | padding_mask if white == '\xff' else last & ~padding_mask
+        row = row[:-1] + chr(last)
+      content = row.lstrip(white)
+      if not content:
+        image_box.add_row()
+        continue
+      left = (len(row) - len(content)) // unit
+      right = (len(row.rstrip(white)) + unit - 1) // unit
+      image_box.add_row(
+          left * pixels_per_byte,
+          min(right * pixels_per_byte, band_img.width))
+
+
+  def encode_blank_body_(self, output_file, mode, size, inverted=False):
+    """Encode a white page of a PIL mode, as few line records as can be."""
+    width, height = size
+    bits_per_pixel = 1 if mode == '1' else 8 * len(mode)
+    unit, units = line_units(bits_per_pixel, width)
+    line = self.encode_line_(white_pixel(mode, inverted) * (unit * units), unit)
+    for y in xrange(0, height, 256):
+      output_file.write(chr(min(256, height - y) - 1))
+      output_file.write(line)
+
+
+  def encode_page_(self, output_file, img, colorspace_str, blank_pages=None):
+    """Encode a page header and body, setting the page image box.
+
+    Blank pages are kept as they are, unless blank_pages is 'minimal', to
+    encode them as runs of whole white lines. Returns 'minimal' for a blank
+    page encoded so, None for a page encoded as it is.
+    """
+    return self.encode_page_bands_(
+        output_file, img.size, image_bands(img), colorspace_str, blank_pages)
+
+
+  def encode_page_bands_(
+      self,
+      output_file,
+      size,
+      bands,
+      colorspace_str,
+      blank_pages=None,
+      ):
+    """encode_page_, for a page given as bands of rows."""
+    header_start = output_file.tell()
+    self.encode_page_header_(output_file)
+    body_start = output_file.tell()
+    image_box = ImageBox()
+    self.encode_bands_(output_file, bands, colorspace_str, image_box)
+    self.set_image_box_(image_box)
+    if self.tolerance:
+      self.tolerance.encoded_bytes += output_file.tell() - body_start
+
+    # The image box is only known now, rewrite the header with it.
+    body_end = output_file.tell()
+    output_file.seek(header_start)
+    self.encode_page_header_(output_file)
+    if image_box.empty and blank_pages == 'minimal':
+      self.encode_blank_body_(
+          output_file, colorspace_str, size, colorspace_str == '1')
+      output_file.truncate()
+      return blank_pages
+    output_file.seek(body_end)
+    return None
 
-        for _ in range(pixels_left_in_line):
-          img.putpixel((x, y), tuple([0xFF] * bytes_per_pixel))
-          x += 1
 
-        i += 1
+  def set_image_box_(self, image_box):
+    """Record the image box of the page in its header, if the format can."""
+    pass
 
-      elif code < '\x80':
-        #'copy single pixel and repeat it n+1 times'
 
-        repeat_times = code_int + 1
-        pixel = tuple([
-            to_B(b)
-            for b in
-            data[i + 1:i + 1 + bytes_per_pixel]
-            ])
+  def transform_image_box_(self, size, flip_h, flip_v, rotate=0):
+    """Move the image box of the page header with the pixels of the page.
 
-        for _ in range(repeat_times):
-          img.putpixel((x, y), pixel)
-          x += 1
+    size is that of the page before. Rotations, by 90 or 270 degrees, are
+    counterclockwise, as PIL's are, and flips are ignored with them, as in
+    transform_file.
+    """
+    pass
 
-        i += 1 + bytes_per_pixel
 
-      elif code > '\x80':
-        #'copy the following (-n)+1 pixels verbatim'
+  def encode_line_(self, row, bytes_per_pixel):
+    """Encode one line of raw pixels as runs, without the line repeat byte."""
+    if self.row_cache is not None:
+      encoded = self.row_cache.get(row, bytes_per_pixel)
+      if encoded is None:
+        encoded = self.encode_line_runs_(row, bytes_per_pixel)
+        self.row_cache.put(row, bytes_per_pixel, encoded)
+      return encoded
+    return self.encode_line_runs_(row, bytes_per_pixel)
 
-        repeat_pixels = (-code_int) + 1
 
-        for j in range(repeat_pixels):
-          pixel = tuple([
-              to_B(b)
-              for b in
-              data[i+1+(j*bytes_per_pixel):i+1+((1+j)*bytes_per_pixel)]
-              ])
-          img.putpixel((x, y), pixel)
-          x += 1
+  def encode_line_runs_(self, row, bytes_per_pixel):
+    """encode_line_, without the row cache."""
+    runs = []
+    for match in run_pattern(bytes_per_pixel).finditer(row):
+      pixel = match.group(1)
+      count = (match.end() - match.start()) // bytes_per_pixel
+      while count > 0:
+        # Don't overflow byte.
+        n = min(count, 128)
+        runs.append(chr(n - 1))
+        runs.append(pixel)
+        count -= n
+    return ''.join(runs)
 
-        i += 1 + bytes_per_pixel * repeat_pixels
 
-      if x >= width:
-        x = 0
-        y += 1
+  def decode_line_(self, data, i, width, bytes_per_pixel, fill='\xff'):
+    """Decode the runs of one line starting at i. Returns (row, end)."""
+    parts = []
+    x = 0
+    while x < width:
+      code = ord(data[i])
+      if code == 0x80:
+        #'FillRestOfLineWithFillByte'
+        parts.append(fill * ((width - x) * bytes_per_pixel))
+        x = width
+        i += 1
+      elif code < 0x80:
+        #'copy single pixel and repeat it n+1 times'
+        parts.append(data[i + 1:i + 1 + bytes_per_pixel] * (code + 1))
+        x += code + 1
+        i += 1 + bytes_per_pixel
+      else:
+        #'copy the following (-n)+1 pixels verbatim'
+        n = 257 - code
+        parts.append(data[i + 1:i + 1 + n * bytes_per_pixel])
+        x += n
+        i += 1 + n * bytes_per_pixel
+    return ''.join(parts), i
 
-        if line_repeat > 0:
-          i = j
-          line_repeat -= 1
-        elif i < len(data):
-          line_repeat = to_B(data[i])
-          i += 1
-          j = i
 
-    return img
+  def decode_rows_(
+      self, data, i, width, height, bytes_per_pixel, fill='\xff'):
+    """Yield the raw rows of a body starting at i, stopping if truncated."""
+    row_bytes = width * bytes_per_pixel
+    y = 0
+    while y < height and i < len(data):
+      line_repeat = ord(data[i])
+      try:
+        row, i = self.decode_line_(data, i + 1, width, bytes_per_pixel, fill)
+      except IndexError:
+        return
+      if len(row) < row_bytes:
+        return
+      row = row[:row_bytes]
+      for _ in range(min(line_repeat + 1, height - y)):
+        yield row
+        y += 1
 
 
-  def encode_packbits_like_(
-      self,
-      output_file,
-      img,
-      colorspace_str,
-      ):
-    img_out = img.convert(colorspace_str)
+  def skip_line_(self, data, i, width, bytes_per_pixel):
+    """Index just past the runs of one line starting at i."""
     x = 0
+    while x < width:
+      code = ord(data[i])
+      if code == 0x80:
+        x = width
+        i += 1
+      elif code < 0x80:
+        x += code + 1
+        i += 1 + bytes_per_pixel
+      else:
+        x += 257 - code
+        i += 1 + (257 - code) * bytes_per_pixel
+    return i
+
+
+  def skip_body_(self, data, i, width, height, bytes_per_pixel):
+    """Index just past a page body starting at i, without decoding pixels."""
+    y = 0
+    while y < height:
+      y += ord(data[i]) + 1
+      i = self.skip_line_(data, i + 1, width, bytes_per_pixel)
+    return i
+
+
+  def validate_body_(self, data, i, width, height, bytes_per_pixel):
+    """Walk the run codes of a page body starting at i, counting pixels.
+
+    Returns (index just past the body, problem or None). Nothing past a
+    problem can be trusted, not even where the next page starts.
+    """
+    pixels, advance = run_tables(bytes_per_pixel)
+    size = len(data)
     y = 0
-    to_x = 0
-    while y < img_out.height:
-      output_file.write(b'\x00')
-      while x < img_out.width:
-        pixel = img_out.getpixel((x, y))
-        to_x = x
-        while ((to_x+1) < img_out.width
-            and pixel == img_out.getpixel((to_x+1, y))
-            # Don't overflow byte.
-            and (to_x - x) < 127):
-          to_x += 1
-        output_file.write(chr(to_x - x))
-        for channel in pixel:
-          output_file.write(chr(channel))
-        x = to_x + 1
+    while y < height:
+      if i >= size:
+        return i, 'truncated at row {} of {}'.format(y, height)
+      row = y
+      y += ord(data[i]) + 1
+      if y > height:
+        return i, 'row {} repeated past the height of {}'.format(row, height)
+      i += 1
       x = 0
-      y += 1
+      while x < width:
+        if i >= size:
+          return i, 'truncated in row {}'.format(row)
+        code = ord(data[i])
+        i += advance[code]
+        if code == 0x80:
+          break
+        x += pixels[code]
+      else:
+        if x != width:
+          return i, 'row {} has {} of {} pixels'.format(row, x, width)
+      if i > size:
+        return i, 'truncated in row {}'.format(row)
+    return i, None
+
+
+  def validate_(self, data):
+    """Problems with the structure of raster data, see validate_file."""
+    if len(data) < self.file_header_size + self.page_header_size:
+      return ['No pages']
+    try:
+      self.decode_header_(data[:self.file_header_size + self.page_header_size])
+    except KeyError:
+      # Color space of the first page, reported with its header below.
+      pass
+    except Exception as error:
+      return [str(error)]
+
+    problems = []
+    pages = 0
+    i = self.file_header_size
+    while i + self.page_header_size <= len(data):
+      pages += 1
+      page_header = data[i:i + self.page_header_size]
+      try:
+        self.decode_page_header_(page_header)
+      except KeyError as error:
+        return problems + ['page {}: unknown color space {}'.format(
+            pages, error)]
+      header_problems = [
+          'page {}: {}'.format(pages, problem)
+          for problem in self.validate_page_header_(page_header)]
+      if header_problems:
+        # Bodies can't be walked without the page geometry.
+        return problems + header_problems
+
+      info = self.page_info_()
+      unit, units = line_units(info['bits_per_pixel'], info['width'])
+      i, problem = self.validate_body_(
+          data, i + self.page_header_size, units, info['height'], unit)
+      if problem:
+        return problems + ['page {}: {}'.format(pages, problem)]
+
+    if i < len(data):
+      problems.append('{} trailing bytes'.format(len(data) - i))
+    total_page_count = self.page_info_()['total_page_count']
+    if total_page_count != pages and (
+        total_page_count or not self.page_count_optional):
+      problems.append('{} pages, {} in the header'.format(
+          pages, total_page_count))
+    return problems
+
+
+  def decode_bands_(self, data, i, info):
+    """Yield a page body starting at i as images of up to BAND_ROWS rows.
+
+    Black pages come out as light, like the PIL modes of pil_mode. Bands
+    stop early if the body is truncated.
+    """
+    unit, units = line_units(info['bits_per_pixel'], info['width'])
+    mode = pil_mode(info['color_kind'], info['bits_per_pixel'])
+    inverted = info['color_kind'] == 'BLACK'
+    fill = white_pixel(mode, inverted)
+
+    def band(rows):
+      raw = ''.join(rows)
+      if inverted:
+        raw = raw.translate(INVERT_TABLE)
+      return Image.frombytes(mode, (info['width'], len(rows)), raw)
+
+    rows = []
+    for row in self.decode_rows_(data, i, units, info['height'], unit, fill):
+      rows.append(row)
+      if len(rows) == BAND_ROWS:
+        yield band(rows)
+        rows = []
+    if rows:
+      yield band(rows)
+
+
+  def transcode_body_(self, output_file, data, i, info, target):
+    """Re-encode a page body into another pixel format, a band at a time."""
+    target_mode = pil_mode(target['color_kind'], target['bits_per_pixel'])
+    for band in self.decode_bands_(data, i, info):
+      self.encode_band_(
+          output_file,
+          band.convert(target_mode),
+          inverted=target['color_kind'] == 'BLACK')
+
+
+  def line_runs_(self, data, i, width, bytes_per_pixel, fill='\xff'):
+    """Parse one line into (pixels, count, repeated) runs. Returns (runs, end)."""
+    runs = []
+    x = 0
+    while x < width:
+      code = ord(data[i])
+      if code == 0x80:
+        runs.append((fill * bytes_per_pixel, width - x, True))
+        x = width
+        i += 1
+      elif code < 0x80:
+        runs.append((data[i + 1:i + 1 + bytes_per_pixel], code + 1, True))
+        x += code + 1
+        i += 1 + bytes_per_pixel
+      else:
+        n = 257 - code
+        runs.append((data[i + 1:i + 1 + n * bytes_per_pixel], n, False))
+        x += n
+        i += 1 + n * bytes_per_pixel
+    return runs, i
+
+
+  def encode_runs_(self, runs, bytes_per_pixel):
+    """Encode (pixels, count, repeated) runs, without the line repeat byte."""
+    parts = []
+    for pixels, count, repeated in runs:
+      if repeated:
+        while count > 0:
+          n = min(count, 128)
+          parts.append(chr(n - 1))
+          parts.append(pixels)
+          count -= n
+        continue
+      for offset in xrange(0, count, 128):
+        n = min(count - offset, 128)
+        chunk = pixels[offset * bytes_per_pixel:(offset + n) * bytes_per_pixel]
+        # A single pixel can only be a run of one.
+        parts.append(chr(257 - n) if n > 1 else '\x00')
+        parts.append(chunk)
+    return ''.join(parts)
+
+
+  def reverse_runs_(self, runs, bytes_per_pixel, bilevel=False):
+    """Mirror a line of runs. Bilevel units are octets of 8 pixels."""
+    reversed_runs = []
+    for pixels, count, repeated in reversed(runs):
+      if not repeated:
+        if bytes_per_pixel == 1:
+          pixels = pixels[::-1]
+        else:
+          pixels = ''.join(reversed([
+              pixels[k:k + bytes_per_pixel]
+              for k in xrange(0, len(pixels), bytes_per_pixel)
+              ]))
+      if bilevel:
+        pixels = pixels.translate(BIT_REVERSE_TABLE)
+      reversed_runs.append((pixels, count, repeated))
+    return reversed_runs
+
+
+  def line_records_(self, data, i, width, height, bytes_per_pixel):
+    """(start, end) of each line record, line repeat byte included."""
+    records = []
+    y = 0
+    while y < height:
+      start = i
+      y += ord(data[i]) + 1
+      i = self.skip_line_(data, i + 1, width, bytes_per_pixel)
+      records.append((start, i))
+    return records
+
+
+  def transform_body_(self, output_file, data, i, info, flip_h, flip_v):
+    """Mirror a page body without decoding it.
+
+    Flipping vertically reorders the encoded lines, and flipping
+    horizontally reverses the runs of each line.
+    """
+    unit, units = line_units(info['bits_per_pixel'], info['width'])
+    bilevel = info['bits_per_pixel'] == 1
+    fill = '\x00' if info['color_kind'] == 'BLACK' else '\xff'
+
+    records = self.line_records_(data, i, units, info['height'], unit)
+    if flip_v:
+      records.reverse()
+    for start, end in records:
+      if not flip_h:
+        output_file.write(data[start:end])
+        continue
+      runs, _ = self.line_runs_(data, start + 1, units, unit, fill)
+      output_file.write(data[start])
+      output_file.write(
+          self.encode_runs_(self.reverse_runs_(runs, unit, bilevel), unit))
+
+
+  def rotate_body_(self, output_file, data, i, info, transpose):
+    """Rotate a page body through PIL, decoding it a band at a time.
+
+    For a quarter turn, each source band turned is a strip of every output
+    line. The strips are encoded as they come, and each line is joined from
+    its strips, so the page is only ever held encoded. Bilevel strips
+    don't end on whole bytes, so bilevel pages are turned whole, as are
+    half turns and flips: a bilevel page takes an eighth of the memory of
+    a gray one.
+    """
+    mode = pil_mode(info['color_kind'], info['bits_per_pixel'])
+    inverted = info['color_kind'] == 'BLACK'
+
+    if mode != '1' and transpose in (Image.ROTATE_90, Image.ROTATE_270):
+      # Encoded strips of each output line, top to bottom of the source.
+      lines = [[] for _ in xrange(info['width'])]
+      for band in self.decode_bands_(data, i, info):
+        for line, strip in zip(
+            lines,
+            self.encode_band_lines_(band.transpose(transpose), inverted)):
+          line.append(strip)
+      for line in lines:
+        if transpose == Image.ROTATE_270:
+          # Source rows go right to left.
+          line.reverse()
+        output_file.write('\x00')
+        output_file.write(''.join(line))
+      return
+
+    page = Image.new(mode, (info['width'], info['height']), 'white')
+    y = 0
+    for band in self.decode_bands_(data, i, info):
+      page.paste(band, (0, y))
+      y += band.height
+
+    page = page.transpose(transpose)
+    for y in xrange(0, page.height, BAND_ROWS):
+      self.encode_band_(
+          output_file,
+          page.crop((0, y, page.width, min(y + BAND_ROWS, page.height))),
+          inverted=inverted)
+
+
+  def read_pages_(self, data):
+    """Yield (body start, body end) of each page, loading its header."""
+    raise NotImplementedError()
+
+  def page_info_(self):
+    """Format independent description of the current page header."""
+    raise NotImplementedError()
+
+  def set_page_info_(self, info):
+    raise NotImplementedError()
+
+  def accept_page_info_(self, info):
+    """The closest page description this format can hold."""
+    return info
+
+  def validate_page_header_(self, page_header):
+    """Problems with the current page header, decoded from page_header."""
+    raise NotImplementedError()
 
 
   def load(self, urf_file):
@@ -216,6 +1034,11 @@ class Raster:
 class URF(Raster):
   """Apple URF UNIRAST raster format."""
 
+  file_header_size = 12
+  page_header_size = URF_PAGE_HEADER_SIZE
+  # The file header counts the pages.
+  page_count_optional = False
+
   colorspace_str = 'RGB'
 
   pages = 0
@@ -289,15 +1112,19 @@ class URF(Raster):
         )
 
 
-  def save(self, output_file):
+  def save(self, output_file, blank_pages=None):
+    """Returns the number of blank pages suppressed, see encode_file."""
     output_urf = open(output_file, 'wb+')
-    self.encode_header_(output_urf)
+    self.write_file_header_(output_urf, self.pages)
     #self.encode_body_(output_urf)
-    self.encode_packbits_like_(
+    if self.encode_page_(
         output_urf,
         self.img,
         self.colorspace_str,
-        )
+        blank_pages,
+        ):
+      return 1
+    return 0
 
 
   def load_img(self, input_img):
@@ -306,6 +1133,11 @@ class URF(Raster):
     self.pages = 1
     self.bpp = 24
     self.colorspace = 1
+    if self.halftone:
+      # URF has no 1-bit pages, halftones go as 8-bit gray.
+      self.bpp = 8
+      self.colorspace = URF_COLOR_SPACES['GRAY']
+      self.colorspace_str = 'L'
     self.duplex = 0
     self.quality = 5
 
@@ -322,11 +1154,72 @@ class URF(Raster):
       print('Converting DPI {} to {}'.format(dpi_tuple, dpi))
     self.dpi = dpi
 
+    self.img = self.convert_img_(self.img, self.colorspace_str)
+
 
   def save_img(self, output_file):
     self.img.save(output_file)
 
 
+  def read_pages_(self, urf_data):
+    if len(urf_data) < 12 + URF_PAGE_HEADER_SIZE:
+      # No pages.
+      return
+    self.decode_header_(urf_data[:12 + URF_PAGE_HEADER_SIZE])
+    i = 12
+    while i + URF_PAGE_HEADER_SIZE <= len(urf_data):
+      self.decode_page_header_(urf_data[i:i + URF_PAGE_HEADER_SIZE])
+      start = i + URF_PAGE_HEADER_SIZE
+      unit, units = line_units(self.bpp, self.page_width)
+      i = self.skip_body_(urf_data, start, units, self.page_height, unit)
+      yield start, i
+
+
+  def page_info_(self):
+    return {
+      'width': self.page_width,
+      'height': self.page_height,
+      'bits_per_pixel': self.bpp,
+      'color_kind': URF_COLOR_KINDS.get(self.colorspace, 'RGB'),
+      'resolution': (self.dpi, self.dpi),
+      # 1: one-sided, 2: two-sided short edge, 3: two-sided long edge
+      'duplex': self.duplex in (2, 3),
+      'tumble': self.duplex == 2,
+      'quality': self.quality,
+      'total_page_count': self.pages,
+    }
+
+
+  def set_page_info_(self, info):
+    self.page_width = info['width']
+    self.page_height = info['height']
+    self.bpp = info['bits_per_pixel']
+    if URF_COLOR_KINDS.get(self.colorspace) != info['color_kind']:
+      self.colorspace = URF_COLOR_SPACES[info['color_kind']]
+    self.duplex = (2 if info['tumble'] else 3) if info['duplex'] else 1
+    self.quality = info['quality'] if 3 <= info['quality'] <= 5 else 4
+    self.dpi = info['resolution'][0]
+    self.pages = info['total_page_count']
+
+
+  def accept_page_info_(self, info):
+    # URF has neither bilevel nor black (inverted gray) pages.
+    if info['color_kind'] == 'BLACK' or info['bits_per_pixel'] < 8:
+      info = dict(info, color_kind='GRAY', bits_per_pixel=8)
+    return info
+
+
+  def validate_page_header_(self, page_header):
+    problems = []
+    if self.bpp not in (8, 24, 32, 64):
+      problems.append('{} bits per pixel'.format(self.bpp))
+    if self.colorspace not in URF_COLOR_KINDS:
+      problems.append('unknown color space {}'.format(self.colorspace))
+    if self.page_width <= 0 or self.page_height <= 0:
+      problems.append('{}x{} pixels'.format(self.page_width, self.page_height))
+    return problems
+
+
   def decode_header_(self, urf_data):
     magic = struct.unpack('8s', urf_data[:8])[0]
     if magic != 'UNIRAST\0':
@@ -336,29 +1229,33 @@ class URF(Raster):
     if self.pages <= 0:
       print('WARNING: Zero or less pages found: {}'.format(self.pages))
 
+    self.decode_page_header_(urf_data[12:12+URF_PAGE_HEADER_SIZE])
+
+
+  def decode_page_header_(self, page_header):
     # Bits-per-pixel
-    self.bpp = struct.unpack('B', urf_data[12:13])[0]
+    self.bpp = struct.unpack('B', page_header[0:1])[0]
     if not self.bpp in [8, 24, 32, 64]:
       print('WARNING: BPP not in valid set: {}'.format(self.bpp))
 
-    self.colorspace = struct.unpack('B', urf_data[13:14])[0]
+    self.colorspace = struct.unpack('B', page_header[1:2])[0]
     if not (0 <= self.colorspace <= 6):
       print('WARNING: Color space value is not in valid range: {}'.format(self.colorspace))
 
-    self.duplex = struct.unpack('B', urf_data[14:15])[0]
+    self.duplex = struct.unpack('B', page_header[2:3])[0]
     if not (0 <= self.duplex <= 3):
       print('WARNING: Duplex value is not in valid range: {}'.format(self.duplex))
 
-    self.quality = struct.unpack('B', urf_data[15:16])[0]
+    self.quality = struct.unpack('B', page_header[3:4])[0]
     if not (3 <= self.quality <= 5):
       print('WARNING: Quality value is not in valid range: {}'.format(self.quality))
 
     # TODO
-    self.unknown0 = struct.unpack('>I', urf_data[16:20])[0]
-    self.unknown1 = struct.unpack('>I', urf_data[20:24])[0]
+    self.unknown0 = struct.unpack('>I', page_header[4:8])[0]
+    self.unknown1 = struct.unpack('>I', page_header[8:12])[0]
 
-    self.page_width = struct.unpack('>I', urf_data[24:28])[0]
-    self.page_height = struct.unpack('>I', urf_data[28:32])[0]
+    self.page_width = struct.unpack('>I', page_header[12:16])[0]
+    self.page_height = struct.unpack('>I', page_header[16:20])[0]
 
     if self.page_width <= 0:
       print(
@@ -369,18 +1266,25 @@ class URF(Raster):
           'WARNING: Zero or less page height found: {}'.format(
               self.page_height))
 
-    self.dpi = struct.unpack('>I', urf_data[32:36])[0]
+    self.dpi = struct.unpack('>I', page_header[20:24])[0]
 
     # TODO
-    self.unknown2 = struct.unpack('>I', urf_data[36:40])[0]
-    self.unknown3 = struct.unpack('>I', urf_data[40:44])[0]
+    self.unknown2 = struct.unpack('>I', page_header[24:28])[0]
+    self.unknown3 = struct.unpack('>I', page_header[28:32])[0]
 
 
   def encode_header_(self, output_urf):
+    self.write_file_header_(output_urf, self.pages)
+    self.encode_page_header_(output_urf)
+
+
+  def write_file_header_(self, output_urf, pages=1):
     output_urf.write(b'UNIRAST\0')
 
-    output_urf.write(struct.pack('>I', self.pages))
+    output_urf.write(struct.pack('>I', pages))
+
 
+  def encode_page_header_(self, output_urf):
     output_urf.write(struct.pack('B', self.bpp))
 
     output_urf.write(struct.pack('B', self.colorspace))
@@ -490,6 +1394,11 @@ class PWG(Raster):
 				 * bottom, right, top) @since CUPS 1.2/macOS 10.5@ */
   '''
 
+  file_header_size = 4
+  page_header_size = PWG_PAGE_HEADER_SIZE
+  # TotalPageCount 0 is unknown.
+  page_count_optional = True
+
   img = None
 
   media_color = ''
@@ -605,6 +1514,9 @@ class PWG(Raster):
   # [PWG5101.1].
   page_size_name = ''
 
+  # Media pages are laid out on, see MEDIA_SIZES.
+  media = DEFAULT_MEDIA
+
 
   def load(self, raster_file):
     raster_data = open(raster_file).read()
@@ -630,39 +1542,58 @@ class PWG(Raster):
         )
 
 
-  def save(self, output_path):
+  def save(self, output_path, blank_pages=None):
+    """Returns the number of blank pages suppressed, see encode_file."""
     output_file = open(output_path, 'wb+')
 
-    self.encode_header_(output_file)
+    self.write_file_header_(output_file)
     
     #self.encode_body_(output_file)
-    self.encode_packbits_like_(
+    if self.encode_page_(
         output_file,
         self.img,
         self.colorspace_str,
-        )
+        blank_pages,
+        ):
+      return 1
+    return 0
 
 
   def load_img(self, input_img):
     self.img = Image.open(input_img)
     
     # TODO
-    self.colorspace_str = 'RGB'
-    self.img = self.img.convert(self.colorspace_str)
-    
+    self.colorspace_str = '1' if self.halftone else 'RGB'
+    # Halftones are made from gray, while encoding.
+    source_mode = 'L' if self.halftone else self.colorspace_str
+    if not self.rendering_intent:
+      self.rendering_intent = 'saturation'
+
     source_size = (self.img.width, self.img.height)
+    media_mm = MEDIA_SIZES[self.media]
+    resolution, media_size, placed_size = page_geometry(
+        source_size, image_dpi(self.img), media_mm, self.resolutions)
+
+    # Resample once, before color conversion has more pixels to go through.
+    if placed_size != source_size:
+      self.img = reduce_on_load(self.img, placed_size)
+    if placed_size != self.img.size:
+      if self.img.mode in ('1', 'P'):
+        self.img = self.img.convert('RGB')
+      self.img = self.img.resize(placed_size, Image.LANCZOS)
+    self.img = self.convert_img_(self.img, source_mode)
     
-    self.hw_resolution = (600, 600) # DPI
+    self.hw_resolution = (resolution, resolution) # DPI
     
     self.num_copies = 1
 
     # 72 DPI dots
-    self.page_size = (595, 842) # A4
+    self.page_size = tuple(int(round(mm / 25.4 * 72)) for mm in media_mm)
     #self.page_size = (4958, 7016) # A4
     #self.page_size = (self.img.width, self.img.height) # A4
     
     # TODO
-    n_channels = 3
+    n_channels = 1 if self.halftone else 3
     
     # CHECK!!!
     #self.width = self.img.width
@@ -683,16 +1614,12 @@ class PWG(Raster):
     #self.width = 4960
     #self.height = 7016
 
-    self.width = 4961
-    self.height = 7016
-    
-    if (self.width != self.img.width and self.height != self.img.height):
-      print('Size mismatch!')
+    self.width, self.height = media_size
 
     img2 = Image.new(
-        mode=self.colorspace_str,
+        mode=source_mode,
         size=(self.width, self.height),
-        color=(255, 255, 255),
+        color='white',
         )
     offset = (
         #(self.width - self.img.width) // 2,
@@ -706,14 +1633,16 @@ class PWG(Raster):
         )
     self.img = img2
 
-    self.bits_per_color = 8
+    self.bits_per_color = 1 if self.halftone else 8
     self.bits_per_pixel = self.bits_per_color * n_channels
-    self.bytes_per_line = (self.bits_per_pixel / 8) * self.width
+    self.bytes_per_line = (self.bits_per_pixel * self.width + 7) // 8
 
     # CHECK!!!
     self.color_space = 1 # 1 RGB, 6 CMYK, 19 sRGB
+    if self.halftone:
+      self.color_space = PWG_COLOR_SPACES['BLACK']
 
-    self.num_colors = 3
+    self.num_colors = n_channels
     self.total_page_count = 1 # CHECK!!!
     
     self.tumble = 0 # CHECK!!!
@@ -723,7 +1652,7 @@ class PWG(Raster):
     #self.rendering_intent = 'perceptual'
     #self.rendering_intent = 'relative'
     #self.rendering_intent = 'relative-bpc'
-    self.rendering_intent = 'saturation'
+    #self.rendering_intent = 'saturation'
     
     '''
     self.image_box_left = 0
@@ -770,133 +1699,255 @@ class PWG(Raster):
     self.img.save(output_file)
 
 
+  def read_pages_(self, raster_data):
+    if len(raster_data) < 4 + PWG_PAGE_HEADER_SIZE:
+      # No pages.
+      return
+    self.decode_header_(raster_data[:4 + PWG_PAGE_HEADER_SIZE])
+    i = 4
+    while i + PWG_PAGE_HEADER_SIZE <= len(raster_data):
+      self.decode_page_header_(raster_data[i:i + PWG_PAGE_HEADER_SIZE])
+      start = i + PWG_PAGE_HEADER_SIZE
+      unit, units = line_units(self.bits_per_pixel, self.width)
+      i = self.skip_body_(raster_data, start, units, self.height, unit)
+      yield start, i
+
+
+  def page_info_(self):
+    return {
+      'width': self.width,
+      'height': self.height,
+      'bits_per_pixel': self.bits_per_pixel,
+      'color_kind': PWG_COLOR_KINDS.get(self.color_space, 'RGB'),
+      'resolution': self.hw_resolution,
+      'duplex': bool(self.duplex),
+      'tumble': bool(self.tumble),
+      'quality': self.print_quality,
+      'total_page_count': self.total_page_count,
+    }
+
+
+  def set_page_info_(self, info):
+    self.width = info['width']
+    self.height = info['height']
+    self.bits_per_pixel = info['bits_per_pixel']
+    if PWG_COLOR_KINDS.get(self.color_space) != info['color_kind']:
+      self.color_space = PWG_COLOR_SPACES[info['color_kind']]
+    self.num_colors = {'RGB': 3, 'CMYK': 4}.get(info['color_kind'], 1)
+    self.bits_per_color = self.bits_per_pixel // self.num_colors
+    self.bytes_per_line = (self.bits_per_pixel * self.width + 7) // 8
+    self.hw_resolution = tuple(info['resolution'])
+    # 72 DPI dots
+    self.page_size = (
+        self.width * 72 // self.hw_resolution[0],
+        self.height * 72 // self.hw_resolution[1])
+    self.duplex = int(info['duplex'])
+    self.tumble = int(info['tumble'])
+    self.print_quality = info['quality']
+    self.total_page_count = info['total_page_count']
+
+
+  def set_image_box_(self, image_box):
+    (self.image_box_left,
+     self.image_box_top,
+     self.image_box_right,
+     self.image_box_bottom) = image_box.edges()
+
+
+  def transform_image_box_(self, size, flip_h, flip_v, rotate=0):
+    width, height = size
+    left, top, right, bottom = (
+        self.image_box_left,
+        self.image_box_top,
+        self.image_box_right,
+        self.image_box_bottom)
+    if right <= left or bottom <= top:
+      # Blank, or no box.
+      return
+    if rotate == 90:
+      left, top, right, bottom = top, width - right, bottom, width - left
+    elif rotate == 270:
+      left, top, right, bottom = height - bottom, left, height - top, right
+    else:
+      if flip_h:
+        left, right = width - right, width - left
+      if flip_v:
+        top, bottom = height - bottom, height - top
+    (self.image_box_left,
+     self.image_box_top,
+     self.image_box_right,
+     self.image_box_bottom) = left, top, right, bottom
+
+
+  def set_transforms_(self, flip_h, flip_v):
+    self.cross_feed_transform = (
+        TRANSFORM_REVERSED if flip_h else TRANSFORM_NORMAL)
+    self.feed_transform = TRANSFORM_REVERSED if flip_v else TRANSFORM_NORMAL
+
+
+  def validate_page_header_(self, page_header):
+    problems = []
+    if page_header[:64] != 'PwgRaster' + '\0' * 55:
+      problems.append('no PwgRaster sync string')
+    if self.color_order != 0:
+      problems.append('color order {}, not chunky'.format(self.color_order))
+    if self.color_space in PWG_COLOR_KINDS:
+      num_colors = {'RGB': 3, 'CMYK': 4}.get(
+          PWG_COLOR_KINDS[self.color_space], 1)
+    else:
+      # DeviceN, 48 being Device1.
+      num_colors = self.color_space - 47
+    if self.num_colors != num_colors:
+      problems.append('{} colors for color space {}'.format(
+          self.num_colors, self.color_space))
+    if self.bits_per_color not in (1, 2, 4, 8, 16):
+      problems.append('{} bits per color'.format(self.bits_per_color))
+    if self.bits_per_pixel != self.bits_per_color * self.num_colors:
+      problems.append('{} bits per pixel for {} colors of {} bits'.format(
+          self.bits_per_pixel, self.num_colors, self.bits_per_color))
+    bytes_per_line = (self.bits_per_pixel * self.width + 7) // 8
+    if self.bytes_per_line != bytes_per_line:
+      problems.append('{} bytes per line, not {}'.format(
+          self.bytes_per_line, bytes_per_line))
+    if self.width <= 0 or self.height <= 0:
+      problems.append('{}x{} pixels'.format(self.width, self.height))
+    return problems
+
+
   def decode_header_(self, raster_data):
     # "synchronization word"
     magic = struct.unpack('4s', raster_data[:4])[0]
     if magic != 'RaS2':
       raise Exception('Header magic does not match: {}'.format(magic))
-    
-    # Page Header
 
-    pwg_raster = struct.unpack('64s', raster_data[4:4+64])[0]
+    self.decode_page_header_(raster_data[4:4+PWG_PAGE_HEADER_SIZE])
+
+
+  def decode_page_header_(self, page_header):
+    pwg_raster = struct.unpack('64s', page_header[0:64])[0]
     if pwg_raster != ('PwgRaster' + '\0'*55):
       print('WARNING: Second header does not match expectations: {}'.format(
           pwg_raster))
 
-    self.media_color = struct.unpack('64s', raster_data[4+64:4+128])[0]
+    self.media_color = struct.unpack('64s', page_header[64:128])[0]
 
-    self.media_type = struct.unpack('64s', raster_data[4+128:4+192])[0]
+    self.media_type = struct.unpack('64s', page_header[128:192])[0]
 
-    self.print_content_optimize = struct.unpack('64s', raster_data[4+192:4+256])[0]
+    self.print_content_optimize = struct.unpack('64s', page_header[192:256])[0]
     
     # 256-267 Reserved
 
-    self.cut_media = struct.unpack('>I', raster_data[4+268:4+272])[0]
+    self.cut_media = struct.unpack('>I', page_header[268:272])[0]
 
-    self.duplex = bool(struct.unpack('>I', raster_data[4+272:4+276])[0])
+    self.duplex = bool(struct.unpack('>I', page_header[272:276])[0])
 
     # HWResolution
-    w = struct.unpack('>I', raster_data[4+276:4+280])[0]
-    h = struct.unpack('>I', raster_data[4+280:4+284])[0]
+    w = struct.unpack('>I', page_header[276:280])[0]
+    h = struct.unpack('>I', page_header[280:284])[0]
     self.hw_resolution = (w, h)
     
     # 284-299 Reserved
 
-    self.insert_sheet = struct.unpack('>I', raster_data[4+300:4+304])[0]
+    self.insert_sheet = struct.unpack('>I', page_header[300:304])[0]
 
-    self.jog = struct.unpack('>I', raster_data[4+304:4+308])[0]
+    self.jog = struct.unpack('>I', page_header[304:308])[0]
 
-    self.leading_edge = struct.unpack('>I', raster_data[4+308:4+312])[0]
+    self.leading_edge = struct.unpack('>I', page_header[308:312])[0]
     
     # 312-323 Reserved
 
-    self.media_position = struct.unpack('>I', raster_data[4+324:4+328])[0]
+    self.media_position = struct.unpack('>I', page_header[324:328])[0]
 
-    self.media_weight_metric = struct.unpack('>I', raster_data[4+328:4+332])[0]
+    self.media_weight_metric = struct.unpack('>I', page_header[328:332])[0]
     
     # 332-339 Reserved
 
-    self.num_copies = struct.unpack('>I', raster_data[4+340:4+344])[0]
+    self.num_copies = struct.unpack('>I', page_header[340:344])[0]
 
-    self.orientation = struct.unpack('>I', raster_data[4+344:4+348])[0]
+    self.orientation = struct.unpack('>I', page_header[344:348])[0]
     
     # 348-351 Reserved
 
     # PageSize
-    page_w = struct.unpack('>I', raster_data[4+352:4+356])[0]
-    page_h = struct.unpack('>I', raster_data[4+356:4+360])[0]
+    page_w = struct.unpack('>I', page_header[352:356])[0]
+    page_h = struct.unpack('>I', page_header[356:360])[0]
     self.page_size = (page_w, page_h)
     
     # 360-367 Reserved
 
-    self.tumble = bool(struct.unpack('>I', raster_data[4+368:4+372])[0])
+    self.tumble = bool(struct.unpack('>I', page_header[368:372])[0])
 
     # width, height in pixels
-    self.width = struct.unpack('>I', raster_data[4+372:4+376])[0]
+    self.width = struct.unpack('>I', page_header[372:376])[0]
 
-    self.height = struct.unpack('>I', raster_data[4+376:4+380])[0]
+    self.height = struct.unpack('>I', page_header[376:380])[0]
     
     # 380-383 Reserved
 
-    self.bits_per_color = struct.unpack('>I', raster_data[4+384:4+388])[0]
+    self.bits_per_color = struct.unpack('>I', page_header[384:388])[0]
 
-    self.bits_per_pixel = struct.unpack('>I', raster_data[4+388:4+392])[0]
+    self.bits_per_pixel = struct.unpack('>I', page_header[388:392])[0]
 
-    self.bytes_per_line = struct.unpack('>I', raster_data[4+392:4+396])[0]
+    self.bytes_per_line = struct.unpack('>I', page_header[392:396])[0]
 
     # 0: CUPS_ORDER_CHUNKED
-    self.color_order = struct.unpack('>I', raster_data[4+396:4+400])[0]
+    self.color_order = struct.unpack('>I', page_header[396:400])[0]
 
     # 6: CUPS_CSPACE_CMYK
-    self.color_space = struct.unpack('>I', raster_data[4+400:4+404])[0]
+    self.color_space = struct.unpack('>I', page_header[400:404])[0]
     self.colorspace_str = COLOR_SPACE_ENUM[self.color_space].upper()
     
     # 404-419 Reserved
 
-    self.num_colors = struct.unpack('>I', raster_data[4+420:4+424])[0]
+    self.num_colors = struct.unpack('>I', page_header[420:424])[0]
     
     # 424-451 Reserved
 
-    self.total_page_count = struct.unpack('>I', raster_data[4+452:4+456])[0]
+    self.total_page_count = struct.unpack('>I', page_header[452:456])[0]
 
-    self.cross_feed_transform = struct.unpack('>I', raster_data[4+456:4+460])[0]
+    self.cross_feed_transform = struct.unpack('>I', page_header[456:460])[0]
 
-    self.feed_transform = struct.unpack('>I', raster_data[4+460:4+464])[0]
+    self.feed_transform = struct.unpack('>I', page_header[460:464])[0]
 
-    self.image_box_left = struct.unpack('>I', raster_data[4+464:4+468])[0]
+    self.image_box_left = struct.unpack('>I', page_header[464:468])[0]
 
-    self.image_box_top = struct.unpack('>I', raster_data[4+468:4+472])[0]
+    self.image_box_top = struct.unpack('>I', page_header[468:472])[0]
 
-    self.image_box_right = struct.unpack('>I', raster_data[4+472:4+476])[0]
+    self.image_box_right = struct.unpack('>I', page_header[472:476])[0]
 
-    self.image_box_bottom = struct.unpack('>I', raster_data[4+476:4+480])[0]
+    self.image_box_bottom = struct.unpack('>I', page_header[476:480])[0]
 
     # 8 bit per channel color
-    self.alternate_primary = struct.unpack('BBBB', raster_data[4+480:4+484])
+    self.alternate_primary = struct.unpack('BBBB', page_header[480:484])
 
-    self.print_quality = struct.unpack('>I', raster_data[4+484:4+488])[0]
+    self.print_quality = struct.unpack('>I', page_header[484:488])[0]
     
     # 488-507 Reserved
 
-    self.vendor_identifier = struct.unpack('>I', raster_data[4+508:4+512])[0]
+    self.vendor_identifier = struct.unpack('>I', page_header[508:512])[0]
 
-    self.vendor_length = struct.unpack('>I', raster_data[4+512:4+516])[0]
+    self.vendor_length = struct.unpack('>I', page_header[512:516])[0]
 
-    self.vendor_data = struct.unpack('1088s', raster_data[4+516:4+1604])[0]
+    self.vendor_data = struct.unpack('1088s', page_header[516:1604])[0]
     
     # 1604-1667 Reserved
 
-    self.rendering_intent = struct.unpack('64s', raster_data[4+1668:4+1732])[0]
+    self.rendering_intent = struct.unpack('64s', page_header[1668:1732])[0]
 
-    self.page_size_name = struct.unpack('64s', raster_data[4+1732:4+1796])[0]
+    self.page_size_name = struct.unpack('64s', page_header[1732:1796])[0]
 
 
   def encode_header_(self, output_file):
+    self.write_file_header_(output_file)
+    self.encode_page_header_(output_file)
+
+
+  def write_file_header_(self, output_file, pages=1):
     # "synchronization word"
     output_file.write('RaS2')
 
-    # Page Header
 
+  def encode_page_header_(self, output_file):
     output_file.write('PwgRaster' + ('\0' * 55))
 
     output_file.write(struct.pack('64s', self.media_color))
@@ -1013,32 +2064,502 @@ class PWG(Raster):
     output_file.write(struct.pack('64s', self.page_size_name))
 
 
+def encode_file(
+    input_file,
+    output_file,
+    blank_pages=None,
+    rendering_intent=None,
+    target_profile=color.SRGB,
+    halftone_method=None,
+    resolutions=DEFAULT_RESOLUTIONS,
+    tolerance=None,
+    ):
+  """Encode an image to the raster format chosen by the output file name.
+
+  Returns the number of blank pages suppressed, see Raster.encode_page_.
+  A tolerance.Tolerance, if given, snaps pixels and counts the savings.
+  """
+  if blank_pages not in (None, 'minimal'):
+    raise ValueError('Unknown blank pages option: {}'.format(blank_pages))
+  raster_obj = Raster.create_best_raster(output_file)
+  if raster_obj is None:
+    raise ValueError('Unrecognised output format')
+
+  if rendering_intent:
+    raster_obj.rendering_intent = rendering_intent
+  raster_obj.target_profile = target_profile
+  raster_obj.halftone = halftone_method
+  raster_obj.resolutions = resolutions
+  raster_obj.tolerance = tolerance
+
+  raster_obj.load_img(input_file)
+  return raster_obj.save(output_file, blank_pages)
+
+
+def encode_roll_file(
+    input_file,
+    output_file,
+    rendering_intent=None,
+    target_profile=color.SRGB,
+    halftone_method=None,
+    tolerance=None,
+    ):
+  """Encode an image of any length as one page, for roll media.
+
+  The page is the size of the image, at its own resolution. Big TIFF and
+  PNG images are read and encoded a band at a time, see strips.Source.
+  """
+  raster_obj = Raster.create_best_raster(output_file)
+  if raster_obj is None:
+    raise ValueError('Unrecognised output format')
+
+  if rendering_intent:
+    raster_obj.rendering_intent = rendering_intent
+  raster_obj.target_profile = target_profile
+  raster_obj.halftone = halftone_method
+  raster_obj.tolerance = tolerance
+
+  source = strips.Source(input_file)
+  dpi = source.dpi()
+  info = raster_obj.accept_page_info_({
+    'width': source.size[0],
+    'height': source.size[1],
+    'bits_per_pixel': 1 if halftone_method else 24,
+    'color_kind': 'BLACK' if halftone_method else 'RGB',
+    'resolution': (dpi, dpi),
+    'duplex': False,
+    'tumble': False,
+    'quality': 4,
+    'total_page_count': 1,
+  })
+  raster_obj.set_page_info_(info)
+  if isinstance(raster_obj, PWG):
+    raster_obj.cut_media = CUT_MEDIA_AFTER_PAGE
+  if not raster_obj.rendering_intent:
+    raster_obj.rendering_intent = color.DEFAULT_INTENT
+
+  mode = pil_mode(info['color_kind'], info['bits_per_pixel'])
+  # Halftones are made from gray.
+  band_mode = 'L' if halftone_method else mode
+  source_profile = color.source_profile(source.img)
+  bands = (
+      color.convert(
+          band,
+          band_mode,
+          raster_obj.target_profile,
+          raster_obj.rendering_intent,
+          source=source_profile)
+      for band in source.bands(BAND_ROWS))
+
+  with open(output_file, 'wb+') as output:
+    raster_obj.write_file_header_(output, 1)
+    raster_obj.encode_page_bands_(output, source.size, bands, mode)
+
+
+def decode_file(input_file, output_file):
+  """Decode a raster file to an image format PIL can save.
+
+  PNG and Netpbm files are written a band at a time as the page is
+  decoded, see writers.open_writer, other formats from the whole page.
+  With a "%d" in output_file, each page is written to its own file,
+  numbered from 1, else only the first page is. Returns the number of
+  pages written.
+  """
+  raster_obj = Raster.create_best_raster(input_file)
+  if raster_obj is None:
+    raise ValueError('Unrecognised input format')
+
+  data = map_file(input_file)
+  header_size = raster_obj.page_header_size
+  if len(data) < raster_obj.file_header_size + header_size:
+    raise ValueError('No pages')
+  raster_obj.decode_header_(data[:raster_obj.file_header_size + header_size])
+
+  pages = 0
+  i = raster_obj.file_header_size
+  while i + header_size <= len(data):
+    raster_obj.decode_page_header_(data[i:i + header_size])
+    info = raster_obj.page_info_()
+    pages += 1
+    page_file = output_file % pages if '%d' in output_file else output_file
+    decode_page_(raster_obj, data, i + header_size, info, page_file)
+    if '%d' not in output_file:
+      break
+    unit, units = line_units(info['bits_per_pixel'], info['width'])
+    try:
+      i = raster_obj.skip_body_(
+          data, i + header_size, units, info['height'], unit)
+    except IndexError:
+      # Truncated, its page decoded as far as it goes.
+      break
+  return pages
+
+
+def decode_page_(raster_obj, data, start, info, output_file):
+  size = (info['width'], info['height'])
+  source_mode = pil_mode(info['color_kind'], info['bits_per_pixel'])
+  bands = raster_obj.decode_bands_(data, start, info)
+  mode = writers.writer_mode(output_file, source_mode)
+
+  if mode is None:
+    page = Image.new(source_mode, size, 'white')
+    y = 0
+    for band in bands:
+      page.paste(band, (0, y))
+      y += band.height
+    page.save(output_file, dpi=info['resolution'])
+    return
+
+  with open(output_file, 'wb') as output:
+    writer = writers.open_writer(
+        output, output_file, mode, size, info['resolution'])
+    y = 0
+    for band in bands:
+      writer.write_band(band if band.mode == mode else band.convert(mode))
+      y += band.height
+    # Truncated bodies end in white.
+    for top in xrange(y, size[1], BAND_ROWS):
+      writer.write_band(Image.new(
+          mode, (size[0], min(BAND_ROWS, size[1] - top)), 'white'))
+    writer.close()
+
+
+def validate_file(input_file):
+  """Check the structure of a raster file, without decoding any pixels.
+
+  The run codes of every row of every page are walked and counted against
+  the page headers, which are checked for consistency. Returns the
+  problems found, none for a sound file.
+  """
+  raster_obj = Raster.create_best_raster(input_file)
+  if raster_obj is None:
+    raise ValueError('Unrecognised input format')
+
+  return raster_obj.validate_(map_file(input_file))
+
+
+def transcode_file(input_file, output_file):
+  """Convert between PWG and URF.
+
+  Page bodies are copied as they are when the pixel formats match, and
+  re-encoded row by row only when they don't.
+  """
+  source = Raster.create_best_raster(input_file)
+  if source is None:
+    raise ValueError('Unrecognised input format')
+
+  target = Raster.create_best_raster(output_file)
+  if target is None:
+    raise ValueError('Unrecognised output format')
+
+  if source.__class__ == target.__class__:
+    shutil.copyfile(input_file, output_file)
+    return
+
+  data = map_file(input_file)
+  try:
+    pages = [
+        (source.page_info_(), start, end)
+        for start, end in source.read_pages_(data)
+        ]
+  except IndexError:
+    raise ValueError('Truncated input')
+
+  with open(output_file, 'wb') as output:
+    target.write_file_header_(output, len(pages))
+    for info, start, end in pages:
+      info['total_page_count'] = len(pages)
+      target_info = target.accept_page_info_(info)
+      target.set_page_info_(target_info)
+      target.encode_page_header_(output)
+
+      if (target_info['color_kind'] == info['color_kind']
+          and target_info['bits_per_pixel'] == info['bits_per_pixel']):
+        for chunk_start in xrange(start, end, COPY_CHUNK_SIZE):
+          output.write(data[chunk_start:min(end, chunk_start + COPY_CHUNK_SIZE)])
+      else:
+        target.transcode_body_(output, data, start, info, target_info)
+
+
+def reduce_file(
+    input_file,
+    output_file,
+    resolution=None,
+    grayscale=False,
+    quality=None,
+    ):
+  """Rewrite a raster file smaller and quicker to print.
+
+  Pages above resolution are resampled down to it, color pages made gray,
+  and the print quality of every page header set to quality. Page bodies
+  are copied as they are when their pixels don't change. Returns the
+  changes made, like ['300dpi', 'grayscale'], none when the file was
+  copied as it is.
+  """
+  raster_obj = Raster.create_best_raster(input_file)
+  if raster_obj is None:
+    raise ValueError('Unrecognised input format')
+
+  data = map_file(input_file)
+  try:
+    bodies = list(raster_obj.read_pages_(data))
+  except IndexError:
+    raise ValueError('Truncated input')
+
+  changes = []
+  def change(name):
+    if name not in changes:
+      changes.append(name)
+
+  with open(output_file, 'wb') as output:
+    output.write(data[:raster_obj.file_header_size])
+    for start, end in bodies:
+      header_start = start - raster_obj.page_header_size
+      raster_obj.decode_page_header_(data[header_start:start])
+      info = raster_obj.page_info_()
+      target = dict(info)
+
+      if quality is not None and quality != info['quality']:
+        target['quality'] = quality
+        change('quality {}'.format(quality))
+      if grayscale and info['color_kind'] in ('RGB', 'CMYK'):
+        target.update(color_kind='GRAY', bits_per_pixel=8)
+        change('grayscale')
+      if resolution and max(info['resolution']) > resolution:
+        target_resolution = tuple(
+            min(resolution, axis) for axis in info['resolution'])
+        target.update(
+            resolution=target_resolution,
+            width=max(1, int(round(info['width'] * target_resolution[0]
+                                   / float(info['resolution'][0])))),
+            height=max(1, int(round(info['height'] * target_resolution[1]
+                                    / float(info['resolution'][1])))))
+        change('{}dpi'.format(resolution))
+      target = raster_obj.accept_page_info_(target)
+      raster_obj.set_page_info_(target)
+
+      header_start = output.tell()
+      raster_obj.encode_page_header_(output)
+      if all(target[key] == info[key] for key in (
+          'width', 'height', 'color_kind', 'bits_per_pixel')):
+        for chunk_start in xrange(start, end, COPY_CHUNK_SIZE):
+          output.write(data[chunk_start:min(end, chunk_start + COPY_CHUNK_SIZE)])
+        continue
+
+      target_mode = pil_mode(target['color_kind'], target['bits_per_pixel'])
+      bands = (
+          band.convert(target_mode)
+          for band in raster_obj.decode_bands_(data, start, info))
+      size = (target['width'], target['height'])
+      if size != (info['width'], info['height']):
+        bands = scale_bands(
+            bands, target_mode, (info['width'], info['height']), size)
+      image_box = ImageBox()
+      for band in bands:
+        raster_obj.encode_band_(
+            output, band, target['color_kind'] == 'BLACK', image_box)
+
+      # As in Raster.encode_page_bands_, the header goes again with the box.
+      body_end = output.tell()
+      raster_obj.set_image_box_(image_box)
+      output.seek(header_start)
+      raster_obj.encode_page_header_(output)
+      output.seek(body_end)
+  return changes
+
+
+def transform_file(
+    input_file,
+    output_file,
+    rotate=0,
+    flip=None,
+    pages='all',
+    sheet_back=None,
+    ):
+  """Rotate or flip the pages of a raster file, in the encoded domain.
+
+  With sheet_back, the back side of each duplex sheet is transformed as a
+  printer with that "pwg-raster-document-sheet-back" expects, and its
+  CrossFeedTransform and FeedTransform say so.
+  """
+  raster = Raster.create_best_raster(input_file)
+  if raster is None:
+    raise ValueError('Unrecognised input format')
+
+  data = map_file(input_file)
+  try:
+    bodies = list(raster.read_pages_(data))
+  except IndexError:
+    raise ValueError('Truncated input')
+
+  with open(output_file, 'wb') as output:
+    output.write(data[:raster.file_header_size])
+    for page_number, (start, end) in enumerate(bodies, 1):
+      header_start = start - raster.page_header_size
+      raster.decode_page_header_(data[header_start:start])
+      info = raster.page_info_()
+
+      if sheet_back:
+        selected = info['duplex'] and page_number % 2 == 0
+        flip_h, flip_v = SHEET_BACK_TRANSFORMS[(sheet_back, info['tumble'])]
+        page_rotate = 0
+      else:
+        selected = (
+            pages == 'all'
+            or (pages == 'odd') == (page_number % 2 == 1))
+        flip_h = flip == 'horizontal'
+        flip_v = flip == 'vertical'
+        page_rotate = rotate
+      if page_rotate == 180:
+        flip_h, flip_v = not flip_h, not flip_v
+        page_rotate = 0
+
+      if not selected or not (flip_h or flip_v or page_rotate):
+        output.write(data[header_start:end])
+        continue
+
+      if page_rotate:
+        raster.set_page_info_(dict(
+            info,
+            width=info['height'],
+            height=info['width'],
+            resolution=tuple(reversed(info['resolution']))))
+      if sheet_back and isinstance(raster, PWG):
+        raster.set_transforms_(flip_h, flip_v)
+      raster.transform_image_box_(
+          (info['width'], info['height']), flip_h, flip_v, page_rotate)
+      raster.encode_page_header_(output)
+
+      bilevel_partial = (
+          info['bits_per_pixel'] == 1 and info['width'] % 8 != 0)
+      if page_rotate or (flip_h and bilevel_partial):
+        # Padding bits of bilevel lines would move to the line start.
+        transpose = {
+          90: Image.ROTATE_90,
+          270: Image.ROTATE_270,
+        }.get(page_rotate)
+        if transpose is None:
+          transpose = (
+              Image.ROTATE_180 if flip_v else Image.FLIP_LEFT_RIGHT)
+        raster.rotate_body_(output, data, start, info, transpose)
+      else:
+        raster.transform_body_(output, data, start, info, flip_h, flip_v)
+
+
 if __name__ == '__main__':
   parser = argparse.ArgumentParser(
       description='Encode and decode URF UNIRAST and PWG files.')
 
-  parser.add_argument('action', choices=['encode', 'decode'])
+  parser.add_argument(
+      'action',
+      choices=['encode', 'decode', 'transcode', 'transform', 'validate'])
   parser.add_argument('input', help='Input file')
-  parser.add_argument('output', help='Output file')
+  parser.add_argument(
+      'output', nargs='?',
+      help='Output file, for all but validate. Decoding to a name with %%d '
+      'writes each page to its own file')
+
+  encode_group = parser.add_argument_group('encode')
+  encode_group.add_argument(
+      '--blank-pages', choices=['keep', 'minimal'], default='keep',
+      help='What to do with pages that have nothing on them')
+  encode_group.add_argument(
+      '--intent', choices=sorted(color.INTENTS), help='Rendering intent')
+  encode_group.add_argument(
+      '--color-profile', default=color.SRGB,
+      help='ICC profile of the printer, "sRGB" or "device" for none')
+  encode_group.add_argument(
+      '--halftone', choices=halftone.METHODS,
+      help='Halftone to 1-bit black, for mono printers')
+  encode_group.add_argument(
+      '--resolutions', default=','.join(map(str, DEFAULT_RESOLUTIONS)),
+      help='Comma separated resolutions the printer supports, in DPI')
+  encode_group.add_argument(
+      '--roll', action='store_true',
+      help='One page the length of the image, read a band at a time')
+  encode_group.add_argument(
+      '--tolerance', type=int, default=0,
+      help='Snap channel values to steps this far apart, for noisy scans')
+  encode_group.add_argument(
+      '--white-snap', type=int, default=0,
+      help='Make channel values this close to white paper white')
+
+  transform_group = parser.add_argument_group('transform')
+  transform_group.add_argument(
+      '--rotate', type=int, choices=[0, 90, 180, 270], default=0,
+      help='Degrees counter-clockwise')
+  transform_group.add_argument(
+      '--flip', choices=['horizontal', 'vertical'])
+  transform_group.add_argument(
+      '--pages', choices=['all', 'odd', 'even'], default='all')
+  transform_group.add_argument(
+      '--sheet-back', choices=['normal', 'flipped', 'rotated', 'manual-tumble'],
+      help='Prepare duplex back sides for this printer sheet-back')
 
   args = parser.parse_args()
+  if args.output is None and args.action != 'validate':
+    parser.error('{} needs an output file'.format(args.action))
 
   action = args.action
   input_file = args.input
   output_file = args.output
 
-  if action == 'encode':
-    raster_obj = Raster.create_best_raster(output_file)
-    if raster_obj is None:
-      exit('Unrecognised output format')
-
-    raster_obj.load_img(input_file)
-    raster_obj.save(output_file)
-
-  elif action == 'decode':
-    raster_obj = Raster.create_best_raster(input_file)
-    if raster_obj is None:
-      exit('Unrecognised input format')
-
-    raster_obj.load(input_file)
-    raster_obj.save_img(output_file)
+  snap = None
+  if args.tolerance or args.white_snap:
+    snap = tolerance.Tolerance(args.tolerance, args.white_snap)
+
+  try:
+    if action == 'encode' and args.roll:
+      encode_roll_file(
+          input_file,
+          output_file,
+          rendering_intent=args.intent,
+          target_profile=(
+              None if args.color_profile == 'device' else args.color_profile),
+          halftone_method=args.halftone,
+          tolerance=snap,
+          )
+      if snap:
+        print(snap.report())
+
+    elif action == 'encode':
+      suppressed = encode_file(
+          input_file,
+          output_file,
+          blank_pages=None if args.blank_pages == 'keep' else args.blank_pages,
+          rendering_intent=args.intent,
+          target_profile=(
+              None if args.color_profile == 'device' else args.color_profile),
+          halftone_method=args.halftone,
+          resolutions=[int(r) for r in args.resolutions.split(',')],
+          tolerance=snap,
+          )
+      if suppressed:
+        print('Suppressed {} blank page(s)'.format(suppressed))
+      if snap:
+        print(snap.report())
+
+    elif action == 'decode':
+      decode_file(input_file, output_file)
+
+    elif action == 'transcode':
+      transcode_file(input_file, output_file)
+
+    elif action == 'validate':
+      problems = validate_file(input_file)
+      for problem in problems:
+        print(problem)
+      if problems:
+        exit(1)
+
+    elif action == 'transform':
+      transform_file(
+          input_file,
+          output_file,
+          rotate=args.rotate,
+          flip=args.flip,
+          pages=args.pages,
+          sheet_back=args.sheet_back,
+          )
+  except ValueError as error:
+    exit(str(error))
@@ -1,10 +1,59 @@
 #!/usr/bin/env python
 
+import StringIO
+import os
+import shutil
+import tempfile
 import unittest
 
+from PIL import Image
+from PIL import ImageChops
+from PIL import ImageDraw
+
+from raster import ImageBox
 from raster import Raster
+from raster import RowCache
 from raster import URF
 from raster import PWG
+from raster import decode_file
+from raster import encode_file
+from raster import encode_roll_file
+from raster import page_geometry
+from raster import reduce_file
+from raster import reduce_on_load
+from raster import transcode_file
+from raster import transform_file
+from raster import validate_file
+
+
+def write_pages(
+    raster_obj, output_path, images, color_kind='RGB', bpp=24, **info):
+  """Write images as the pages of a raster file."""
+  with open(output_path, 'wb') as output_file:
+    raster_obj.write_file_header_(output_file, len(images))
+    for img in images:
+      raster_obj.set_page_info_(dict({
+        'width': img.width,
+        'height': img.height,
+        'bits_per_pixel': bpp,
+        'color_kind': color_kind,
+        'resolution': (300, 300),
+        'duplex': False,
+        'tumble': False,
+        'quality': 4,
+        'total_page_count': len(images),
+      }, **info))
+      raster_obj.encode_page_header_(output_file)
+      raster_obj.encode_band_(
+          output_file, img, inverted=color_kind == 'BLACK')
+
+
+def test_image(size=(300, 20), mode='RGB'):
+  img = Image.new(mode, size, 'white')
+  draw = ImageDraw.Draw(img)
+  draw.rectangle((10, 2, 200, 12), fill='red' if mode == 'RGB' else 0)
+  draw.text((210, 4), 'Hi', fill='black' if mode == 'RGB' else 0)
+  return img
 
 
 class TestRaster(unittest.TestCase):
@@ -42,6 +91,456 @@ class TestRaster(unittest.TestCase):
     self.assertEqual(urf.unknown2, 6)
     self.assertEqual(urf.unknown3, 7)
 
+  def test_encode_decode_line(self):
+    raster = Raster()
+    row = '\xff\xff\xff' * 300 + '\x01\x02\x03\x04\x05\x06'
+    encoded = raster.encode_line_(row, 3)
+    self.assertEqual(
+        encoded,
+        '\x7f\xff\xff\xff' '\x7f\xff\xff\xff' '\x2b\xff\xff\xff'
+        '\x00\x01\x02\x03' '\x00\x04\x05\x06')
+    self.assertEqual(
+        raster.decode_line_(encoded, 0, 302, 3), (row, len(encoded)))
+    # Verbatim pixels, then fill the rest of the line.
+    self.assertEqual(
+        raster.decode_line_('\xff\x01\x02\x80', 0, 4, 1),
+        ('\x01\x02\xff\xff', 4))
+    self.assertEqual(raster.skip_line_('\xff\x01\x02\x80', 0, 4, 1), 4)
+
+  def test_row_cache(self):
+    raster = Raster()
+    raster.row_cache = RowCache(max_bytes=100)
+    white = '\xff' * 30
+    encoded = raster.encode_line_(white, 3)
+    self.assertEqual(raster.encode_line_(white, 3), encoded)
+    # Same bytes, other pixel size.
+    self.assertEqual(raster.encode_line_(white, 1), '\x1d\xff')
+    self.assertEqual((raster.row_cache.hits, raster.row_cache.misses), (1, 2))
+
+    # Least recently used rows go first.
+    raster.encode_line_(white, 3)
+    raster.encode_line_('\x00' * 60, 1)
+    self.assertEqual(raster.row_cache.stats()['bytes'], 30 + 4 + 60 + 2)
+    raster.encode_line_(white, 3)
+    self.assertEqual(raster.row_cache.hits, 3)
+    raster.encode_line_(white, 1)
+    self.assertEqual(raster.row_cache.misses, 4)
+    # Rows larger than the cache aren't kept.
+    raster.encode_line_('\x00' * 200, 1)
+    self.assertLessEqual(raster.row_cache.size, 100)
+
+  def test_transcode(self):
+    tmp_dir = tempfile.mkdtemp()
+    try:
+      pwg_path = os.path.join(tmp_dir, 'in.pwg')
+      urf_path = os.path.join(tmp_dir, 'out.urf')
+      images = [test_image(), test_image((100, 30))]
+      write_pages(PWG(), pwg_path, images)
+
+      transcode_file(pwg_path, urf_path)
+
+      urf_data = open(urf_path).read()
+      urf = URF()
+      pages = list(urf.read_pages_(urf_data))
+      self.assertEqual(urf.pages, 2)
+      self.assertEqual(len(pages), 2)
+      self.assertEqual((urf.page_width, urf.page_height), (100, 30))
+      self.assertEqual((urf.bpp, urf.colorspace, urf.dpi), (24, 1, 300))
+
+      # Bodies are passed through untouched.
+      pwg_data = open(pwg_path).read()
+      pwg_pages = list(PWG().read_pages_(pwg_data))
+      for (start, end), (pwg_start, pwg_end) in zip(pages, pwg_pages):
+        self.assertEqual(urf_data[start:end], pwg_data[pwg_start:pwg_end])
+      self.assertEqual(pages[-1][1], len(urf_data))
+    finally:
+      shutil.rmtree(tmp_dir)
+
+  def test_transcode_reencode(self):
+    tmp_dir = tempfile.mkdtemp()
+    try:
+      pwg_path = os.path.join(tmp_dir, 'in.pwg')
+      urf_path = os.path.join(tmp_dir, 'out.urf')
+      img = test_image(mode='1')
+      write_pages(PWG(), pwg_path, [img], color_kind='BLACK', bpp=1)
+
+      transcode_file(pwg_path, urf_path)
+
+      urf_data = open(urf_path).read()
+      urf = URF()
+      (start, end), = urf.read_pages_(urf_data)
+      self.assertEqual((urf.bpp, urf.colorspace), (8, 0))
+      decoded = ''.join(urf.decode_rows_(urf_data, start, 300, 20, 1))
+      self.assertEqual(decoded, img.convert('L').tobytes())
+    finally:
+      shutil.rmtree(tmp_dir)
+
+  def test_decode(self):
+    tmp_dir = tempfile.mkdtemp()
+    try:
+      pwg_path = os.path.join(tmp_dir, 'in.pwg')
+      images = [test_image(), test_image((100, 30))]
+      write_pages(PWG(), pwg_path, images)
+
+      output_path = os.path.join(tmp_dir, 'page-%d.png')
+      self.assertEqual(decode_file(pwg_path, output_path), 2)
+      for page_number, img in enumerate(images, 1):
+        decoded = Image.open(output_path % page_number)
+        self.assertEqual(decoded.tobytes(), img.tobytes())
+        self.assertEqual(decoded.info['dpi'], (300, 300))
+
+      # First page only, as gray.
+      pgm_path = os.path.join(tmp_dir, 'out.pgm')
+      self.assertEqual(decode_file(pwg_path, pgm_path), 1)
+      self.assertEqual(
+          Image.open(pgm_path).tobytes(), images[0].convert('L').tobytes())
+
+      bilevel = test_image(mode='1')
+      urf_path = os.path.join(tmp_dir, 'in.urf')
+      write_pages(
+          URF(), urf_path, [bilevel.convert('L')], color_kind='GRAY', bpp=8)
+      # Truncated, the rest of the page left white.
+      data = open(urf_path).read()
+      with open(urf_path, 'wb') as urf_file:
+        urf_file.write(data[:-20])
+      decode_file(urf_path, os.path.join(tmp_dir, 'out.pbm'))
+      decoded = Image.open(os.path.join(tmp_dir, 'out.pbm'))
+      self.assertEqual(decoded.mode, '1')
+      self.assertEqual(decoded.size, bilevel.size)
+      self.assertEqual(decoded.getpixel((299, 19)), 255)
+      self.assertEqual(decoded.getpixel((10, 2)), 0)
+    finally:
+      shutil.rmtree(tmp_dir)
+
+  def test_validate(self):
+    tmp_dir = tempfile.mkdtemp()
+    try:
+      pwg_path = os.path.join(tmp_dir, 'in.pwg')
+      write_pages(PWG(), pwg_path, [test_image(), test_image((100, 30))])
+      data = open(pwg_path).read()
+      self.assertEqual(validate_file(pwg_path), [])
+
+      bilevel_path = os.path.join(tmp_dir, 'bilevel.pwg')
+      write_pages(
+          PWG(), bilevel_path, [test_image((301, 20), mode='1')],
+          color_kind='BLACK', bpp=1)
+      self.assertEqual(validate_file(bilevel_path), [])
+
+      def validate_data(data):
+        with open(pwg_path, 'wb') as pwg_file:
+          pwg_file.write(data)
+        return validate_file(pwg_path)
+
+      self.assertEqual(
+          validate_data(data[:-3]), ['page 2: truncated in row 29'])
+      self.assertEqual(validate_data(data + 'xx'), ['2 trailing bytes'])
+      # BytesPerLine
+      self.assertEqual(
+          validate_data(data[:396] + '\0\0\0\x01' + data[400:]),
+          ['page 1: 1 bytes per line, not 900'])
+
+      # 4x2 gray pages, with hand made bodies.
+      write_pages(
+          PWG(), pwg_path, [Image.new('L', (4, 2))], color_kind='GRAY',
+          bpp=8)
+      header = open(pwg_path).read()[:4 + 1796]
+      self.assertEqual(validate_data(header + '\x01\x80'), [])
+      self.assertEqual(
+          validate_data(header + '\x00\x04\xff\x80'),
+          ['page 1: row 0 has 5 of 4 pixels'])
+      self.assertEqual(
+          validate_data(header + '\x02\x80'),
+          ['page 1: row 0 repeated past the height of 2'])
+      self.assertEqual(
+          validate_data(header + '\x00\xfd\x01\x02\x03'),
+          ['page 1: truncated in row 0'])
+
+      urf_path = os.path.join(tmp_dir, 'in.urf')
+      write_pages(URF(), urf_path, [test_image()])
+      data = open(urf_path).read()
+      self.assertEqual(validate_file(urf_path), [])
+      with open(urf_path, 'wb') as urf_file:
+        urf_file.write(data[:8] + '\0\0\0\x02' + data[12:])
+      self.assertEqual(validate_file(urf_path), ['1 pages, 2 in the header'])
+    finally:
+      shutil.rmtree(tmp_dir)
+
+  def read_page_images(self, raster_obj, path, mode='RGB'):
+    data = open(path).read()
+    images = []
+    for start, end in raster_obj.read_pages_(data):
+      info = raster_obj.page_info_()
+      rows = ''.join(raster_obj.decode_rows_(
+          data, start, info['width'], info['height'], len(mode)))
+      images.append(
+          Image.frombytes(mode, (info['width'], info['height']), rows))
+    return images
+
+  def test_reverse_runs(self):
+    raster = Raster()
+    line = '\xfd\x01\x02\x03\x04' '\x02\x09' '\x80'
+    runs, end = raster.line_runs_(line, 0, 10, 1)
+    self.assertEqual(end, len(line))
+    reversed_line = raster.encode_runs_(raster.reverse_runs_(runs, 1), 1)
+    self.assertEqual(
+        raster.decode_line_(reversed_line, 0, 10, 1)[0],
+        raster.decode_line_(line, 0, 10, 1)[0][::-1])
+
+  def test_reduce(self):
+    tmp_dir = tempfile.mkdtemp()
+    try:
+      in_path = os.path.join(tmp_dir, 'in.pwg')
+      out_path = os.path.join(tmp_dir, 'out.pwg')
+      images = [test_image((300, 40)), test_image((100, 30))]
+      write_pages(PWG(), in_path, images, resolution=(600, 600))
+
+      self.assertEqual(
+          reduce_file(in_path, out_path, 300, True, 3),
+          ['quality 3', 'grayscale', '300dpi'])
+      self.assertEqual(validate_file(out_path), [])
+      pwg = PWG()
+      data = open(out_path).read()
+      reduced = []
+      for start, end in pwg.read_pages_(data):
+        info = pwg.page_info_()
+        reduced.append(info)
+        # The box found again, on the reduced page.
+        self.assertTrue(
+            0 < pwg.image_box_right <= info['width']
+            and 0 < pwg.image_box_bottom <= info['height'])
+        self.assertEqual(
+            (info['color_kind'], info['resolution'], info['quality']),
+            ('GRAY', (300, 300), 3))
+      self.assertEqual(
+          [(info['width'], info['height']) for info in reduced],
+          [(150, 20), (50, 15)])
+      # The red bar, gray and half the size.
+      decode_file(out_path, os.path.join(tmp_dir, 'out.pgm'))
+      decoded = Image.open(os.path.join(tmp_dir, 'out.pgm'))
+      self.assertLess(abs(decoded.getpixel((50, 3)) - 76), 4)
+
+      # Headers only, the bodies copied.
+      self.assertEqual(reduce_file(in_path, out_path, 600), [])
+      self.assertEqual(open(out_path).read(), open(in_path).read())
+    finally:
+      shutil.rmtree(tmp_dir)
+
+  def test_transform(self):
+    tmp_dir = tempfile.mkdtemp()
+    try:
+      in_path = os.path.join(tmp_dir, 'in')
+      out_path = os.path.join(tmp_dir, 'out')
+      # The last one of several bands, turned a strip at a time.
+      tall = Image.linear_gradient('L').resize((60, 600)).convert('RGB')
+      images = [test_image(), test_image((100, 30)), tall]
+      for raster_class in (PWG, URF):
+        write_pages(raster_class(), in_path, images)
+        for options, transpose in [
+            ({'flip': 'horizontal'}, Image.FLIP_LEFT_RIGHT),
+            ({'flip': 'vertical'}, Image.FLIP_TOP_BOTTOM),
+            ({'rotate': 180}, Image.ROTATE_180),
+            ({'rotate': 90}, Image.ROTATE_90),
+            ({'rotate': 270}, Image.ROTATE_270),
+            ]:
+          transform_file(in_path, out_path, **options)
+          transformed = self.read_page_images(raster_class(), out_path)
+          self.assertEqual(len(transformed), 3)
+          for img, result in zip(images, transformed):
+            self.assertEqual(
+                result.tobytes(), img.transpose(transpose).tobytes())
+    finally:
+      shutil.rmtree(tmp_dir)
+
+  def test_transform_sheet_back(self):
+    tmp_dir = tempfile.mkdtemp()
+    try:
+      in_path = os.path.join(tmp_dir, 'in.pwg')
+      out_path = os.path.join(tmp_dir, 'out.pwg')
+      images = [test_image(), test_image()]
+      write_pages(PWG(), in_path, images, duplex=True, tumble=True)
+
+      transform_file(in_path, out_path, sheet_back='flipped')
+
+      pwg = PWG()
+      data = open(out_path).read()
+      pages = list(pwg.read_pages_(data))
+      self.assertEqual(
+          (pwg.cross_feed_transform, pwg.feed_transform), (0xFFFFFFFF, 1))
+      front, back = self.read_page_images(PWG(), out_path)
+      self.assertEqual(front.tobytes(), images[0].tobytes())
+      self.assertEqual(
+          back.tobytes(),
+          images[1].transpose(Image.FLIP_LEFT_RIGHT).tobytes())
+      # Front sides are left untouched.
+      in_data = open(in_path).read()
+      self.assertEqual(data[:pages[0][1]], in_data[:pages[0][1]])
+    finally:
+      shutil.rmtree(tmp_dir)
+
+  def test_transform_image_box(self):
+    tmp_dir = tempfile.mkdtemp()
+    try:
+      in_path = os.path.join(tmp_dir, 'in.pwg')
+      out_path = os.path.join(tmp_dir, 'out.pwg')
+      img = Image.new('RGB', (240, 350), 'white')
+      ImageDraw.Draw(img).rectangle((10, 20, 100, 60), fill='blue')
+      pwg = PWG()
+      with open(in_path, 'wb') as in_file:
+        pwg.write_file_header_(in_file)
+        pwg.set_page_info_(dict(
+            width=240, height=350, bits_per_pixel=24, color_kind='RGB',
+            resolution=(300, 300), duplex=False, tumble=False, quality=4,
+            total_page_count=1))
+        pwg.encode_page_(in_file, img, 'RGB')
+
+      for options, edges in [
+          ({'rotate': 90}, (20, 139, 61, 230)),
+          ({'rotate': 270}, (289, 10, 330, 101)),
+          ({'rotate': 180}, (139, 289, 230, 330)),
+          ({'flip': 'horizontal'}, (139, 20, 230, 61)),
+          ({'flip': 'vertical'}, (10, 289, 101, 330)),
+          ]:
+        transform_file(in_path, out_path, **options)
+        pwg = PWG()
+        list(pwg.read_pages_(open(out_path).read()))
+        self.assertEqual(
+            (pwg.image_box_left, pwg.image_box_top,
+             pwg.image_box_right, pwg.image_box_bottom),
+            edges, options)
+        page, = self.read_page_images(PWG(), out_path)
+        white = Image.new('RGB', page.size, 'white')
+        self.assertEqual(
+            ImageChops.difference(page, white).getbbox(), edges, options)
+    finally:
+      shutil.rmtree(tmp_dir)
+
+  def test_image_box(self):
+    raster = Raster()
+    img = Image.new('RGB', (300, 20), 'white')
+    ImageDraw.Draw(img).rectangle((10, 2, 200, 12), fill='red')
+    image_box = ImageBox()
+    raster.encode_band_(StringIO.StringIO(), img, image_box=image_box)
+    self.assertEqual(image_box.edges(), (10, 2, 201, 13))
+
+    bilevel = Image.new('1', (21, 4), 1)
+    bilevel.putpixel((9, 3), 0)
+    image_box = ImageBox()
+    raster.encode_band_(
+        StringIO.StringIO(), bilevel, inverted=True, image_box=image_box)
+    self.assertEqual(image_box.edges(), (8, 3, 16, 4))
+
+    image_box = ImageBox()
+    raster.encode_band_(
+        StringIO.StringIO(), Image.new('L', (5, 5), 255), image_box=image_box)
+    self.assertTrue(image_box.empty)
+    self.assertEqual(image_box.edges(), (0, 0, 0, 0))
+
+  def test_blank_pages(self):
+    tmp_dir = tempfile.mkdtemp()
+    try:
+      image_path = os.path.join(tmp_dir, 'blank.png')
+      Image.new('RGB', (100, 600), 'white').save(image_path, dpi=(300, 300))
+
+      urf_path = os.path.join(tmp_dir, 'blank.urf')
+      self.assertEqual(encode_file(image_path, urf_path), 0)
+      full_size = os.path.getsize(urf_path)
+
+      self.assertEqual(encode_file(image_path, urf_path, 'minimal'), 1)
+      minimal = open(urf_path).read()
+      self.assertLess(len(minimal), full_size / 10)
+      self.assertEqual(validate_file(urf_path), [])
+      urf = URF()
+      urf.load(urf_path)
+      self.assertEqual(urf.img.getextrema(), ((255, 255),) * 3)
+
+      # Blank pages are never left out.
+      self.assertRaises(ValueError, encode_file, image_path, urf_path, 'drop')
+
+      Image.new('RGB', (100, 600), 'red').save(image_path, dpi=(300, 300))
+      self.assertEqual(encode_file(image_path, urf_path, 'minimal'), 0)
+    finally:
+      shutil.rmtree(tmp_dir)
+
+  def test_page_geometry(self):
+    a4 = (210, 297)
+    # A 72 DPI screenshot shrinks to the page width, 300 DPI is plenty.
+    self.assertEqual(
+        page_geometry((1920, 1080), 72, a4, (300, 600)),
+        (300, (2480, 3508), (2480, 1395)))
+    # A 300 DPI scan is printed as it is.
+    self.assertEqual(
+        page_geometry((2480, 3508), 300, a4, (300, 600)),
+        (300, (2480, 3508), (2480, 3508)))
+    # Big photos keep their detail.
+    self.assertEqual(
+        page_geometry((4000, 3000), 72, a4, (300, 600)),
+        (600, (4961, 7016), (4961, 3720)))
+    # Only what the printer supports.
+    self.assertEqual(
+        page_geometry((100, 100), 600, a4, (300,)),
+        (300, (2480, 3508), (50, 50)))
+
+  def test_encode_resolution(self):
+    tmp_dir = tempfile.mkdtemp()
+    try:
+      image_path = os.path.join(tmp_dir, 'shot.png')
+      Image.new('RGB', (720, 144), 'red').save(image_path, dpi=(72, 72))
+      pwg_path = os.path.join(tmp_dir, 'shot.pwg')
+
+      encode_file(image_path, pwg_path, resolutions=(150, 300, 600))
+      pwg = PWG()
+      list(pwg.read_pages_(open(pwg_path).read()))
+      self.assertEqual(pwg.hw_resolution, (150, 150))
+      self.assertEqual((pwg.width, pwg.height), (1240, 1754))
+      self.assertEqual(pwg.page_size, (595, 842))
+      # 10 inches wide, shrunk to the page.
+      self.assertEqual(
+          (pwg.image_box_left, pwg.image_box_top,
+           pwg.image_box_right, pwg.image_box_bottom),
+          (0, 0, 1240, 248))
+    finally:
+      shutil.rmtree(tmp_dir)
+
+  def test_reduce_on_load(self):
+    tmp_dir = tempfile.mkdtemp()
+    try:
+      jpeg_path = os.path.join(tmp_dir, 'photo.jpg')
+      Image.new('RGB', (1600, 1200), (0, 128, 255)).save(jpeg_path)
+
+      img = reduce_on_load(Image.open(jpeg_path), (390, 290))
+      self.assertEqual(img.size, (400, 300))
+      img.load()
+      r, g, b = img.getpixel((200, 150))
+      self.assertTrue(r < 8 and 120 < g < 136 and b > 247)
+
+      # Nothing to gain when the source is not bigger.
+      img = reduce_on_load(Image.open(jpeg_path), (1600, 1200))
+      self.assertEqual(img.size, (1600, 1200))
+    finally:
+      shutil.rmtree(tmp_dir)
+
+  def test_encode_roll(self):
+    tmp_dir = tempfile.mkdtemp()
+    try:
+      image_path = os.path.join(tmp_dir, 'banner.png')
+      img = test_image((300, 700))
+      img.save(image_path, dpi=(150, 150))
+      pwg_path = os.path.join(tmp_dir, 'banner.pwg')
+
+      encode_roll_file(image_path, pwg_path)
+
+      pwg = PWG()
+      data = open(pwg_path).read()
+      (start, end), = pwg.read_pages_(data)
+      self.assertEqual((pwg.width, pwg.height), (300, 700))
+      self.assertEqual(pwg.hw_resolution, (150, 150))
+      self.assertEqual(pwg.cut_media, 4)
+      self.assertEqual(end, len(data))
+      rows = ''.join(pwg.decode_rows_(data, start, 300, 700, 3))
+      self.assertEqual(rows, img.tobytes())
+    finally:
+      shutil.rmtree(tmp_dir)
+
 
 if __name__ == '__main__':
   unittest.main()
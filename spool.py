@@ -0,0 +1,490 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import random
+import shutil
+import threading
+import time
+
+from degrade import DegradePolicy
+from print import DEFAULT_DOCUMENT_FORMAT
+from print import get_job_id
+from print import get_status
+from print import get_status_code
+from print import guess_document_format
+from print import send_job
+from raster import validate_file
+from transports import document_parts
+from transports import parse_page_ranges
+
+
+# Job states, as stored in the job metadata.
+QUEUED = 'queued'
+SENDING = 'sending'
+DONE = 'done'
+FAILED = 'failed'
+
+# server-error-busy [RFC2911] 13.1.5.8
+IPP_SERVER_BUSY = 0x0507
+
+# Document formats checked before sending, see raster.validate_file.
+VALIDATED_FORMATS = ('image/pwg-raster', 'image/urf')
+
+# Upload throughput assumed before any job has been sent, bytes/second.
+DEFAULT_THROUGHPUT = 1024 * 1024
+# Weight of the latest send in the throughput moving average.
+THROUGHPUT_SMOOTHING = 0.3
+
+
+def write_atomically(path, data):
+  """Replace the file at path with data, never leaving it half written."""
+  tmp_path = path + '.tmp'
+  with open(tmp_path, 'wb') as tmp_file:
+    tmp_file.write(data)
+    tmp_file.flush()
+    os.fsync(tmp_file.fileno())
+  os.rename(tmp_path, path)
+
+
+def byte_strings(value):
+  """Loaded JSON with its strings UTF-8 encoded, all the way down.
+
+  pkipplib builds requests from byte strings, not unicode, as the options
+  of a job end up in its request.
+  """
+  if isinstance(value, unicode):
+    return value.encode('utf-8')
+  if isinstance(value, list):
+    return [byte_strings(item) for item in value]
+  if isinstance(value, dict):
+    return dict(
+        (byte_strings(key), byte_strings(item)) for key, item in value.items())
+  return value
+
+
+class SpoolJob:
+  """Metadata of a spooled job, persisted next to its document."""
+
+  def __init__(self, job_id, url, options=None, degradable=True):
+    self.job_id = job_id
+    self.url = url
+    # Keyword arguments to send_job.
+    self.options = options or {}
+    # Whether the job may be degraded while the printer is backed up, and
+    # what it gave up, see degrade.DegradePolicy.
+    self.degradable = degradable
+    self.degraded = []
+    self.bytes_saved = 0
+    self.seconds_saved = 0.0
+    self.state = QUEUED
+    self.created = time.time()
+    self.attempts = 0
+    # Time before which the job must not be retried.
+    self.next_attempt = 0
+    self.last_error = None
+    # "job-id" assigned by the printer.
+    self.printer_job_id = None
+
+  def to_dict(self):
+    return dict(self.__dict__)
+
+  @staticmethod
+  def from_dict(values):
+    job = SpoolJob(values['job_id'], values['url'])
+    job.__dict__.update(values)
+    return job
+
+
+class Spool:
+  """On-disk queue of encoded documents.
+
+  Each job is a pair of files in the spool directory: `<job_id>.data`, the
+  document exactly as it will be sent, and `<job_id>.json`, its metadata.
+  The metadata is only ever replaced atomically, and is written after the
+  document, so a job exists once and only once its metadata does.
+  """
+
+  def __init__(self, spool_dir):
+    self.spool_dir = spool_dir
+    if not os.path.isdir(spool_dir):
+      os.makedirs(spool_dir)
+    self.lock = threading.Lock()
+    self.jobs = {}
+    self.recover()
+
+  def data_path(self, job):
+    return os.path.join(self.spool_dir, job.job_id + '.data')
+
+  def metadata_path(self, job):
+    return os.path.join(self.spool_dir, job.job_id + '.json')
+
+  def save(self, job):
+    write_atomically(self.metadata_path(job), json.dumps(job.to_dict()))
+
+  def refresh(self):
+    """Pick up jobs submitted to the spool directory by other processes."""
+    for file_name in sorted(os.listdir(self.spool_dir)):
+      job_id, extension = os.path.splitext(file_name)
+      if extension != '.json' or job_id in self.jobs:
+        continue
+      with open(os.path.join(self.spool_dir, file_name)) as metadata_file:
+        self.jobs[job_id] = SpoolJob.from_dict(
+            byte_strings(json.load(metadata_file)))
+
+  def recover(self):
+    """Requeue jobs that were being sent when the last spooler stopped."""
+    with self.lock:
+      self.refresh()
+      for job in self.jobs.values():
+        if job.state == SENDING:
+          job.state = QUEUED
+          self.save(job)
+
+  def submit(self, input_path, url, degradable=True, **options):
+    """Copy an encoded document into the spool. Returns the new job.
+
+    Raises ValueError for copies and page ranges the document can't be
+    sent with, see transports.document_parts.
+    """
+    with open(input_path, 'rb') as input_file:
+      document_parts(
+          input_file,
+          options.get('document_format', DEFAULT_DOCUMENT_FORMAT),
+          options.get('copies', 1),
+          options.get('pages'),
+          options.get('reverse', False))
+    job = SpoolJob(
+        '{:014d}-{}'.format(
+            int(time.time() * 1000), os.urandom(4).encode('hex')),
+        url,
+        options,
+        degradable)
+    tmp_path = self.data_path(job) + '.tmp'
+    shutil.copyfile(input_path, tmp_path)
+    os.rename(tmp_path, self.data_path(job))
+    with self.lock:
+      self.save(job)
+      self.jobs[job.job_id] = job
+    return job
+
+  def claim(self, url):
+    """Mark the oldest job due for the printer as being sent, and return it."""
+    now = time.time()
+    with self.lock:
+      self.refresh()
+      due = [
+          job for job in self.jobs.values()
+          if job.url == url and job.state == QUEUED and job.next_attempt <= now
+          ]
+      if not due:
+        return None
+      job = min(due, key=lambda job: job.job_id)
+      job.state = SENDING
+      job.attempts += 1
+      self.save(job)
+      return job
+
+  def finish(self, job, state, error=None):
+    """Record a job as done or failed, dropping its document."""
+    with self.lock:
+      job.state = state
+      job.last_error = error
+      self.save(job)
+    if os.path.exists(self.data_path(job)):
+      os.remove(self.data_path(job))
+
+  def backlog(self, url):
+    """Jobs queued or being sent to a printer, and the bytes of their
+    documents."""
+    with self.lock:
+      self.refresh()
+      jobs = [
+          job for job in self.jobs.values()
+          if job.url == url and job.state in (QUEUED, SENDING)
+          ]
+    data_paths = [self.data_path(job) for job in jobs]
+    return len(jobs), sum(
+        os.path.getsize(path) for path in data_paths if os.path.exists(path))
+
+  def record_degraded(self, job, changes, bytes_saved, seconds_saved):
+    with self.lock:
+      job.degraded = changes
+      job.bytes_saved = bytes_saved
+      job.seconds_saved = seconds_saved
+      self.save(job)
+
+  def requeue(self, job, delay, error):
+    with self.lock:
+      job.state = QUEUED
+      job.next_attempt = time.time() + delay
+      job.last_error = error
+      self.save(job)
+
+  def urls(self):
+    with self.lock:
+      self.refresh()
+      return set(job.url for job in self.jobs.values())
+
+
+class Spooler:
+  """Pool of sender workers per printer, draining a Spool."""
+
+  def __init__(
+      self,
+      spool,
+      workers_per_printer=1,
+      max_attempts=10,
+      backoff_base=1.0,
+      backoff_max=300.0,
+      poll_interval=1.0,
+      sender=send_job,
+      validate=False,
+      degrade_policy=None,
+      ):
+    self.spool = spool
+    self.workers_per_printer = workers_per_printer
+    self.max_attempts = max_attempts
+    self.backoff_base = backoff_base
+    self.backoff_max = backoff_max
+    self.poll_interval = poll_interval
+    self.sender = sender
+    # Check the structure of raster documents before their first attempt,
+    # failing those a printer would choke on.
+    self.validate = validate
+    # Degrade jobs while their printer is backed up, see
+    # degrade.DegradePolicy.
+    self.degrade_policy = degrade_policy
+    # Observed upload throughput by printer, bytes/second.
+    self.throughput = {}
+    self.lock = threading.Lock()
+
+    self.stopping = threading.Event()
+    self.workers = {}
+
+  def backoff(self, attempts):
+    """Exponential backoff with jitter, in seconds."""
+    delay = min(self.backoff_max, self.backoff_base * 2 ** (attempts - 1))
+    return delay * random.uniform(0.5, 1.0)
+
+  def problems(self, job):
+    """Problems with the structure of a job's raster document."""
+    document_format = job.options.get(
+        'document_format', DEFAULT_DOCUMENT_FORMAT)
+    if document_format not in VALIDATED_FORMATS:
+      return []
+    try:
+      return validate_file(self.spool.data_path(job))
+    except ValueError as error:
+      return [str(error)]
+
+  def observe(self, url, job_bytes, seconds):
+    """Fold a completed send into the throughput of its printer."""
+    with self.lock:
+      throughput = self.throughput.get(url, DEFAULT_THROUGHPUT)
+      self.throughput[url] = throughput + THROUGHPUT_SMOOTHING * (
+          job_bytes / max(seconds, 1e-3) - throughput)
+
+  def degrade(self, job):
+    """Degrade a job as the policy says, if its printer is backed up.
+
+    What the job gave up is recorded with it, and the upload time saved,
+    at the printer's observed throughput.
+    """
+    queued_jobs, queued_bytes = self.spool.backlog(job.url)
+    with self.lock:
+      throughput = self.throughput.get(job.url, DEFAULT_THROUGHPUT)
+    if not self.degrade_policy.backed_up(
+        queued_jobs, queued_bytes / float(throughput)):
+      return
+
+    data_path = self.spool.data_path(job)
+    size = os.path.getsize(data_path)
+    changes = self.degrade_policy.degrade(data_path, job.options)
+    if changes:
+      bytes_saved = size - os.path.getsize(data_path)
+      self.spool.record_degraded(
+          job, changes, bytes_saved, bytes_saved / float(throughput))
+
+  def send(self, job):
+    """Send one claimed job, then finish or requeue it."""
+    if self.validate and job.attempts == 1:
+      problems = self.problems(job)
+      if problems:
+        self.spool.finish(
+            job, FAILED, 'invalid document: ' + '; '.join(problems))
+        return
+    if self.degrade_policy and job.degradable and job.attempts == 1:
+      self.degrade(job)
+
+    start = time.time()
+    try:
+      with open(self.spool.data_path(job), 'rb') as data_file:
+        job_bytes = os.fstat(data_file.fileno()).st_size
+        response = self.sender(job.url, data_file, **job.options)
+    except (IOError, OSError) as error:
+      response, error_message = None, str(error)
+    except ValueError as error:
+      # The document changed under the job's options, no use retrying.
+      self.spool.finish(job, FAILED, str(error))
+      return
+    else:
+      error_message = get_status(response)
+
+    status = get_status_code(response)
+    if status is not None and status < 0x0100:
+      # successful-ok*
+      job.printer_job_id = get_job_id(response)
+      self.observe(job.url, job_bytes, time.time() - start)
+      self.spool.finish(job, DONE)
+      return
+
+    if status is None:
+      error_message = error_message or 'transport error'
+    else:
+      error_message = error_message or 'status 0x{:04x}'.format(status)
+
+    retryable = status is None or status == IPP_SERVER_BUSY
+    if retryable and job.attempts < self.max_attempts:
+      self.spool.requeue(job, self.backoff(job.attempts), error_message)
+    else:
+      self.spool.finish(job, FAILED, error_message)
+
+  def work(self, url):
+    while not self.stopping.is_set():
+      job = self.spool.claim(url)
+      if job is None:
+        self.stopping.wait(self.poll_interval)
+      else:
+        self.send(job)
+
+  def start_workers(self):
+    """Start workers for printers that don't have any yet."""
+    for url in self.spool.urls():
+      if url in self.workers:
+        continue
+      self.workers[url] = []
+      for _ in range(self.workers_per_printer):
+        worker = threading.Thread(target=self.work, args=(url,))
+        worker.daemon = True
+        worker.start()
+        self.workers[url].append(worker)
+
+  def run(self):
+    """Keep workers running for every printer in the spool until stopped."""
+    while not self.stopping.is_set():
+      self.start_workers()
+      self.stopping.wait(self.poll_interval)
+
+  def stop(self):
+    self.stopping.set()
+    for workers in self.workers.values():
+      for worker in workers:
+        worker.join()
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(
+      description='Spool encoded documents and send them with retries.')
+  subparsers = parser.add_subparsers(dest='action')
+
+  submit_parser = subparsers.add_parser('submit', help='Spool a document')
+  submit_parser.add_argument('spool_dir', help='Spool directory')
+  submit_parser.add_argument('url', help='Printer URL')
+  submit_parser.add_argument('input', help='Encoded document')
+  submit_parser.add_argument('--job-name', default='MyJobName')
+  submit_parser.add_argument('--user-name', default='MyName')
+  submit_parser.add_argument('--copies', type=int, default=1)
+  submit_parser.add_argument(
+      '--pages', type=parse_page_ranges,
+      help='Pages to send, like 40-45,50, out of a PWG or URF document')
+  submit_parser.add_argument(
+      '--reverse', action='store_true',
+      help='Send the pages last first, for face-up output bins')
+  submit_parser.add_argument(
+      '--no-degrade', action='store_true',
+      help='Never degrade this job, however backed up the printer is')
+
+  run_parser = subparsers.add_parser('run', help='Send spooled documents')
+  run_parser.add_argument('spool_dir', help='Spool directory')
+  run_parser.add_argument(
+      '--workers', type=int, default=1, help='Sender workers per printer')
+  run_parser.add_argument('--max-attempts', type=int, default=10)
+  run_parser.add_argument(
+      '--validate', action='store_true',
+      help='Check raster documents before sending, failing corrupt ones')
+  degrade_group = run_parser.add_argument_group(
+      'degrade', 'Degrade jobs while their printer is backed up')
+  degrade_group.add_argument(
+      '--degrade-queued-jobs', type=int,
+      help='Degrade when more jobs than this are spooled for the printer')
+  degrade_group.add_argument(
+      '--degrade-drain-seconds', type=float,
+      help='Degrade when the spooled jobs take longer than this to upload')
+  degrade_group.add_argument(
+      '--no-draft', action='store_true',
+      help='Keep the print quality of degraded jobs')
+  degrade_group.add_argument(
+      '--degrade-resolution', type=int,
+      help='Resample raster documents above this resolution down to it')
+  degrade_group.add_argument(
+      '--degrade-grayscale', action='store_true',
+      help='Print raster documents in gray')
+
+  status_parser = subparsers.add_parser('status', help='List spooled jobs')
+  status_parser.add_argument('spool_dir', help='Spool directory')
+
+  args = parser.parse_args()
+
+  if args.action == 'submit':
+    try:
+      job = Spool(args.spool_dir).submit(
+          args.input,
+          args.url,
+          job_name=args.job_name,
+          user_name=args.user_name,
+          degradable=not args.no_degrade,
+          document_format=guess_document_format(args.input),
+          copies=args.copies,
+          pages=args.pages,
+          reverse=args.reverse)
+    except ValueError as error:
+      parser.error(str(error))
+    print(job.job_id)
+
+  elif args.action == 'run':
+    degrade_policy = None
+    if (args.degrade_queued_jobs is not None
+        or args.degrade_drain_seconds is not None):
+      degrade_policy = DegradePolicy(
+          max_queued_jobs=args.degrade_queued_jobs,
+          max_drain_seconds=args.degrade_drain_seconds,
+          draft=not args.no_draft,
+          resolution=args.degrade_resolution,
+          grayscale=args.degrade_grayscale)
+    spooler = Spooler(
+        Spool(args.spool_dir),
+        workers_per_printer=args.workers,
+        max_attempts=args.max_attempts,
+        validate=args.validate,
+        degrade_policy=degrade_policy)
+    try:
+      spooler.run()
+    except KeyboardInterrupt:
+      spooler.stop()
+
+  elif args.action == 'status':
+    spool = Spool(args.spool_dir)
+    for job_id, job in sorted(spool.jobs.items()):
+      print(job_id, job.state, job.url, job.attempts, job.last_error or '',
+            ','.join(job.degraded))
+    degraded = [job for job in spool.jobs.values() if job.degraded]
+    if degraded:
+      print('{} jobs degraded, {} bytes and {:.1f}s of upload saved'.format(
+          len(degraded),
+          sum(job.bytes_saved for job in degraded),
+          sum(job.seconds_saved for job in degraded)))
@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from PIL import Image
+from pkipplib import pkipplib
+
+from degrade import DegradePolicy
+from fake_printer import FakePrinter
+from print import PRINT_QUALITY_DRAFT
+from raster import PWG
+from raster import encode_file
+from raster_test import write_pages
+from spool import DONE
+from spool import FAILED
+from spool import IPP_SERVER_BUSY
+from spool import QUEUED
+from spool import SENDING
+from spool import Spool
+from spool import Spooler
+
+
+def ipp_response(status, job_id=None):
+  response = pkipplib.IPPRequest(operation_id=status, request_id=1)
+  if job_id is not None:
+    response.job['job-id'] = ('integer', job_id)
+  return response
+
+
+class TestSpool(unittest.TestCase):
+
+  def setUp(self):
+    self.spool_dir = tempfile.mkdtemp()
+    self.document = os.path.join(self.spool_dir, 'document.pwg')
+    with open(self.document, 'wb') as document:
+      document.write('RaS2' + '\0' * 1796)
+
+  def tearDown(self):
+    shutil.rmtree(self.spool_dir)
+
+  def spooler(self, spool, responses, validate=False, degrade_policy=None):
+    sent = []
+    def sender(url, chunks, **options):
+      sent.append((url, ''.join(chunks), options))
+      response = responses.pop(0)
+      if isinstance(response, Exception):
+        raise response
+      return response
+    spooler = Spooler(
+        spool, backoff_base=0, sender=sender, validate=validate,
+        degrade_policy=degrade_policy)
+    return spooler, sent
+
+  def test_submit_and_send(self):
+    spool = Spool(os.path.join(self.spool_dir, 'spool'))
+    job = spool.submit(self.document, 'http://printer', job_name='a')
+
+    spooler, sent = self.spooler(spool, [ipp_response(0x0000, 42)])
+    spooler.send(spool.claim('http://printer'))
+
+    self.assertEqual(
+        sent, [('http://printer', open(self.document).read(),
+                {'job_name': 'a'})])
+    self.assertEqual(job.state, DONE)
+    self.assertEqual(job.printer_job_id, 42)
+    self.assertFalse(os.path.exists(spool.data_path(job)))
+    self.assertIsNone(spool.claim('http://printer'))
+
+  def test_retry(self):
+    spool = Spool(os.path.join(self.spool_dir, 'spool'))
+    job = spool.submit(self.document, 'http://printer')
+    spooler, sent = self.spooler(spool, [
+        ipp_response(IPP_SERVER_BUSY),
+        None,
+        ipp_response(0x0400),
+        ])
+
+    spooler.send(spool.claim('http://printer'))
+    self.assertEqual(job.state, QUEUED)
+    self.assertEqual(job.last_error, 'status 0x0507')
+
+    spooler.send(spool.claim('http://printer'))
+    self.assertEqual(job.state, QUEUED)
+    self.assertEqual(job.last_error, 'transport error')
+
+    spooler.send(spool.claim('http://printer'))
+    self.assertEqual(job.state, FAILED)
+    self.assertEqual(job.attempts, 3)
+
+  def test_bad_options(self):
+    spool = Spool(os.path.join(self.spool_dir, 'spool'))
+    write_pages(PWG(), self.document, [Image.new('RGB', (16, 8), 'red')])
+    with self.assertRaises(ValueError):
+      spool.submit(self.document, 'http://printer', pages=[(5, None)])
+    with self.assertRaises(ValueError):
+      spool.submit(
+          self.document, 'http://printer', copies=2,
+          document_format='image/jpeg')
+    self.assertEqual(spool.jobs, {})
+
+    # Not retried, nor left sending for recovery to send again.
+    job = spool.submit(self.document, 'http://printer')
+    spooler, sent = self.spooler(spool, [ValueError('Truncated document')])
+    spooler.send(spool.claim('http://printer'))
+    self.assertEqual(job.state, FAILED)
+    self.assertEqual(job.last_error, 'Truncated document')
+
+  def test_validate(self):
+    spool = Spool(os.path.join(self.spool_dir, 'spool'))
+    corrupt = spool.submit(self.document, 'http://printer')
+    image_path = os.path.join(self.spool_dir, 'page.png')
+    Image.new('RGB', (16, 8), 'white').save(image_path)
+    encode_file(image_path, self.document)
+    sound = spool.submit(self.document, 'http://printer')
+    spooler, sent = self.spooler(
+        spool, [ipp_response(0x0000, 42)], validate=True)
+
+    spooler.send(spool.claim('http://printer'))
+    self.assertEqual(corrupt.state, FAILED)
+    self.assertEqual(
+        corrupt.last_error, 'invalid document: page 1: unknown color space 0')
+    self.assertEqual(sent, [])
+
+    spooler.send(spool.claim('http://printer'))
+    self.assertEqual(sound.state, DONE)
+    self.assertEqual(len(sent), 1)
+
+  def test_degrade(self):
+    spool = Spool(os.path.join(self.spool_dir, 'spool'))
+    write_pages(
+        PWG(), self.document, [Image.new('RGB', (200, 100), 'red')],
+        resolution=(600, 600))
+    size = os.path.getsize(self.document)
+    jobs = []
+    for degradable in (False, True, True):
+      jobs.append(spool.submit(
+          self.document, 'http://printer', degradable=degradable))
+      # Claimed in the order of their ids, from the submit time.
+      time.sleep(0.002)
+    spooler, sent = self.spooler(
+        spool, [ipp_response(0x0000, n) for n in range(3)],
+        degrade_policy=DegradePolicy(
+            max_queued_jobs=1, resolution=300, grayscale=True))
+
+    for _ in jobs:
+      spooler.send(spool.claim('http://printer'))
+    # Opted out, then degraded with 2 jobs spooled, not with 1.
+    self.assertEqual(
+        [job.degraded for job in jobs],
+        [[], ['draft', 'grayscale', '300dpi'], []])
+    self.assertEqual(
+        [options for _, _, options in sent],
+        [{}, {'print_quality': PRINT_QUALITY_DRAFT}, {}])
+    self.assertEqual(len(sent[1][1]), size - jobs[1].bytes_saved)
+    self.assertGreater(jobs[1].seconds_saved, 0)
+
+    pwg = PWG()
+    list(pwg.read_pages_(sent[1][1]))
+    info = pwg.page_info_()
+    self.assertEqual(
+        (info['width'], info['height'], info['resolution']),
+        (100, 50, (300, 300)))
+    self.assertEqual(
+        (info['color_kind'], info['quality']), ('GRAY', PRINT_QUALITY_DRAFT))
+
+    # Saved with the job.
+    spool = Spool(os.path.join(self.spool_dir, 'spool'))
+    self.assertEqual(spool.jobs[jobs[1].job_id].degraded, jobs[1].degraded)
+
+  def test_recover(self):
+    spool_dir = os.path.join(self.spool_dir, 'spool')
+    spool = Spool(spool_dir)
+    job = spool.submit(self.document, 'http://printer')
+    self.assertEqual(spool.claim('http://printer').state, SENDING)
+
+    # A new spool over the same directory, as after a crash.
+    spool = Spool(spool_dir)
+    self.assertEqual(spool.jobs[job.job_id].state, QUEUED)
+    self.assertEqual(spool.claim('http://printer').attempts, 2)
+
+  def test_send_reloaded(self):
+    printer = FakePrinter()
+    printer.start()
+    try:
+      spool_dir = os.path.join(self.spool_dir, 'spool')
+      write_pages(PWG(), self.document, [Image.new('RGB', (16, 8), 'red')])
+      job = Spool(spool_dir).submit(
+          self.document, printer.url, job_name='R\xc3\xa9union',
+          document_format='image/pwg-raster', pages=[(1, 1)])
+
+      # Options as loaded from JSON, sent with the real send_job.
+      spool = Spool(spool_dir)
+      reloaded = spool.jobs[job.job_id]
+      self.assertEqual(reloaded.options['job_name'], 'R\xc3\xa9union')
+      self.assertIsInstance(reloaded.options['document_format'], str)
+      spooler = Spooler(spool)
+      spooler.send(spool.claim(printer.url))
+      self.assertEqual(reloaded.state, DONE, reloaded.last_error)
+      self.assertEqual(len(printer.jobs), 1)
+    finally:
+      printer.shutdown()
+      printer.server_close()
+
+
+if __name__ == '__main__':
+  unittest.main()
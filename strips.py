@@ -0,0 +1,327 @@
+#!/usr/bin/env python
+
+import io
+import struct
+import zlib
+
+from PIL import Image
+
+
+# TIFF tags.
+BITS_PER_SAMPLE = 258
+COMPRESSION = 259
+FILL_ORDER = 266
+STRIP_OFFSETS = 273
+ROWS_PER_STRIP = 278
+STRIP_BYTE_COUNTS = 279
+PLANAR_CONFIGURATION = 284
+PREDICTOR = 317
+TILE_WIDTH = 322
+TILE_LENGTH = 323
+TILE_OFFSETS = 324
+TILE_BYTE_COUNTS = 325
+
+# TIFF compressions whose strips are decoded here, to the PIL decoder of
+# their decompressed data.
+TIFF_DECODERS = {
+  1: 'raw',
+  8: 'raw', # Adobe deflate
+  32773: 'packbits',
+  32946: 'raw', # deflate
+}
+TIFF_DEFLATE = (8, 32946)
+# Compressions whose strips can be read a row at a time.
+TIFF_ROW_COMPRESSIONS = (1,) + TIFF_DEFLATE
+
+# Color type: (PIL mode, samples per pixel).
+PNG_MODES = {
+  0: ('L', 1),
+  2: ('RGB', 3),
+  3: ('P', 1),
+  4: ('LA', 2),
+  6: ('RGBA', 4),
+}
+
+PNG_SIGNATURE = '\x89PNG\r\n\x1a\n'
+
+READ_SIZE = 64 * 1024
+
+# Rows of the blocks strips and PNG data are cut into.
+BLOCK_ROWS = 64
+
+
+class Source:
+  """An image read a band of rows at a time.
+
+  Large TIFF and PNG files are read a strip or a block of rows at a time,
+  so that only about a band of them is ever in memory. Anything else is
+  decoded whole by PIL.
+  """
+
+  def __init__(self, path):
+    self.path = path
+    self.img = Image.open(path)
+    self.size = self.img.size
+    self.mode = self.img.mode
+    self.info = self.img.info
+    self.blocks = None
+    if self.img.format == 'TIFF':
+      self.blocks = self.tiff_blocks_()
+    elif self.img.format == 'PNG':
+      self.blocks = self.png_blocks_()
+
+  @property
+  def streamed(self):
+    return self.blocks is not None
+
+  def dpi(self, default=72):
+    dpi = self.info.get('dpi')
+    if not dpi or not dpi[0]:
+      return default
+    return int(round(dpi[0]))
+
+  def bands(self, rows):
+    """Yield the image as PIL images of `rows` rows, the last one shorter."""
+    if self.blocks is None:
+      img = self.img
+      for y in xrange(0, img.height, rows):
+        yield img.crop((0, y, img.width, min(y + rows, img.height)))
+      return
+
+    pending = []
+    pending_rows = 0
+    for block in self.blocks:
+      pending.append(block)
+      pending_rows += block.height
+      while pending_rows >= rows:
+        band, pending = rebatch(pending, rows)
+        pending_rows -= rows
+        yield band
+    if pending_rows:
+      yield rebatch(pending, pending_rows)[0]
+
+  def tiff_blocks_(self):
+    tags = self.img.tag_v2
+    compression = tags.get(COMPRESSION, 1)
+    if (compression not in TIFF_DECODERS
+        or tags.get(FILL_ORDER, 1) != 1
+        or tags.get(PLANAR_CONFIGURATION, 1) != 1
+        or tags.get(PREDICTOR, 1) != 1):
+      return None
+    rawmode = self.img.tile[0][3][0]
+    tiled = TILE_OFFSETS in tags
+    if tiled:
+      block_size = (tags[TILE_WIDTH], tags[TILE_LENGTH])
+      offsets = tags[TILE_OFFSETS]
+      byte_counts = tags[TILE_BYTE_COUNTS]
+    else:
+      block_size = (self.size[0], tags.get(ROWS_PER_STRIP, self.size[1]))
+      offsets = tags[STRIP_OFFSETS]
+      byte_counts = tags[STRIP_BYTE_COUNTS]
+    bits_per_sample = tags.get(BITS_PER_SAMPLE, (1,))
+    if not isinstance(bits_per_sample, tuple):
+      bits_per_sample = (bits_per_sample,)
+    if tiled or compression not in TIFF_ROW_COMPRESSIONS:
+      return tiff_blocks(
+          self.path, self.mode, rawmode, compression, self.size, block_size,
+          offsets, byte_counts, tiled)
+    return tiff_strip_rows(
+        self.path, self.mode, rawmode, compression, self.size,
+        (self.size[0] * sum(bits_per_sample) + 7) // 8,
+        offsets, byte_counts)
+
+  def png_blocks_(self):
+    with open(self.path, 'rb') as png_file:
+      header = png_file.read(8 + 8 + 13)
+    width, height, depth, color_type, _, _, interlace = struct.unpack(
+        '>IIBBBBB', header[16:29])
+    if depth != 8 or interlace or color_type not in PNG_MODES:
+      return None
+    return png_blocks(self.path, width, height, color_type)
+
+
+def rebatch(blocks, rows):
+  """Stack the first `rows` rows of a list of images of the same width.
+
+  Returns (stacked image, images left over).
+  """
+  first = blocks[0]
+  if first.height == rows and len(blocks) == 1:
+    return first, []
+  band = Image.new(first.mode, (first.width, rows))
+  y = 0
+  while y < rows:
+    block = blocks.pop(0)
+    take = min(block.height, rows - y)
+    if take < block.height:
+      blocks.insert(0, block.crop((0, take, block.width, block.height)))
+      block = block.crop((0, 0, block.width, take))
+    band.paste(block, (0, y))
+    y += take
+  if first.mode == 'P':
+    band.putpalette(first.getpalette())
+  return band, blocks
+
+
+def tiff_strip_rows(
+    path,
+    mode,
+    rawmode,
+    compression,
+    size,
+    row_bytes,
+    offsets,
+    byte_counts,
+    block_rows=BLOCK_ROWS,
+    ):
+  """Yield the rows of a raw or deflated striped TIFF, a block at a time.
+
+  Strips are read a chunk at a time too, as TIFF writers often put the
+  whole image in one strip.
+  """
+  width, height = size
+  y = 0
+  with open(path, 'rb') as tiff_file:
+    for offset, byte_count in zip(offsets, byte_counts):
+      decompressor = (
+          zlib.decompressobj() if compression in TIFF_DEFLATE else None)
+      tiff_file.seek(offset)
+      pending = ''
+      remaining = byte_count
+      while remaining and y < height:
+        data = tiff_file.read(min(READ_SIZE, remaining))
+        remaining -= len(data)
+        if not data:
+          raise ValueError('Truncated TIFF strip')
+        pending += decompressor.decompress(data) if decompressor else data
+        rows = min(len(pending) // row_bytes, height - y)
+        for start in xrange(0, rows, block_rows):
+          n = min(block_rows, rows - start)
+          yield Image.frombytes(
+              mode,
+              (width, n),
+              pending[start * row_bytes:(start + n) * row_bytes],
+              'raw',
+              rawmode)
+        pending = pending[rows * row_bytes:]
+        y += rows
+
+
+def tiff_blocks(
+    path,
+    mode,
+    rawmode,
+    compression,
+    size,
+    block_size,
+    offsets,
+    byte_counts,
+    tiled=False,
+    ):
+  """Yield a TIFF as images of whole rows of strips or tiles, top to bottom."""
+  width, height = size
+  block_width, block_height = block_size
+  decoder = TIFF_DECODERS[compression]
+  per_row = (width + block_width - 1) // block_width
+  with open(path, 'rb') as tiff_file:
+    for index in xrange(0, len(offsets), per_row):
+      y = (index // per_row) * block_height
+      rows = min(block_height, height - y)
+      if rows <= 0:
+        return
+      band = Image.new(mode, (width, rows))
+      for column in xrange(per_row):
+        tiff_file.seek(offsets[index + column])
+        data = tiff_file.read(byte_counts[index + column])
+        if compression in TIFF_DEFLATE:
+          data = zlib.decompress(data)
+        # Tiles are whole even past the edges of the image, strips aren't.
+        tile_rows = block_height if tiled else rows
+        tile = Image.frombytes(
+            mode, (block_width, tile_rows), data, decoder, rawmode)
+        band.paste(tile, (column * block_width, 0))
+      yield band
+
+
+def png_chunks(png_file):
+  png_file.seek(8)
+  while True:
+    header = png_file.read(8)
+    if len(header) < 8:
+      return
+    length, chunk_type = struct.unpack('>I4s', header)
+    if chunk_type == 'IDAT':
+      # Leave the data to the caller, a block at a time.
+      yield chunk_type, length
+      png_file.seek(4, 1)
+      continue
+    data = png_file.read(length)
+    png_file.seek(4, 1)
+    yield chunk_type, data
+    if chunk_type == 'IEND':
+      return
+
+
+def png_chunk(chunk_type, data):
+  return ''.join([
+      struct.pack('>I', len(data)),
+      chunk_type,
+      data,
+      struct.pack('>I', zlib.crc32(chunk_type + data) & 0xffffffff)])
+
+
+def unfilter_rows(filtered, prior, width, color_type):
+  """Undo the PNG filters of rows, given the unfiltered row above them.
+
+  PIL's decoder undoes them, from a PNG of their own: the row above,
+  unfiltered, then the rows, stored without compression. Returns the
+  unfiltered rows.
+  """
+  rows = len(filtered) // (len(prior) + 1)
+  # Palette indexes unfilter as gray.
+  header = struct.pack(
+      '>IIBBBBB', width, rows + 1, 8, 0 if color_type == 3 else color_type,
+      0, 0, 0)
+  png = ''.join([
+      PNG_SIGNATURE,
+      png_chunk('IHDR', header),
+      png_chunk('IDAT', zlib.compress('\0' + prior + filtered, 0)),
+      png_chunk('IEND', '')])
+  return Image.open(io.BytesIO(png)).tobytes()[len(prior):]
+
+
+def png_blocks(path, width, height, color_type, block_rows=BLOCK_ROWS):
+  """Yield the rows of an 8-bit, non-interlaced PNG, a block at a time."""
+  mode, bpp = PNG_MODES[color_type]
+  row_bytes = width * bpp
+  palette = None
+  decompressor = zlib.decompressobj()
+  pending = ''
+  prior = '\0' * row_bytes
+  rows = []
+  y = 0
+  with open(path, 'rb') as png_file:
+    for chunk_type, data in png_chunks(png_file):
+      if chunk_type == 'PLTE':
+        palette = data
+      if chunk_type != 'IDAT':
+        continue
+      remaining = data
+      while remaining:
+        pending += decompressor.decompress(
+            png_file.read(min(READ_SIZE, remaining)))
+        remaining -= min(READ_SIZE, remaining)
+        start = 0
+        while len(pending) - start > row_bytes and y < height:
+          rows.append(pending[start:start + 1 + row_bytes])
+          start += 1 + row_bytes
+          y += 1
+          if len(rows) == block_rows or y == height:
+            unfiltered = unfilter_rows(''.join(rows), prior, width, color_type)
+            prior = unfiltered[-row_bytes:]
+            block = Image.frombytes(mode, (width, len(rows)), unfiltered)
+            if palette:
+              block.putpalette(palette)
+            rows = []
+            yield block
+        pending = pending[start:]
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+import zlib
+
+from PIL import Image
+from PIL import ImageChops
+from PIL import ImageDraw
+
+import strips
+
+
+def banner(size=(120, 700)):
+  img = Image.linear_gradient('L').resize(size).convert('RGB')
+  ImageDraw.Draw(img).rectangle((10, 10, 60, 650), fill=(255, 0, 0))
+  return img
+
+
+def paeth(a, b, c):
+  p = a + b - c
+  pa, pb, pc = abs(p - a), abs(p - b), abs(p - c)
+  if pa <= pb and pa <= pc:
+    return a
+  return b if pb <= pc else c
+
+
+def filter_row(filter_type, row, prior, bpp):
+  """Filter a row of bytes as a PNG encoder would."""
+  filtered = []
+  for i, x in enumerate(row):
+    a = row[i - bpp] if i >= bpp else 0
+    c = prior[i - bpp] if i >= bpp else 0
+    b = prior[i]
+    predictor = [0, a, b, (a + b) // 2, paeth(a, b, c)][filter_type]
+    filtered.append((x - predictor) & 0xff)
+  return chr(filter_type) + ''.join(map(chr, filtered))
+
+
+def write_filtered_png(path, img):
+  """Save an RGB image as a PNG with rows of every filter type in turn."""
+  width, height = img.size
+  data = map(ord, img.tobytes())
+  prior = [0] * width * 3
+  rows = []
+  for y in range(height):
+    row = data[y * width * 3:(y + 1) * width * 3]
+    rows.append(filter_row(y % 5, row, prior, 3))
+    prior = row
+  with open(path, 'wb') as png_file:
+    png_file.write('\x89PNG\r\n\x1a\n')
+    for chunk_type, chunk in [
+        ('IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)),
+        ('IDAT', zlib.compress(''.join(rows))),
+        ('IEND', '')]:
+      png_file.write(strips.png_chunk(chunk_type, chunk))
+
+
+class TestStrips(unittest.TestCase):
+
+  def setUp(self):
+    self.tmp_dir = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.tmp_dir)
+
+  def read_bands(self, path, rows=256):
+    source = strips.Source(path)
+    page = Image.new('RGB', source.size)
+    heights = []
+    for band in source.bands(rows):
+      page.paste(band.convert('RGB'), (0, sum(heights)))
+      heights.append(band.height)
+    return source, page, heights
+
+  def test_tiff(self):
+    img = banner()
+    path = os.path.join(self.tmp_dir, 'banner.tif')
+    for compression in (None, 'tiff_deflate', 'tiff_adobe_deflate', 'packbits'):
+      options = {'compression': compression} if compression else {}
+      img.save(path, **options)
+      source, page, heights = self.read_bands(path)
+      self.assertTrue(source.streamed, compression)
+      self.assertEqual(heights, [256, 256, 188])
+      self.assertIsNone(ImageChops.difference(page, img).getbbox())
+
+  def test_png(self):
+    img = banner()
+    path = os.path.join(self.tmp_dir, 'banner.png')
+    for mode in ('RGB', 'L', 'P', 'RGBA'):
+      expected = img.convert(mode)
+      expected.save(path, dpi=(150, 150))
+      source, page, heights = self.read_bands(path, rows=100)
+      self.assertTrue(source.streamed, mode)
+      self.assertEqual(source.dpi(), 150)
+      self.assertEqual(heights, [100] * 7)
+      self.assertIsNone(
+          ImageChops.difference(page, expected.convert('RGB')).getbbox())
+
+  def test_png_filters(self):
+    img = banner((40, 30))
+    path = os.path.join(self.tmp_dir, 'filtered.png')
+    write_filtered_png(path, img)
+    source, page, heights = self.read_bands(path, rows=8)
+    self.assertTrue(source.streamed)
+    self.assertEqual(Image.open(path).tobytes(), img.tobytes())
+    self.assertIsNone(ImageChops.difference(page, img).getbbox())
+
+    # Blocks unfiltered from the last row of the block before.
+    blocks = list(strips.png_blocks(path, 40, 30, 2, block_rows=7))
+    self.assertEqual([block.height for block in blocks], [7, 7, 7, 7, 2])
+    self.assertEqual(
+        ''.join(block.tobytes() for block in blocks), img.tobytes())
+
+  def test_fallback(self):
+    img = banner()
+    path = os.path.join(self.tmp_dir, 'banner.tif')
+    img.save(path, compression='tiff_lzw')
+    source, page, heights = self.read_bands(path)
+    self.assertFalse(source.streamed)
+    self.assertIsNone(ImageChops.difference(page, img).getbbox())
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+from PIL import Image
+
+import tolerance
+from raster import encode_file
+
+
+def noisy_page(size=(200, 100), noise=2):
+  """Near-white paper with a gray bar, both with sensor noise."""
+  rng = random.Random(1)
+  width, height = size
+  data = []
+  for y in xrange(height):
+    level = 130 if height // 3 <= y < 2 * height // 3 else 252
+    for x in xrange(width * 3):
+      data.append(chr(max(0, min(255, level + rng.randint(-noise, noise)))))
+  return Image.frombytes('RGB', size, ''.join(data))
+
+
+class TestTolerance(unittest.TestCase):
+
+  def test_snap_table(self):
+    for white in (255, 0):
+      table = tolerance.snap_table(3, white=white)
+      self.assertEqual(table[white], white)
+      self.assertTrue(all(abs(v - table[v]) <= 3 for v in range(256)))
+      self.assertLessEqual(len(set(table)), 256 // 7 + 2)
+    self.assertEqual(tolerance.snap_table(0), range(256))
+    table = tolerance.snap_table(0, white_snap=4)
+    self.assertEqual(table[250:], [250] + [255] * 5)
+
+  def test_apply(self):
+    snap = tolerance.Tolerance(2, 6)
+    band = snap.apply(noisy_page())
+    white = (255, 255, 255)
+    self.assertEqual(band.getpixel((0, 0)), white)
+    colors = band.getcolors()
+    self.assertLessEqual(len(colors), 2)
+    self.assertLessEqual(snap.mean_error, 4)
+    self.assertEqual(snap.samples, 200 * 100 * 3)
+    self.assertEqual(snap.raw_bytes, 200 * 100 * 3)
+
+    bilevel = Image.new('1', (9, 2))
+    self.assertIs(snap.apply(bilevel), bilevel)
+    self.assertEqual(snap.raw_bytes, 200 * 100 * 3 + 2 * 2)
+
+  def test_encode(self):
+    tmp_dir = tempfile.mkdtemp()
+    try:
+      image_path = os.path.join(tmp_dir, 'scan.png')
+      noisy_page().save(image_path, dpi=(300, 300))
+      lossless_path = os.path.join(tmp_dir, 'lossless.urf')
+      snapped_path = os.path.join(tmp_dir, 'snapped.urf')
+
+      encode_file(image_path, lossless_path)
+      snap = tolerance.Tolerance(2, 6)
+      encode_file(image_path, snapped_path, tolerance=snap)
+      self.assertLess(
+          os.path.getsize(snapped_path) * 20, os.path.getsize(lossless_path))
+      self.assertGreater(snap.ratio, 20)
+      self.assertIn('Compression', snap.report())
+    finally:
+      shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+  unittest.main()
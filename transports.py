@@ -0,0 +1,462 @@
+#!/usr/bin/env python
+
+import errno
+import httplib
+import itertools
+import os
+import random
+import select
+import socket
+import ssl
+import struct
+import tempfile
+import urlparse
+
+import raster
+
+
+# IPP status codes of the responses transports and preflight stand in with.
+IPP_OK = 0x0000
+IPP_ATTRIBUTES_NOT_SUPPORTED = 0x040B
+IPP_SERVER_BUSY = 0x0507
+
+RAW_PORT = 9100
+LPD_PORT = 515
+LPD_QUEUE = 'lp'
+
+SCHEMES = ('socket', 'lpd')
+
+# Large send buffers keep the link busy while the printer drains the socket.
+SEND_BUFFER_SIZE = 1024 * 1024
+TIMEOUT = 60.0
+
+# Seconds to wait for the 100 Continue of an Expect: 100-continue request
+# before sending the body anyway, as HTTP/1.0 servers never send one.
+EXPECT_TIMEOUT = 1.0
+
+# Chunks files are copied in without sendfile(2), and data of unknown
+# length is spooled in for LPD.
+CHUNK_SIZE = 64 * 1024
+
+# File header sizes of the documents that can be sent as collated copies,
+# their pages replayed after one header, by "document-format".
+RASTER_FILE_HEADERS = {
+  'image/pwg-raster': 4,
+  'image/urf': 12,
+}
+
+# Formats whose pages can be picked out of the file, see document_parts.
+RASTER_CLASSES = {
+  'image/pwg-raster': raster.PWG,
+  'image/urf': raster.URF,
+}
+# TotalPageCount, from the start of a PWG page header [PWG5102.4].
+PWG_TOTAL_PAGE_COUNT = 452
+
+
+class Response:
+  """Stands in for the pkipplib response of a Print-Job, see print.get_status.
+
+  Raw and LPD printers have no job attributes, so transports only report
+  whether the printer took the job.
+  """
+
+  def __init__(self, status_code, message, job_id=None):
+    self.operation_id = status_code
+    self.operation = {'status-message': [('textWithoutLanguage', message)]}
+    self.job = {}
+    if job_id is not None:
+      self.job['job-id'] = [('integer', job_id)]
+
+
+def is_raw_url(url):
+  """True for URLs sent without IPP, socket:// and lpd://."""
+  return urlparse.urlsplit(url).scheme in SCHEMES
+
+
+def connect(url, default_port):
+  parts = urlparse.urlsplit(url)
+  connection = socket.create_connection(
+      (parts.hostname, parts.port or default_port), TIMEOUT)
+  connection.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SEND_BUFFER_SIZE)
+  return connection
+
+
+def parse_page_ranges(value):
+  """Page ranges like "40-45,50,60-", as (first, last) page numbers.
+
+  Pages are numbered from 1, and a range without a last page goes on to
+  the end of the document.
+  """
+  ranges = []
+  for part in value.split(','):
+    first, dash, last = part.strip().partition('-')
+    try:
+      first = int(first)
+      last = (int(last) if last else None) if dash else first
+    except ValueError:
+      raise ValueError('Bad page range {!r}'.format(part))
+    if first < 1 or (last is not None and last < first):
+      raise ValueError('Bad page range {!r}'.format(part))
+    ranges.append((first, last))
+  return ranges
+
+
+def page_spans(document_file, document_format, page_count=None):
+  """(header start, body start, body end) of each page of a raster file.
+
+  Pages are found by walking the run codes of their lines, without
+  decoding any pixels, up to page_count pages if given.
+  """
+  raster_obj = RASTER_CLASSES[document_format]()
+  data = raster.map_file_object(document_file)
+  try:
+    return [
+        (start - raster_obj.page_header_size, start, end)
+        for start, end in itertools.islice(
+            raster_obj.read_pages_(data), page_count)]
+  except IndexError:
+    raise ValueError('Truncated document')
+  except KeyError as error:
+    raise ValueError('Unknown page header value {}'.format(error))
+
+
+def document_parts(
+    document_file, document_format=None, copies=1, pages=None, reverse=False):
+  """Parts of a document file to send, as collated copies of some pages.
+
+  Parts are strings, and (offset, count) ranges of the file, sent in
+  order. Copies of PWG and URF documents are their pages after one file
+  header, with the page counts in the headers multiplied: the URF file
+  header's, or each PWG page header's, for which PWG pages are walked.
+  Given page ranges, see parse_page_ranges, or reversed, only the header
+  and body ranges of the pages sent are read, and the page counts in the
+  headers rewritten.
+  """
+  document_file.seek(0, os.SEEK_END)
+  size = document_file.tell()
+  if copies == 1 and not pages and not reverse:
+    return [(0, size)]
+  if document_format not in RASTER_FILE_HEADERS:
+    raise ValueError('Copies and pages need a PWG or URF document')
+  header_size = RASTER_FILE_HEADERS[document_format]
+  document_file.seek(0)
+  head = document_file.read(header_size)
+
+  if document_format == 'image/urf' and not pages and not reverse:
+    body = [(header_size, size - header_size)]
+    page_count, = struct.unpack('>I', head[8:12])
+  else:
+    # Pages past the last of closed ranges aren't walked.
+    last_page = None
+    if pages and all(last for _, last in pages):
+      last_page = max(last for _, last in pages)
+    spans = page_spans(document_file, document_format, last_page)
+    selected = range(len(spans))
+    if pages:
+      selected = [
+          index for index in selected
+          if any(first <= index + 1 <= (last or len(spans))
+                 for first, last in pages)]
+      if not selected:
+        raise ValueError('No pages in {} of {}'.format(
+            ','.join('{}-{}'.format(first, last or '') for first, last in pages),
+            len(spans)))
+    if reverse:
+      selected.reverse()
+    page_count = len(selected)
+
+    body = []
+    for index in selected:
+      header_start, start, end = spans[index]
+      if document_format == 'image/pwg-raster':
+        document_file.seek(header_start)
+        page_header = document_file.read(start - header_start)
+        body.append(''.join([
+            page_header[:PWG_TOTAL_PAGE_COUNT],
+            struct.pack('>I', page_count * copies),
+            page_header[PWG_TOTAL_PAGE_COUNT + 4:]]))
+        body.append((start, end - start))
+      else:
+        body.append((header_start, end - header_start))
+
+  if document_format == 'image/urf':
+    head = head[:8] + struct.pack('>I', page_count * copies)
+  return [head] + body * copies
+
+
+def parts_size(parts):
+  """Bytes in the parts of a document, see document_parts."""
+  return sum(
+      len(part) if isinstance(part, str) else part[1] for part in parts)
+
+
+def send_file(connection, document_file, offset, count):
+  """Send count bytes of a file from offset, with sendfile(2) if there is one.
+
+  Without it, as on Python 2 or over TLS, the file is copied a chunk at a
+  time.
+  """
+  if hasattr(os, 'sendfile') and not isinstance(connection, ssl.SSLSocket):
+    while count:
+      try:
+        sent = os.sendfile(
+            connection.fileno(), document_file.fileno(), offset, count)
+      except OSError as error:
+        if error.errno != errno.EAGAIN:
+          raise
+        # Sockets with a timeout don't block.
+        select.select([], [connection], [], TIMEOUT)
+        continue
+      if not sent:
+        raise IOError('Document file shorter than expected')
+      offset += sent
+      count -= sent
+    return
+
+  document_file.seek(offset)
+  while count:
+    chunk = document_file.read(min(CHUNK_SIZE, count))
+    if not chunk:
+      raise IOError('Document file shorter than expected')
+    connection.sendall(chunk)
+    count -= len(chunk)
+
+
+def send_document(connection, document_file, parts):
+  for part in parts:
+    if isinstance(part, str):
+      connection.sendall(part)
+    else:
+      send_file(connection, document_file, *part)
+
+
+def document_chunks(document_file, parts):
+  """Yield the parts of a document, see document_parts, in chunks."""
+  for part in parts:
+    if isinstance(part, str):
+      yield part
+      continue
+    offset, remaining = part
+    document_file.seek(offset)
+    while remaining:
+      chunk = document_file.read(min(CHUNK_SIZE, remaining))
+      if not chunk:
+        raise IOError('Document file shorter than expected')
+      remaining -= len(chunk)
+      yield chunk
+
+
+def expect_continue(connection):
+  """Wait for the interim response to an Expect: 100-continue request.
+
+  True when the body should be sent, on 100 Continue or when there's no
+  answer within EXPECT_TIMEOUT. False when the server answered with its
+  final response, left for httplib to read.
+  """
+  status = ''
+  while len(status) < len('HTTP/1.1 100'):
+    readable, _, _ = select.select([connection], [], [], EXPECT_TIMEOUT)
+    if not readable:
+      return not status
+    peeked = connection.recv(len('HTTP/1.1 100'), socket.MSG_PEEK)
+    if len(peeked) == len(status):
+      # Closed, the final response is all there is.
+      return False
+    status = peeked
+  if status[len('HTTP/1.1 '):] != '100':
+    return False
+  # Unbuffered, reading no further than the interim response.
+  interim = connection.makefile('rb', 0)
+  while interim.readline() not in ('\r\n', '\n', ''):
+    pass
+  return True
+
+
+def send_chunked(connection, chunks):
+  """Send chunks of data with HTTP/1.1 chunked transfer encoding."""
+  for chunk in chunks:
+    if chunk:
+      connection.sendall('{:x}\r\n{}\r\n'.format(len(chunk), chunk))
+  connection.sendall('0\r\n\r\n')
+
+
+def post_ipp(url, preamble, document_file=None, parts=None, chunks=None):
+  """HTTP POST an IPP request, followed by a document file or chunks.
+
+  The IPP preamble is written as usual, and the document sent from its
+  file, see send_file. Chunks of data whose length isn't known up front,
+  like those of a document compressed on the way, are sent as they come,
+  with chunked transfer encoding. Over plain HTTP the request expects 100
+  Continue, so a printer refusing jobs answers before the document is
+  sent, see expect_continue. Returns the body of the response, None when
+  the request didn't get through.
+  """
+  url_parts = urlparse.urlsplit(url)
+  if url_parts.scheme == 'https':
+    connection = httplib.HTTPSConnection(
+        url_parts.hostname, url_parts.port, timeout=TIMEOUT)
+  else:
+    connection = httplib.HTTPConnection(
+        url_parts.hostname, url_parts.port, timeout=TIMEOUT)
+  try:
+    connection.putrequest('POST', url_parts.path or '/')
+    connection.putheader('Content-Type', 'application/ipp')
+    if chunks is None:
+      connection.putheader(
+          'Content-Length', str(len(preamble) + parts_size(parts)))
+    else:
+      connection.putheader('Transfer-Encoding', 'chunked')
+    # TLS sockets can't peek at the interim response.
+    expect = url_parts.scheme != 'https'
+    if expect:
+      connection.putheader('Expect', '100-continue')
+    connection.endheaders()
+    connection.sock.setsockopt(
+        socket.SOL_SOCKET, socket.SO_SNDBUF, SEND_BUFFER_SIZE)
+    if not expect or expect_continue(connection.sock):
+      if chunks is None:
+        connection.sock.sendall(preamble)
+        send_document(connection.sock, document_file, parts)
+      else:
+        send_chunked(connection.sock, itertools.chain([preamble], chunks))
+    response = connection.getresponse()
+    if response.status != httplib.OK:
+      return None
+    return response.read()
+  except (socket.error, httplib.HTTPException):
+    return None
+  finally:
+    connection.close()
+
+
+def send_raw(
+    url, data, document_format=None, copies=1, pages=None, reverse=False):
+  """Stream the document data as is to a socket://host[:port] printer.
+
+  Data is a string, an iterable of chunks or a file, only files can be
+  sent as several copies or some of their pages.
+  """
+  if hasattr(data, 'fileno'):
+    parts = document_parts(data, document_format, copies, pages, reverse)
+  elif copies != 1 or pages or reverse:
+    raise ValueError('Copies and pages need a document file')
+  elif isinstance(data, str):
+    data = [data]
+  try:
+    connection = connect(url, RAW_PORT)
+    try:
+      if hasattr(data, 'fileno'):
+        send_document(connection, data, parts)
+      else:
+        for chunk in data:
+          connection.sendall(chunk)
+      # The printer prints once it sees the end of the data.
+      connection.shutdown(socket.SHUT_WR)
+    finally:
+      connection.close()
+  except socket.error:
+    return None
+  return Response(IPP_OK, 'successful-ok')
+
+
+def spool_chunks(data):
+  """Data spooled to a temporary file.
+
+  LPD needs the size of the data file before any of it.
+  """
+  if isinstance(data, str):
+    data = [data]
+  spooled = tempfile.TemporaryFile()
+  for chunk in data:
+    spooled.write(chunk)
+  return spooled
+
+
+class LPDError(Exception):
+  pass
+
+
+def lpd_command(connection, command):
+  """Send an LPD command or subcommand, and check its acknowledgement."""
+  connection.sendall(command)
+  ack = connection.recv(1)
+  if ack != '\x00':
+    raise LPDError('LPD refused {!r}: {!r}'.format(command[:1], ack))
+
+
+def control_file(host, user_name, job_name, data_name):
+  """RFC 1179 control file printing one data file, control characters kept."""
+  return ''.join('{}{}\n'.format(command, operand) for command, operand in [
+    ('H', host),
+    ('P', user_name),
+    ('J', job_name),
+    ('N', job_name),
+    ('l', data_name),
+    ('U', data_name),
+  ])
+
+
+def send_lpd(
+    url,
+    data,
+    job_name='MyJobName',
+    user_name='MyName',
+    document_format=None,
+    copies=1,
+    pages=None,
+    reverse=False,
+    ):
+  """Print the document data on the queue of a lpd://host[:port]/queue URL.
+
+  Files are sent as they are, other data spooled to a file first.
+  """
+  queue = urlparse.urlsplit(url).path.strip('/') or LPD_QUEUE
+  host = socket.gethostname()[:31]
+  job_number = random.randint(0, 999)
+  data_name = 'dfA{:03d}{}'.format(job_number, host)
+  control = control_file(host, user_name[:31], job_name[:99], data_name)
+
+  document_file = data if hasattr(data, 'fileno') else spool_chunks(data)
+  try:
+    parts = document_parts(
+        document_file, document_format, copies, pages, reverse)
+    connection = connect(url, LPD_PORT)
+    try:
+      # Receive a printer job.
+      lpd_command(connection, '\x02{}\n'.format(queue))
+      lpd_command(connection, '\x02{} cfA{:03d}{}\n'.format(
+          len(control), job_number, host))
+      lpd_command(connection, control + '\x00')
+      lpd_command(connection, '\x03{} {}\n'.format(
+          parts_size(parts), data_name))
+      send_document(connection, document_file, parts)
+      lpd_command(connection, '\x00')
+    finally:
+      connection.close()
+  except socket.error:
+    return None
+  except LPDError as error:
+    return Response(IPP_SERVER_BUSY, str(error))
+  finally:
+    if document_file is not data:
+      document_file.close()
+  return Response(IPP_OK, 'successful-ok', job_number)
+
+
+def send(
+    url,
+    data,
+    job_name='MyJobName',
+    user_name='MyName',
+    document_format=None,
+    copies=1,
+    pages=None,
+    reverse=False,
+    ):
+  """Send over the transport of the URL scheme, see is_raw_url."""
+  if urlparse.urlsplit(url).scheme == 'lpd':
+    return send_lpd(
+        url, data, job_name, user_name, document_format, copies, pages,
+        reverse)
+  return send_raw(url, data, document_format, copies, pages, reverse)
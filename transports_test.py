@@ -0,0 +1,309 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+
+import SocketServer
+import os
+import struct
+import tempfile
+import threading
+import unittest
+
+from PIL import Image
+
+import transports
+from fake_printer import FakePrinter
+from fake_printer import IPP_SERVICE_UNAVAILABLE
+from print import get_job_id
+from print import get_status_code
+from print import send_job
+from raster import PWG
+from raster import URF
+from raster import validate_file
+from raster_test import write_pages
+
+
+class RawHandler(SocketServer.BaseRequestHandler):
+
+  def handle(self):
+    data = []
+    for chunk in iter(lambda: self.request.recv(65536), ''):
+      data.append(chunk)
+    self.server.jobs.append(''.join(data))
+    self.server.received.set()
+
+
+class LPDHandler(SocketServer.StreamRequestHandler):
+  """Takes one job of a control file and a data file, as RFC 1179 puts it."""
+
+  def ack(self):
+    self.wfile.write('\x00' if self.server.accepting else '\x01')
+    self.wfile.flush()
+
+  def handle(self):
+    command = self.rfile.readline()
+    self.server.commands.append(command)
+    self.ack()
+    if not self.server.accepting:
+      return
+    files = {}
+    for _ in range(2):
+      subcommand = self.rfile.readline()
+      self.server.commands.append(subcommand)
+      size, name = subcommand[1:].split()
+      self.ack()
+      files[subcommand[0]] = (name, self.rfile.read(int(size)))
+      self.rfile.read(1)
+      self.ack()
+    self.server.jobs.append(files)
+    self.server.received.set()
+
+
+class StandIn(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+
+  allow_reuse_address = True
+  daemon_threads = True
+
+  def __init__(self, handler, scheme):
+    SocketServer.TCPServer.__init__(self, ('127.0.0.1', 0), handler)
+    self.url = '{}://127.0.0.1:{}'.format(scheme, self.server_address[1])
+    self.jobs = []
+    self.commands = []
+    self.accepting = True
+    self.received = threading.Event()
+    self.thread = threading.Thread(target=self.serve_forever)
+    self.thread.daemon = True
+    self.thread.start()
+
+  def stop(self):
+    self.shutdown()
+    self.server_close()
+
+
+def document_file(data):
+  document = tempfile.TemporaryFile()
+  document.write(data)
+  document.flush()
+  return document
+
+
+URF_DATA = 'UNIRAST\0' + struct.pack('>I', 2) + 'page1' + 'page2'
+
+
+class TestTransports(unittest.TestCase):
+
+  def test_document_parts(self):
+    document = document_file(URF_DATA)
+    self.assertEqual(
+        transports.document_parts(document, 'image/urf'),
+        [(0, len(URF_DATA))])
+    parts = transports.document_parts(document, 'image/urf', 3)
+    self.assertEqual(
+        parts, ['UNIRAST\0' + struct.pack('>I', 6)] + [(12, 10)] * 3)
+    self.assertEqual(transports.parts_size(parts), 12 + 3 * 10)
+    self.assertEqual(
+        ''.join(transports.document_chunks(document, parts)),
+        'UNIRAST\0' + struct.pack('>I', 6) + 'page1page2' * 3)
+
+    # Each PWG page header counts the pages of all copies.
+    pwg = tempfile.NamedTemporaryFile(suffix='.pwg')
+    images = [Image.new('L', (8, 4), level) for level in (0, 60, 120)]
+    write_pages(PWG(), pwg.name, images, 'GRAY', 8)
+    parts = transports.document_parts(pwg, 'image/pwg-raster', 2)
+    self.assertEqual(len(parts), 1 + 2 * 2 * 3)
+    sent = tempfile.NamedTemporaryFile(suffix='.pwg')
+    for chunk in transports.document_chunks(pwg, parts):
+      sent.write(chunk)
+    sent.flush()
+    self.assertEqual(validate_file(sent.name), [])
+    with self.assertRaises(ValueError):
+      transports.document_parts(pwg, 'image/jpeg', 2)
+
+  def test_parse_page_ranges(self):
+    self.assertEqual(
+        transports.parse_page_ranges('40-45, 50,60-'),
+        [(40, 45), (50, 50), (60, None)])
+    for value in ('', '0-2', '5-3', 'a'):
+      with self.assertRaises(ValueError):
+        transports.parse_page_ranges(value)
+
+  def test_document_pages(self):
+    images = [Image.new('L', (8, 4), level) for level in (0, 60, 120, 180)]
+    for raster_class, document_format in [
+        (PWG, 'image/pwg-raster'), (URF, 'image/urf')]:
+      document = tempfile.NamedTemporaryFile()
+      write_pages(raster_class(), document.name, images, 'GRAY', 8)
+      parts = transports.document_parts(
+          document, document_format, 2,
+          transports.parse_page_ranges('2-3,4'), reverse=True)
+      sent = ''.join(transports.document_chunks(document, parts))
+      # Nothing of page 1 is read.
+      spans = transports.page_spans(document, document_format)
+      self.assertTrue(all(
+          part[0] >= spans[1][0] for part in parts[1:]
+          if not isinstance(part, str)))
+
+      raster_obj = raster_class()
+      levels = []
+      for start, end in raster_obj.read_pages_(sent):
+        self.assertEqual(raster_obj.page_info_()['total_page_count'], 6)
+        levels.append(ord(sent[start + 2]))
+      self.assertEqual(levels, [180, 120, 60] * 2)
+
+      with self.assertRaises(ValueError):
+        transports.document_parts(
+            document, document_format, pages=[(5, None)])
+
+      # Pages after the last one sent are never walked, truncated or not.
+      document.truncate(os.path.getsize(document.name) - 4)
+      document.flush()
+      parts = transports.document_parts(
+          document, document_format, pages=[(1, 2)])
+      self.assertEqual(len(parts), 3 if document_format == 'image/urf' else 5)
+      with self.assertRaises(ValueError):
+        transports.document_parts(
+            document, document_format, pages=[(2, None)])
+
+  def test_post_ipp(self):
+    printer = FakePrinter()
+    printer.start()
+    try:
+      response = send_job(
+          printer.url, document_file(URF_DATA),
+          document_format='image/urf', copies=3)
+      self.assertEqual(get_status_code(response), transports.IPP_OK)
+      job = printer.jobs[get_job_id(response)]
+      self.assertEqual(job.bytes, 12 + 3 * 10)
+      self.assertEqual(job.pages, 6)
+      self.assertEqual(job.document_format, 'image/urf')
+
+      # Some pages, last first.
+      pwg = tempfile.NamedTemporaryFile()
+      write_pages(PWG(), pwg.name, [Image.new('L', (8, 4))] * 5, 'GRAY', 8)
+      response = send_job(
+          printer.url, pwg, pages=[(2, 3), (5, 5)], reverse=True)
+      self.assertEqual(printer.jobs[get_job_id(response)].pages, 3)
+
+      # Compressed, from the same file.
+      response = send_job(
+          printer.url, document_file(URF_DATA), compression='gzip',
+          document_format='image/urf', copies=2)
+      self.assertEqual(printer.jobs[get_job_id(response)].bytes, 12 + 2 * 10)
+
+      # Chunks compressed as they come, never joined before the upload.
+      pulled = []
+      def chunks():
+        for chunk in [URF_DATA[:12], 'page1', 'page2']:
+          pulled.append(chunk)
+          yield chunk
+      response = send_job(
+          printer.url, chunks(), compression='deflate',
+          document_format='image/urf')
+      job = printer.jobs[get_job_id(response)]
+      self.assertEqual((job.bytes, job.pages), (len(URF_DATA), 2))
+      self.assertEqual(len(pulled), 3)
+    finally:
+      printer.shutdown()
+      printer.server_close()
+
+  def test_post_ipp_refused(self):
+    printer = FakePrinter()
+    printer.stopped = True
+    printer.start()
+    try:
+      # Refused on the headers, the 100 Continue never sent.
+      response = send_job(
+          printer.url, document_file('RaS2' + '\0' * 1000000),
+          document_format='image/pwg-raster')
+      self.assertEqual(get_status_code(response), IPP_SERVICE_UNAVAILABLE)
+      (_, _, _, bytes_in, _), = printer.requests
+      self.assertEqual(bytes_in, 0)
+    finally:
+      printer.shutdown()
+      printer.server_close()
+
+  def test_is_raw_url(self):
+    self.assertTrue(transports.is_raw_url('socket://10.0.0.2'))
+    self.assertTrue(transports.is_raw_url('lpd://10.0.0.2/queue'))
+    self.assertFalse(transports.is_raw_url('ipp://10.0.0.2/ipp/print'))
+    self.assertFalse(transports.is_raw_url('http://10.0.0.2:631'))
+
+  def test_raw(self):
+    printer = StandIn(RawHandler, 'socket')
+    try:
+      chunks = ['RaS2', 'x' * 200000, 'end']
+      response = send_job(printer.url, iter(chunks))
+      self.assertEqual(get_status_code(response), transports.IPP_OK)
+      self.assertTrue(printer.received.wait(5))
+      self.assertEqual(printer.jobs, [''.join(chunks)])
+    finally:
+      printer.stop()
+
+  def test_raw_copies(self):
+    printer = StandIn(RawHandler, 'socket')
+    try:
+      pwg = document_file(URF_DATA)
+      send_job(printer.url, pwg, document_format='image/urf', copies=2)
+      self.assertTrue(printer.received.wait(5))
+      self.assertEqual(
+          printer.jobs,
+          ['UNIRAST\0' + struct.pack('>I', 4) + 'page1page2' * 2])
+      with self.assertRaises(ValueError):
+        send_job(printer.url, iter(['RaS2']), copies=2)
+    finally:
+      printer.stop()
+
+  def test_raw_refused(self):
+    printer = StandIn(RawHandler, 'socket')
+    url = printer.url
+    printer.stop()
+    self.assertIsNone(send_job(url, 'RaS2'))
+
+  def test_lpd(self):
+    printer = StandIn(LPDHandler, 'lpd')
+    try:
+      data = 'UNIRAST\0' + struct.pack('>I', 1) + '\xff' * 100000
+      response = send_job(
+          printer.url + '/raw', [data[:10], data[10:]],
+          job_name='Invoice', user_name='alice')
+      self.assertEqual(get_status_code(response), transports.IPP_OK)
+      self.assertTrue(printer.received.wait(5))
+
+      self.assertEqual(printer.commands[0], '\x02raw\n')
+      job, = printer.jobs
+      control_name, control = job['\x02']
+      data_name, received = job['\x03']
+      self.assertEqual(received, data)
+      self.assertTrue(control_name.startswith('cfA'))
+      self.assertTrue(data_name.startswith('dfA'))
+      self.assertEqual(control_name[3:], data_name[3:])
+      lines = control.splitlines()
+      self.assertIn('Palice', lines)
+      self.assertIn('JInvoice', lines)
+      self.assertIn('l' + data_name, lines)
+      self.assertEqual(get_job_id(response), int(data_name[3:6]))
+
+      printer.received.clear()
+      send_job(
+          printer.url, document_file(data),
+          document_format='image/urf', copies=2)
+      self.assertTrue(printer.received.wait(5))
+      self.assertEqual(
+          printer.jobs[1]['\x03'][1],
+          'UNIRAST\0' + struct.pack('>I', 2) + '\xff' * 200000)
+    finally:
+      printer.stop()
+
+  def test_lpd_refused(self):
+    printer = StandIn(LPDHandler, 'lpd')
+    printer.accepting = False
+    try:
+      response = send_job(printer.url, 'UNIRAST\0')
+      self.assertEqual(get_status_code(response), transports.IPP_SERVER_BUSY)
+      self.assertEqual(printer.commands, ['\x02lp\n'])
+    finally:
+      printer.stop()
+
+
+if __name__ == '__main__':
+  unittest.main()
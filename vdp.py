@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+
+import argparse
+import json
+import time
+
+from PIL import Image
+from PIL import ImageDraw
+from PIL import ImageFont
+
+import halftone
+from raster import DEFAULT_RESOLUTIONS
+from raster import ImageBox
+from raster import Raster
+from raster import image_bands
+
+
+class ImageRegion:
+  """An image pasted over the template, at (x, y) in page pixels."""
+
+  def __init__(self, img, position):
+    self.img = img
+    self.position = position
+
+  @property
+  def box(self):
+    x, y = self.position
+    return (x, y, x + self.img.width, y + self.img.height)
+
+  def prepare(self, raster_obj, mode):
+    self.img = raster_obj.convert_img_(self.img, mode)
+
+  def draw(self, band, top):
+    x, y = self.position
+    band.paste(self.img, (x, y - top))
+
+
+class TextRegion:
+  """A line of text drawn over the template, at (x, y) in page pixels."""
+
+  def __init__(self, text, position, font=None, fill='black'):
+    self.text = text
+    self.position = position
+    self.font = font or ImageFont.load_default()
+    self.fill = fill
+
+  @property
+  def box(self):
+    x, y = self.position
+    width, height = self.font.getsize(self.text)
+    return (x, y, x + width, y + height)
+
+  def prepare(self, raster_obj, mode):
+    pass
+
+  def draw(self, band, top):
+    x, y = self.position
+    ImageDraw.Draw(band).text(
+        (x, y - top), self.text, font=self.font, fill=self.fill)
+
+
+class RowExtents:
+  """Non-white extent of each row, filled in like an ImageBox."""
+
+  def __init__(self):
+    self.rows = []
+
+  def add_row(self, left=None, right=None):
+    self.rows.append((left, right))
+
+
+class Template:
+  """A static page, encoded once, that records are printed over.
+
+  The encoded rows of the background are kept. Each record re-encodes only
+  the rows its regions touch and copies the cached rows for the rest.
+  """
+
+  def __init__(self, raster_obj):
+    """Encode the background loaded in raster_obj, see Raster.load_img."""
+    if raster_obj.halftone == 'diffusion':
+      # Error diffusion carries changes into the rows below.
+      raise ValueError('Templates cannot use error diffusion')
+    self.raster = raster_obj
+    self.img = raster_obj.img
+    self.mode = raster_obj.colorspace_str
+    self.inverted = self.mode == '1'
+    self.rows = []
+    self.extents = RowExtents()
+    for band in raster_obj.prepare_bands_(image_bands(self.img), self.mode):
+      self.rows.extend(raster_obj.encode_band_lines_(
+          band, self.inverted, self.extents))
+
+  def dirty_rows(self, regions):
+    """Sorted, merged (top, bottom) row ranges touched by regions."""
+    # Halftoned bands start on a row of the Bayer matrix.
+    align = halftone.BAYER_SIZE
+    ranges = []
+    for region in regions:
+      left, top, right, bottom = region.box
+      top = max(0, top - top % align)
+      bottom = min(self.img.height, bottom)
+      if top >= bottom or right <= 0 or left >= self.img.width:
+        continue
+      ranges.append((top, bottom))
+    merged = []
+    for top, bottom in sorted(ranges):
+      if merged and top <= merged[-1][1]:
+        merged[-1] = (merged[-1][0], max(merged[-1][1], bottom))
+      else:
+        merged.append((top, bottom))
+    return merged
+
+  def encode_record(self, output_file, regions):
+    """Encode one page, the template with regions drawn over it.
+
+    The page is the same as a full encode of the composited image.
+    """
+    for region in regions:
+      region.prepare(self.raster, self.img.mode)
+
+    header_start = output_file.tell()
+    self.raster.encode_page_header_(output_file)
+    image_box = ImageBox()
+    y = 0
+    for top, bottom in self.dirty_rows(regions):
+      self.write_rows_(output_file, y, top, image_box)
+      band = self.img.crop((0, top, self.img.width, bottom))
+      for region in regions:
+        region.draw(band, top)
+      for prepared in self.raster.prepare_bands_([band], self.mode):
+        for line in self.raster.encode_band_lines_(
+            prepared, self.inverted, image_box):
+          output_file.write('\x00')
+          output_file.write(line)
+      y = bottom
+    self.write_rows_(output_file, y, self.img.height, image_box)
+
+    # As in Raster.encode_page_bands_, the header goes again with the box.
+    body_end = output_file.tell()
+    self.raster.set_image_box_(image_box)
+    output_file.seek(header_start)
+    self.raster.encode_page_header_(output_file)
+    output_file.seek(body_end)
+
+  def write_rows_(self, output_file, start, end, image_box):
+    for y in xrange(start, end):
+      output_file.write('\x00')
+      output_file.write(self.rows[y])
+      image_box.add_row(*self.extents.rows[y])
+
+
+def parse_region(values):
+  """A region from its JSON description."""
+  position = (values['x'], values['y'])
+  if 'image' in values:
+    return ImageRegion(Image.open(values['image']), position)
+  font = None
+  if 'font' in values:
+    font = ImageFont.truetype(values['font'], values.get('size', 24))
+  return TextRegion(values['text'], position, font, values.get('fill', 'black'))
+
+
+def encode_records(
+    template_file,
+    output_file,
+    records,
+    resolutions=DEFAULT_RESOLUTIONS,
+    halftone_method=None,
+    ):
+  """Encode one page per record, each a list of regions, over a template."""
+  raster_obj = Raster.create_best_raster(output_file)
+  if raster_obj is None:
+    raise ValueError('Unrecognised output format')
+  raster_obj.resolutions = resolutions
+  raster_obj.halftone = halftone_method
+  raster_obj.load_img(template_file)
+  # One file header for all the pages.
+  raster_obj.pages = raster_obj.total_page_count = len(records)
+
+  template = Template(raster_obj)
+  with open(output_file, 'wb') as output:
+    raster_obj.write_file_header_(output, len(records))
+    for regions in records:
+      template.encode_record(output, regions)
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(
+      description='Print records over a static template page.')
+
+  parser.add_argument('template', help='Background image')
+  parser.add_argument(
+      'records',
+      help='JSON list of records, each a list of regions like '
+      '{"text": "Jane Doe", "x": 100, "y": 200} or '
+      '{"image": "logo.png", "x": 100, "y": 200}')
+  parser.add_argument('output', help='Output file')
+  parser.add_argument('--halftone', choices=['ordered'])
+
+  args = parser.parse_args()
+
+  with open(args.records) as records_file:
+    records = [
+        [parse_region(region) for region in record]
+        for record in json.load(records_file)]
+
+  start = time.time()
+  try:
+    encode_records(
+        args.template, args.output, records, halftone_method=args.halftone)
+  except ValueError as error:
+    exit(str(error))
+  print('{} pages in {:.2f}s'.format(len(records), time.time() - start))
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import StringIO
+import tempfile
+import unittest
+
+from PIL import Image
+from PIL import ImageDraw
+
+import vdp
+from raster import PWG
+from raster import URF
+
+
+def background(path):
+  img = Image.new('RGB', (200, 300), 'white')
+  draw = ImageDraw.Draw(img)
+  draw.rectangle((20, 20, 180, 60), fill=(40, 80, 160))
+  draw.rectangle((20, 250, 100, 280), fill=(200, 200, 200))
+  img.save(path, dpi=(300, 300))
+
+
+def records():
+  logo = Image.new('RGB', (30, 20), (250, 0, 0))
+  return [
+      [vdp.TextRegion('Jane Doe', (30, 100))],
+      [vdp.TextRegion('John Smith', (30, 100)),
+       vdp.ImageRegion(logo, (150, 95)),
+       vdp.TextRegion('Account 42', (30, 255))],
+      [],
+      ]
+
+
+class TestVdp(unittest.TestCase):
+
+  def setUp(self):
+    self.tmp_dir = tempfile.mkdtemp()
+    self.template_path = os.path.join(self.tmp_dir, 'template.png')
+    background(self.template_path)
+
+  def tearDown(self):
+    shutil.rmtree(self.tmp_dir)
+
+  def assert_records_encode_whole(self, raster_obj):
+    raster_obj.load_img(self.template_path)
+    template = vdp.Template(raster_obj)
+    for regions in records():
+      record = StringIO.StringIO()
+      template.encode_record(record, regions)
+
+      composite = template.img.copy()
+      for region in regions:
+        region.draw(composite, 0)
+      whole = StringIO.StringIO()
+      raster_obj.encode_page_(whole, composite, raster_obj.colorspace_str)
+      self.assertEqual(record.getvalue(), whole.getvalue())
+
+  def test_encode_record(self):
+    self.assert_records_encode_whole(PWG())
+    self.assert_records_encode_whole(URF())
+
+  def test_encode_record_halftone(self):
+    for raster_obj in (PWG(), URF()):
+      raster_obj.halftone = 'ordered'
+      self.assert_records_encode_whole(raster_obj)
+
+  def test_diffusion(self):
+    raster_obj = PWG()
+    raster_obj.halftone = 'diffusion'
+    raster_obj.load_img(self.template_path)
+    with self.assertRaises(ValueError):
+      vdp.Template(raster_obj)
+
+  def test_encode_records(self):
+    for name, raster_class in (('out.pwg', PWG), ('out.urf', URF)):
+      output_path = os.path.join(self.tmp_dir, name)
+      vdp.encode_records(self.template_path, output_path, records())
+      raster_obj = raster_class()
+      pages = list(raster_obj.read_pages_(open(output_path, 'rb').read()))
+      self.assertEqual(len(pages), 3)
+      self.assertEqual(raster_obj.page_info_()['total_page_count'], 3)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+
+import os.path
+import struct
+import zlib
+
+from PIL import Image
+from PIL import ImageChops
+
+
+PNG_SIGNATURE = '\x89PNG\r\n\x1a\n'
+
+# PIL mode: (PNG bit depth, color type).
+PNG_MODES = {
+  '1': (1, 0),
+  'L': (8, 0),
+  'RGB': (8, 2),
+}
+
+# Row filter types [PNG] 9.2.
+PNG_FILTER_NONE = '\x00'
+PNG_FILTER_UP = '\x02'
+
+# Compressed bytes per IDAT chunk.
+IDAT_SIZE = 64 * 1024
+
+# PIL mode: (magic number, has a maximum value).
+PNM_MODES = {
+  '1': ('P4', False),
+  'L': ('P5', True),
+  'RGB': ('P6', True),
+}
+# Modes of the files of each extension, by the mode of the source.
+PNM_EXTENSION_MODES = {
+  '.pbm': {'1': '1', 'L': '1', 'RGB': '1'},
+  '.pgm': {'1': 'L', 'L': 'L', 'RGB': 'L'},
+  '.ppm': {'1': 'RGB', 'L': 'RGB', 'RGB': 'RGB'},
+  '.pnm': {'1': '1', 'L': 'L', 'RGB': 'RGB'},
+}
+
+# PBM bits are ink, PIL "1" bits are light.
+INVERT_TABLE = ''.join(chr(255 - i) for i in range(256))
+
+
+def png_chunk(chunk_type, data):
+  return ''.join([
+      struct.pack('>I', len(data)),
+      chunk_type,
+      data,
+      struct.pack('>I', zlib.crc32(chunk_type + data) & 0xFFFFFFFF),
+  ])
+
+
+class PNGWriter:
+  """PNG file written a band of rows at a time.
+
+  Rows are filtered with the row above (Up), which turns the repeated rows
+  of printed pages into zeros, and deflated straight into IDAT chunks.
+  """
+
+  def __init__(self, output_file, mode, size, dpi=None, level=6):
+    self.output_file = output_file
+    self.mode = mode
+    self.width, self.height = size
+    self.rows = 0
+    self.compressor = zlib.compressobj(level)
+    self.pending = []
+    self.pending_size = 0
+    # Filtered against, zeros above the first row.
+    self.previous = Image.new(mode, (self.width, 1), 0)
+
+    bit_depth, color_type = PNG_MODES[mode]
+    output_file.write(PNG_SIGNATURE)
+    output_file.write(png_chunk('IHDR', struct.pack(
+        '>IIBBBBB', self.width, self.height, bit_depth, color_type, 0, 0, 0)))
+    if dpi:
+      output_file.write(png_chunk('pHYs', struct.pack(
+          '>IIB',
+          int(round(dpi[0] / 0.0254)),
+          int(round(dpi[1] / 0.0254)),
+          1))) # per meter
+
+  def write_band(self, band):
+    width, height = band.size
+    if self.mode == '1':
+      # Packed bits, filters only pay off on whole bytes.
+      filter_type = PNG_FILTER_NONE
+      data = band.tobytes()
+    else:
+      filter_type = PNG_FILTER_UP
+      above = Image.new(self.mode, band.size)
+      above.paste(self.previous, (0, 0))
+      above.paste(band.crop((0, 0, width, height - 1)), (0, 1))
+      data = ImageChops.subtract_modulo(band, above).tobytes()
+      self.previous = band.crop((0, height - 1, width, height))
+
+    stride = len(data) // height
+    self.write_data(self.compressor.compress(''.join(
+        filter_type + data[y * stride:(y + 1) * stride]
+        for y in xrange(height))))
+    self.rows += height
+
+  def write_data(self, data, flush=False):
+    self.pending.append(data)
+    self.pending_size += len(data)
+    if self.pending_size >= IDAT_SIZE or flush:
+      self.output_file.write(png_chunk('IDAT', ''.join(self.pending)))
+      self.pending = []
+      self.pending_size = 0
+
+  def close(self):
+    if self.rows != self.height:
+      raise ValueError('{} of {} rows written'.format(self.rows, self.height))
+    self.write_data(self.compressor.flush(), flush=True)
+    self.output_file.write(png_chunk('IEND', ''))
+
+
+class PNMWriter:
+  """Netpbm PBM, PGM or PPM file written a band of rows at a time."""
+
+  def __init__(self, output_file, mode, size, dpi=None):
+    self.output_file = output_file
+    self.mode = mode
+    self.height = size[1]
+    self.rows = 0
+    magic, has_maxval = PNM_MODES[mode]
+    output_file.write('{}\n{} {}\n'.format(magic, *size))
+    if has_maxval:
+      output_file.write('255\n')
+
+  def write_band(self, band):
+    data = band.tobytes()
+    if self.mode == '1':
+      data = data.translate(INVERT_TABLE)
+    self.output_file.write(data)
+    self.rows += band.height
+
+  def close(self):
+    if self.rows != self.height:
+      raise ValueError('{} of {} rows written'.format(self.rows, self.height))
+
+
+def writer_mode(output_path, mode):
+  """Mode a file written to output_path holds pixels of a PIL mode in.
+
+  None when there's no writer for the file extension.
+  """
+  extension = os.path.splitext(output_path)[1].lower()
+  # Neither PNG nor Netpbm hold CMYK.
+  if mode not in PNG_MODES:
+    mode = 'RGB'
+  if extension == '.png':
+    return mode
+  if extension in PNM_EXTENSION_MODES:
+    return PNM_EXTENSION_MODES[extension][mode]
+  return None
+
+
+def open_writer(output_file, output_path, mode, size, dpi=None):
+  """Writer of the file format of output_path, see writer_mode."""
+  if output_path.lower().endswith('.png'):
+    return PNGWriter(output_file, mode, size, dpi)
+  return PNMWriter(output_file, mode, size, dpi)
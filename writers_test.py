@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+
+import StringIO
+import unittest
+
+from PIL import Image
+from PIL import ImageDraw
+
+import writers
+
+
+def page(mode, size=(67, 50)):
+  img = Image.new(mode, size, 'white')
+  draw = ImageDraw.Draw(img)
+  draw.rectangle((5, 3, 40, 30), fill='black')
+  draw.line((0, 49, 66, 0), fill='gray' if mode != '1' else 'black')
+  return img
+
+
+def write_bands(writer_class, img, band_rows=16, **kwargs):
+  output = StringIO.StringIO()
+  writer = writer_class(output, img.mode, img.size, **kwargs)
+  for top in range(0, img.height, band_rows):
+    writer.write_band(
+        img.crop((0, top, img.width, min(top + band_rows, img.height))))
+  writer.close()
+  output.seek(0)
+  return output
+
+
+class TestWriters(unittest.TestCase):
+
+  def test_png(self):
+    for mode in ('1', 'L', 'RGB'):
+      img = page(mode)
+      output = write_bands(writers.PNGWriter, img, dpi=(300, 300))
+      decoded = Image.open(output)
+      self.assertEqual(decoded.mode, mode)
+      self.assertEqual(decoded.tobytes(), img.tobytes())
+      self.assertEqual(
+          [int(round(dpi)) for dpi in decoded.info['dpi']], [300, 300])
+
+  def test_pnm(self):
+    for mode in ('1', 'L', 'RGB'):
+      img = page(mode)
+      decoded = Image.open(write_bands(writers.PNMWriter, img))
+      self.assertEqual(decoded.mode, mode)
+      self.assertEqual(decoded.tobytes(), img.tobytes())
+
+  def test_short(self):
+    output = StringIO.StringIO()
+    writer = writers.PNGWriter(output, 'L', (10, 10))
+    writer.write_band(Image.new('L', (10, 5)))
+    with self.assertRaises(ValueError):
+      writer.close()
+
+  def test_writer_mode(self):
+    self.assertEqual(writers.writer_mode('a.png', 'CMYK'), 'RGB')
+    self.assertEqual(writers.writer_mode('a.PNG', '1'), '1')
+    self.assertEqual(writers.writer_mode('a.pgm', 'RGB'), 'L')
+    self.assertEqual(writers.writer_mode('a.pnm', 'L'), 'L')
+    self.assertIsNone(writers.writer_mode('a.jpg', 'RGB'))
+
+
+if __name__ == '__main__':
+  unittest.main()